@@ -1,6 +1,12 @@
+import asyncio
+import math
+import os
 import sys
 import typing as t
-from datetime import datetime
+from collections import Counter
+from datetime import datetime, timezone
+from functools import partial
+from pathlib import Path
 
 import aiohttp
 import discord
@@ -8,7 +14,15 @@ from discord.ext.commands import AutoShardedBot
 from loguru import logger
 
 from bot import config
+from bot.core.admission import AdmissionControl
 from bot.core.aiml_skill import AIMLSkill
+from bot.core.batching import MessageBatcher
+from bot.core.cluster import ClusterLink, Snapshot
+from bot.core.metrics import MetricsServer
+from bot.core.outbox import Outbox
+from bot.core.sessions import MemorySessionStore, SQLiteSessionStore
+from bot.core.tenants import TenantRouter
+from bot.core.transcripts import TranscriptWriter
 
 # -- Logger configuration --
 logger.configure(
@@ -36,6 +50,8 @@ class Bot(AutoShardedBot):
         # -- Bot info --
         self.cluster = kwargs.get("cluster_id")
         self.cluster_count = kwargs.get("cluster_count")
+        # Set by `python -m bot.launcher`, for the stats of the other clusters.
+        self.cluster_link: t.Optional[ClusterLink] = kwargs.get("cluster_link")
         self.version = kwargs.get("version")
 
         # -- Start time config --
@@ -43,7 +59,54 @@ class Bot(AutoShardedBot):
         self.last_reset_time = datetime.now()
 
         # -- AIML conf --
-        self.aiml_kernel = AIMLSkill("./bot/aiml")
+        # The launcher loads the brain once, before forking the clusters.
+        self.aiml_kernel = kwargs.get("aiml_kernel") or self.load_aiml_skill(
+            cluster=self.cluster
+        )
+        self.tenants = TenantRouter(channel_name, self.aiml_kernel.tenant_names)
+        self.admission = AdmissionControl(
+            user_rate=config.admission_user_rate,
+            user_burst=config.admission_user_burst,
+            channel_rate=config.admission_channel_rate,
+            channel_burst=config.admission_channel_burst,
+            max_pending=config.admission_max_pending,
+            shed_response=config.admission_shed_response,
+        )
+        self.message_batcher = MessageBatcher(
+            self.aiml_kernel,
+            window=config.aiml_batch_window,
+            max_size=config.aiml_batch_size,
+        )
+        self.outbox = Outbox(
+            config.outbound_rate,
+            config.outbound_period,
+            self.aiml_kernel.timings,
+        )
+        # Messages in the channel, by whether they were answered, shed or dropped.
+        self.message_stats = Counter()
+
+        # -- Transcripts config --
+        self.transcripts = None
+        if config.transcript_path:
+            transcript_path = config.transcript_path
+            if self.cluster is not None:
+                transcript_path = os.path.join(
+                    transcript_path, f"cluster-{self.cluster}"
+                )
+            self.transcripts = TranscriptWriter(
+                transcript_path,
+                max_queue=config.transcript_queue_size,
+                flush_interval=config.transcript_flush_interval,
+                segment_size=config.transcript_segment_size,
+                keep=config.transcript_keep,
+            )
+
+        # -- Metrics config --
+        self.metrics = None
+        if config.metrics_port:
+            self.metrics = MetricsServer(
+                self, config.metrics_host, config.metrics_port + (self.cluster or 0)
+            )
 
         # -- Sessions config --
         self.session = None
@@ -51,6 +114,92 @@ class Bot(AutoShardedBot):
         # -- Startup config --
         self.initial_call = True
 
+    @classmethod
+    def load_aiml_skill(
+        cls,
+        worker_processes: int = config.aiml_worker_processes,
+        cluster: t.Optional[int] = None,
+    ) -> AIMLSkill:
+        """Load the AIML brain as configured, for `cluster` if set."""
+        return AIMLSkill(
+            config.aiml_path,
+            brain_snapshot=config.brain_snapshot,
+            compile_workers=config.aiml_compile_workers,
+            shadow_plan=config.aiml_shadow_plan,
+            lazy_manifest=config.aiml_lazy_manifest,
+            lazy_idle=config.aiml_lazy_idle,
+            tenants_path=config.aiml_tenants_path,
+            tenant_idle=config.aiml_tenant_idle,
+            max_tenants=config.aiml_max_tenants,
+            inference_workers=config.aiml_inference_workers,
+            inference_queue_depth=config.aiml_inference_queue_depth,
+            worker_processes=worker_processes,
+            session_store=cls.session_store(cluster),
+            history_length=config.aiml_history_length,
+            response_cache_size=config.aiml_response_cache_size,
+            matcher=config.aiml_matcher,
+            collapse_redirects=config.aiml_collapse_redirects,
+            ignored_characters=config.aiml_ignored_characters,
+        )
+
+    @staticmethod
+    def session_store(
+        cluster: t.Optional[int] = None,
+    ) -> t.Callable[[], MemorySessionStore]:
+        """
+        Get the factory for the AIML session store from the config. Every
+        cluster keeps its sessions in a database of its own, as their users
+        and resets are their own too.
+        """
+        if config.aiml_session_db:
+            path = Path(config.aiml_session_db)
+            if cluster is not None:
+                path = path.with_name(f"{path.stem}-cluster-{cluster}{path.suffix}")
+            return partial(
+                SQLiteSessionStore,
+                str(path),
+                flush_interval=config.aiml_session_flush_interval,
+                max_sessions=config.aiml_max_sessions,
+                ttl=config.aiml_session_ttl,
+            )
+
+        return partial(
+            MemorySessionStore,
+            max_sessions=config.aiml_max_sessions,
+            ttl=config.aiml_session_ttl,
+        )
+
+    def cluster_snapshot(self) -> Snapshot:
+        """What this cluster tells the others about itself."""
+        return {
+            "pid": os.getpid(),
+            "started": self.start_time.replace(tzinfo=timezone.utc).timestamp(),
+            "guilds": len(self.guilds),
+            "members": sum(guild.member_count or 0 for guild in self.guilds),
+            # Not connected yet, or lost, while the latency isn't finite.
+            "shards": {
+                shard_id: shard.latency if math.isfinite(shard.latency) else None
+                for shard_id, shard in self.shards.items()
+            },
+            "messages": dict(self.message_stats),
+        }
+
+    async def report_cluster_stats(self) -> None:
+        """Trade stats with the other clusters until the launcher goes away."""
+        await self.wait_until_ready()
+
+        while not self.is_closed():
+            try:
+                await self.loop.run_in_executor(
+                    None, self.cluster_link.exchange, self.cluster_snapshot()
+                )
+            except (EOFError, OSError):
+                logger.critical("Lost the connection to the launcher, shutting down")
+                await self.close()
+                return
+
+            await asyncio.sleep(config.cluster_stats_interval)
+
     async def is_owner(self, user: discord.User) -> bool:
         if user.id in config.devs:
             return True
@@ -91,6 +240,10 @@ class Bot(AutoShardedBot):
     async def start(self, *args, **kwargs) -> None:
         """Starts the bot."""
         self.session = aiohttp.ClientSession()
+        if self.metrics is not None:
+            self.metrics.start()
+        if self.cluster_link is not None:
+            self.loop.create_task(self.report_cluster_stats())
 
         await super().start(*args, **kwargs)
 
@@ -101,4 +254,12 @@ class Bot(AutoShardedBot):
         if hasattr(self, "session"):
             await self.session.close()
 
+        await self.message_batcher.drain()
+        await self.outbox.drain()
+        if self.metrics is not None:
+            self.metrics.stop()
+        self.aiml_kernel.close()
+        if self.transcripts is not None:
+            self.transcripts.close()
+
         await super().close()
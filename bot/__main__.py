@@ -9,20 +9,26 @@ CHANNEL_NAME = os.getenv("CHANNEL_NAME")
 
 PREFIX = config.COMMAND_PREFIX
 
-intents = discord.Intents.all()
-intents.presences = False
-
-bot = Bot(
-    version="0.0.1",
-    channel_name=CHANNEL_NAME,
-    command_prefix=PREFIX,
-    intents=intents,
-    activity=discord.Game(name=f"Talk with me in #{CHANNEL_NAME} :)"),
-    case_insensitive=True,
-    owner_ids=config.devs,
-    heartbeat_timeout=150.0,
-)
+
+def create_bot(**kwargs) -> Bot:
+    """Create the bot, with `kwargs` on top of the usual options."""
+    intents = discord.Intents.all()
+    intents.presences = False
+
+    return Bot(
+        version="0.0.1",
+        channel_name=CHANNEL_NAME,
+        command_prefix=PREFIX,
+        intents=intents,
+        activity=discord.Game(name=f"Talk with me in #{CHANNEL_NAME} :)"),
+        case_insensitive=True,
+        owner_ids=config.devs,
+        heartbeat_timeout=150.0,
+        **kwargs,
+    )
+
 
 # -- Run when this file is invoked --
 if __name__ == "__main__":
+    bot = create_bot()
     bot.run(TOKEN)
@@ -0,0 +1,300 @@
+"""
+Benchmark the AIML hot path and print the results as JSON.
+
+Runs without Discord or network access:
+
+- cold start: the corpus parsed from scratch, as a whole and per
+  subdirectory, each in a fresh process,
+- latency: turns of conversations generated from the corpus, one by one
+  through `AIMLSkill.process_step`,
+- throughput: batches through `AIMLSkill.__call__` over many sessions,
+- peak RSS of every process involved.
+
+    python -m bot.bench [--replay FILE] [--output FILE] [--skip-cold] ...
+"""
+
+import argparse
+import json
+import multiprocessing
+import platform
+import resource
+import subprocess
+import sys
+import time
+import typing as t
+from datetime import datetime, timezone
+from pathlib import Path
+
+from loguru import logger
+
+from bot import config
+from bot.bench.workload import (
+    Replay,
+    TimedOut,
+    UtteranceGenerator,
+    Workload,
+    context,
+    converse,
+    deadline,
+)
+from bot.core.aiml_skill import AIMLSkill
+
+
+def peak_rss(who: int = resource.RUSAGE_SELF) -> int:
+    """Peak resident set size in bytes (`ru_maxrss` is in KiB on Linux)."""
+    peak = resource.getrusage(who).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def percentiles(samples: t.Sequence[float]) -> t.Optional[t.Dict[str, float]]:
+    """Summary of durations in seconds, in microseconds."""
+    if not samples:
+        return None
+
+    ordered = sorted(samples)
+
+    def rank(fraction: float) -> float:
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1e6
+
+    return {
+        "mean": sum(ordered) / len(ordered) * 1e6,
+        "p50": rank(0.5),
+        "p90": rank(0.9),
+        "p99": rank(0.99),
+        "p999": rank(0.999),
+        "max": ordered[-1] * 1e6,
+    }
+
+
+def git_commit() -> t.Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# -- Cold start --
+def _cold_load(path: Path, compile_workers: int) -> t.Dict[str, t.Any]:
+    start = time.perf_counter()
+    skill = AIMLSkill(
+        str(path),
+        compile_workers=compile_workers,
+        inference_workers=1,
+        response_cache_size=config.aiml_response_cache_size,
+        matcher=config.aiml_matcher,
+        collapse_redirects=config.aiml_collapse_redirects,
+    )
+    startup_time = time.perf_counter() - start
+
+    result = {
+        "path": str(path),
+        "files": len(skill.load_timings),
+        "categories": skill.kernel.numCategories(),
+        "load_seconds": skill.load_time,
+        "startup_seconds": startup_time,
+        "peak_rss_bytes": peak_rss(),
+    }
+    skill.close()
+
+    return result
+
+
+def _child_main(connection: t.Any, func: t.Callable, args: tuple) -> None:
+    connection.send(func(*args))
+    connection.close()
+
+
+def in_fresh_process(func: t.Callable, *args: t.Any) -> t.Any:
+    """Run `func(*args)` in a forked process, so it starts from a small heap."""
+    context = multiprocessing.get_context("fork")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_child_main, args=(sender, func, args))
+    process.start()
+    sender.close()
+
+    try:
+        return receiver.recv()
+    finally:
+        process.join()
+
+
+def cold_start(path: Path, compile_workers: int) -> t.List[t.Dict[str, t.Any]]:
+    """Parse the whole corpus, then each subdirectory of it, without a snapshot."""
+    directories = [path] + sorted(child for child in path.iterdir() if child.is_dir())
+
+    results = []
+    for directory in directories:
+        logger.info(f"Cold loading {directory}")
+        results.append(in_fresh_process(_cold_load, directory, compile_workers))
+
+    return results
+
+
+# -- Hot path --
+# Turns that miss their deadline are counted and left out of the results, and
+# their categories out of the rest of the workload (see `bot.bench.workload`).
+def warm_up(
+    skill: AIMLSkill, workload: Workload, count: int, timeout: float
+) -> t.Dict[str, int]:
+    """Run `count` turns first, which also finds most of the slow categories."""
+    timed_out = sum(
+        elapsed is None for _, elapsed in converse(skill, workload, count, timeout)
+    )
+
+    return {"turns": count, "timed_out": timed_out}
+
+
+def latency(
+    skill: AIMLSkill, workload: Workload, count: int, timeout: float
+) -> t.Dict[str, t.Any]:
+    samples = []
+    timed_out = 0
+
+    for _, elapsed in converse(skill, workload, count, timeout):
+        if elapsed is None:
+            timed_out += 1
+        else:
+            samples.append(elapsed)
+
+    return {
+        "utterances": len(samples),
+        "timed_out": timed_out,
+        "latency_us": percentiles(samples),
+    }
+
+
+def throughput(
+    skill: AIMLSkill,
+    workload: Workload,
+    batch_size: int,
+    duration: float,
+    timeout: float,
+) -> t.Dict[str, t.Any]:
+    """Batches through `__call__` for `duration` seconds, over many sessions."""
+    batch_times = []
+    timed_out = 0
+
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        turns = [workload.next_turn() for _ in range(batch_size)]
+        try:
+            with deadline(timeout * batch_size):
+                start = time.perf_counter()
+                skill(
+                    [text for _, text in turns],
+                    [{"user_id": session} for session, _ in turns],
+                )
+                elapsed = time.perf_counter() - start
+        except TimedOut:
+            # Which turn was slow is unknown, so the whole batch is left out.
+            for session, _ in turns:
+                skill.reset_session(session)
+                workload.exclude(session)
+            timed_out += 1
+        else:
+            batch_times.append(elapsed)
+            for session in {session for session, _ in turns}:
+                workload.answered(session, *context(skill, session))
+
+    # Only the time spent on batches that were answered counts.
+    busy = sum(batch_times)
+    return {
+        "batch_size": batch_size,
+        "batches": len(batch_times),
+        "timed_out_batches": timed_out,
+        "utterances": len(batch_times) * batch_size,
+        "utterances_per_second": len(batch_times) * batch_size / busy if busy else 0,
+        "batch_latency_us": percentiles(batch_times),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--replay", help="file of logged inputs or recorded turns, or transcripts"
+    )
+    parser.add_argument("--output", help="write the JSON here instead of stdout")
+    parser.add_argument(
+        "--count", type=int, default=5000, help="warm-up and latency turns"
+    )
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+    parser.add_argument("--timeout", type=float, default=0.25, help="per utterance")
+    parser.add_argument("--compile-workers", type=int, default=0)
+    parser.add_argument("--skip-cold", action="store_true", help="no cold starts")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # Keep stdout for the results.
+    logger.configure(handlers=[dict(sink=sys.stderr, level="ERROR")])
+
+    path = Path(config.aiml_path).expanduser().resolve()
+    report: t.Dict[str, t.Any] = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            key: value
+            for key, value in vars(args).items()
+            if key not in {"output", "skip_cold"}
+        },
+    }
+
+    # Before the brain is loaded here, so the children fork from a small heap.
+    if not args.skip_cold:
+        report["cold_start"] = cold_start(path, args.compile_workers)
+
+    start = time.perf_counter()
+    skill = AIMLSkill(
+        str(path),
+        brain_snapshot=config.brain_snapshot,
+        inference_workers=1,
+        response_cache_size=config.aiml_response_cache_size,
+        matcher=config.aiml_matcher,
+        collapse_redirects=config.aiml_collapse_redirects,
+        ignored_characters=config.aiml_ignored_characters,
+    )
+    report["startup_seconds"] = time.perf_counter() - start
+
+    workload: Workload
+    if args.replay:
+        workload = Replay.from_file(args.replay, args.sessions, args.seed)
+    else:
+        workload = UtteranceGenerator.for_skill(
+            skill, seed=args.seed, sessions=args.sessions
+        )
+
+    try:
+        report["warm_up"] = warm_up(skill, workload, args.count, args.timeout)
+        report["latency"] = latency(skill, workload, args.count, args.timeout)
+        report["throughput"] = throughput(
+            skill, workload, args.batch_size, args.duration, args.timeout
+        )
+        report["workload"] = {"excluded": len(workload.excluded)}
+        report["cache"] = skill.cache_stats()
+    finally:
+        skill.close()
+
+    report["peak_rss_bytes"] = peak_rss()
+    # The largest of the cold start processes.
+    report["peak_child_rss_bytes"] = peak_rss(resource.RUSAGE_CHILDREN)
+
+    results = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(results + "\n", encoding="utf-8")
+    else:
+        print(results)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
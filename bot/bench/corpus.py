@@ -0,0 +1,149 @@
+"""
+Find the categories of the AIML corpus that other files replace.
+
+Files are loaded in sorted order and a category defined again by a later
+file replaces the earlier one, so everything but the last definition is
+parsed for nothing. This reports, file by file, how many of its categories
+are shadowed and by which files, and can write a plan for the skill to
+leave them out of the next load (see `AIMLSkill(shadow_plan=...)`).
+
+With `--lazy`, it also works out which categories of the matching topic
+files only inputs of their own can reach, and can write a manifest for
+the skill to load those on demand (see `AIMLSkill(lazy_manifest=...)`).
+
+    python -m bot.bench.corpus [--workers N] [--conflicts N] [--write-plan FILE]
+        [--lazy GLOB ...] [--write-manifest FILE]
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+from bot import config
+from bot.core.compiler import CategoryKey, corpus_files
+from bot.core.corpus import analyze, plan_lazy, save_plan
+from bot.core.lazy import save_manifest
+from bot.core.snapshot import corpus_digest
+
+
+def _format_key(key: CategoryKey) -> str:
+    pattern, that, topic = key
+    text = pattern
+    if that != "*":
+        text += f" <that>{that}</that>"
+    if topic != "*":
+        text += f" <topic>{topic}</topic>"
+    return text
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--workers", type=int, default=config.aiml_compile_workers)
+    parser.add_argument(
+        "--conflicts", type=int, default=10, help="Conflicting categories to list"
+    )
+    parser.add_argument(
+        "--write-plan",
+        metavar="FILE",
+        help="Write the plan to skip shadowed categories",
+    )
+    parser.add_argument(
+        "--lazy",
+        metavar="GLOB",
+        action="append",
+        default=[],
+        help="Topic files to load on demand, relative to the corpus",
+    )
+    parser.add_argument(
+        "--write-manifest",
+        metavar="FILE",
+        help="Write the manifest of what the --lazy files can load on demand",
+    )
+    args = parser.parse_args()
+    if args.write_manifest and not args.lazy:
+        parser.error("--write-manifest needs at least one --lazy file")
+
+    root = Path(config.aiml_path).expanduser().resolve()
+    files = corpus_files(root)
+
+    start = time.perf_counter()
+    report = analyze(files, args.workers)
+    elapsed = time.perf_counter() - start
+
+    identical = sum(file.identical for file in report.files)
+    print(
+        f"Files:      {len(files)}, parsed in {elapsed:.2f}s "
+        f"({sum(file.parse_time for file in report.files):.2f}s of parsing)"
+    )
+    print(
+        f"Categories: {report.categories}, of which {report.shadowed} are shadowed "
+        f"({identical} identical, {report.shadowed - identical} conflicting)"
+    )
+
+    print("\nShadowed categories by file:")
+    for file in sorted(report.files, key=lambda file: -len(file.shadowed)):
+        if not file.shadowed:
+            continue
+
+        winners = ", ".join(
+            f"{winner.relative_to(root)} ({count})"
+            for winner, count in file.shadowed_by.most_common(3)
+        )
+        if len(file.shadowed_by) > 3:
+            winners += f" and {len(file.shadowed_by) - 3} more"
+        print(
+            f"  {file.path.relative_to(root)}: {len(file.shadowed)} of "
+            f"{file.categories}{' (all)' if file.fully_shadowed else ''}, "
+            f"{file.identical} identical, lose to {winners}"
+        )
+
+    conflicts = [overlap for overlap in report.overlaps if not overlap.identical]
+    if conflicts and args.conflicts:
+        print(f"\nConflicting categories ({len(conflicts)}, the last file wins):")
+        for overlap in conflicts[: args.conflicts]:
+            chain = " < ".join(str(path.relative_to(root)) for path in overlap.files)
+            print(f"  {_format_key(overlap.key)!r}: {chain}")
+
+    lazy_files = {}
+    if args.lazy:
+        lazy = {
+            path
+            for path in files
+            if any(path.relative_to(root).match(glob) for glob in args.lazy)
+        }
+        lazy_files = plan_lazy(report, lazy)
+
+        print(f"\nLoaded on demand ({len(lazy)} files matched):")
+        for path in sorted(lazy):
+            file = lazy_files.get(path)
+            if file is None:
+                print(
+                    f"  {path.relative_to(root)}: nothing, no pattern leads off the rest"
+                )
+            else:
+                print(
+                    f"  {path.relative_to(root)}: {len(file.categories)} of "
+                    f"{len(file.categories) + file.eager} categories "
+                    f"below {len(file.grafts)} grafts"
+                )
+        print(
+            f"  In all {sum(len(file.categories) for file in lazy_files.values())} "
+            f"of {report.categories} categories"
+        )
+
+    if args.write_plan:
+        plan_path = Path(args.write_plan)
+        save_plan(report, root, plan_path, corpus_digest(root, files))
+        print(f"\nShadow plan written to {plan_path}")
+
+    if args.write_manifest:
+        manifest_path = Path(args.write_manifest)
+        save_manifest(lazy_files, root, manifest_path, corpus_digest(root, files))
+        print(f"\nLazy manifest written to {manifest_path}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
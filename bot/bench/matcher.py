@@ -0,0 +1,117 @@
+"""
+Compare the fast pattern matcher against the stock one on a replay workload.
+
+Every input is matched by both, which must agree on the template and on the
+matched pattern (which `<star/>` relies on), then each is timed on its own.
+
+    python -m bot.bench.matcher [--replay FILE] [--count N] [--seed N]
+"""
+
+import argparse
+import random
+import sys
+import time
+import typing as t
+
+from aiml.PatternMgr import PatternMgr
+
+from bot import config
+from bot.bench.workload import Replay, UtteranceGenerator
+from bot.core.aiml_skill import AIMLSkill
+from bot.core.matcher import FastPatternMgr
+
+# Mutually exclusive `<that>`s to replay the workload under. The last one has
+# no words left once punctuation is stripped, which stock AIML matches nothing with.
+THATS = ["", "YES", "WHAT IS YOUR NAME", "DO YOU LIKE MOVIES", "..."]
+
+Case = t.Tuple[str, str, str]
+
+
+def check(stock: PatternMgr, fast: FastPatternMgr, cases: t.Sequence[Case]) -> int:
+    """Count the cases on which the two matchers disagree, printing the first few."""
+    mismatches = 0
+
+    for pattern, that, topic in cases:
+        words, that_words, topic_words = (
+            pattern.upper().split(),
+            (that or "ULTRABOGUSDUMMYTHAT").upper().split(),
+            (topic or "ULTRABOGUSDUMMYTOPIC").upper().split(),
+        )
+        expected = stock._match(words, that_words, topic_words, stock._root)
+        result = fast._match(words, that_words, topic_words, fast._root)
+
+        if (
+            expected[0] != result[0]
+            or expected[1] != result[1]
+            or stock.match(pattern, that, topic) != fast.match(pattern, that, topic)
+        ):
+            mismatches += 1
+            if mismatches <= 5:
+                print(f"Mismatch on {pattern!r} (that {that!r}, topic {topic!r})")
+
+    return mismatches
+
+
+def timed(matcher: PatternMgr, cases: t.Sequence[Case], rounds: int) -> float:
+    """Best time per match over `rounds` runs of the workload, in seconds."""
+    best = float("inf")
+
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for pattern, that, topic in cases:
+            matcher.match(pattern, that, topic)
+        best = min(best, time.perf_counter() - start)
+
+    return best / len(cases)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--replay", help="file of logged inputs or recorded turns")
+    parser.add_argument("--count", type=int, default=5000, help="synthetic inputs")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    # The stock matcher unfolds the default contexts of its trie, so it gets
+    # a copy of its own, and the two can only compare templates by value.
+    skill, stock_skill = (
+        AIMLSkill(
+            config.aiml_path,
+            brain_snapshot=config.brain_snapshot,
+            response_cache_size=0,
+            matcher=matcher,
+        )
+        for matcher in ("fast", "stock")
+    )
+    kernel = skill.kernel
+    fast = kernel._brain
+    stock = stock_skill.kernel._brain
+
+    rng = random.Random(args.seed)
+    if args.replay:
+        inputs = [text for _, text in Replay.from_file(args.replay, 1).turns]
+    else:
+        generator = UtteranceGenerator.for_skill(skill, seed=args.seed, zipf=0)
+        inputs = [generator.utterance() for _ in range(args.count)]
+
+    normal = kernel._subbers["normal"]
+    cases = [(normal.sub(text), rng.choice(THATS), "") for text in inputs]
+
+    mismatches = check(stock, fast, cases)
+    stock_time = timed(stock, cases, args.rounds)
+    fast_time = timed(fast, cases, args.rounds)
+    skill.close()
+    stock_skill.close()
+
+    print(f"Inputs:     {len(cases)} ({len(fast.exact)} patterns in the exact index)")
+    print(f"Mismatches: {mismatches}")
+    print(f"Stock:      {stock_time * 1e6:.1f}us per match")
+    print(f"Fast:       {fast_time * 1e6:.1f}us per match")
+    print(f"Speedup:    {stock_time / fast_time:.2f}x")
+
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,145 @@
+"""
+Compare the single-pass input normalizer against the chain it replaces.
+
+Before matching, a message used to go through the cog's character filter,
+python-aiml's sentence split, the `normal` substitutions of every sentence
+and the matcher's own punctuation strip. Both must produce the same
+sentences, then each is timed on long pasted messages.
+
+    python -m bot.bench.normalize [--count N] [--length N] [--seed N]
+"""
+
+import argparse
+import random
+import re
+import sys
+import time
+import typing as t
+
+from aiml import Utils
+from aiml.WordSub import WordSub
+
+from bot import config
+from bot.core.aiml_skill import AIMLSkill
+from bot.core.normalize import Normalizer
+
+Sentences = t.List[t.Tuple[str, str, t.Tuple[str, ...]]]
+
+# What people paste: prose, code, links, mentions and contractions.
+FRAGMENTS = [
+    "I wanna know what you think about this.",
+    "we're gonna need a bigger boat!",
+    "Can't you see (it's obvious)?",
+    "check https://example.com/some/path?query=1 for details.",
+    '<@711194921683648523> said "hello there"...',
+    "def f(x):\n    return x * 2",
+    "it cannot be that hard, isn't it?",
+    "C:\\Users\\someone\\Desktop",
+    "OK.",
+    "what's your name, bot",
+    "I'd like 2.5 apples & 3 oranges; thanks!!",
+]
+
+
+def pasted_messages(count: int, length: int, rng: random.Random) -> t.List[str]:
+    """Messages of about `length` characters stitched from random fragments."""
+    messages = []
+    for _ in range(count):
+        parts, size = [], 0
+        while size < length:
+            fragment = rng.choice(FRAGMENTS)
+            parts.append(fragment)
+            size += len(fragment) + 1
+        messages.append(rng.choice([" ", "\n", "  "]).join(parts))
+
+    return messages
+
+
+def chained(
+    text: str, ignored_characters: str, normal: WordSub, punctuation: t.Pattern
+) -> Sentences:
+    """The normalization as the cog and python-aiml used to do it, step by step."""
+    for character in ignored_characters:
+        text = text.replace(character, "")
+    if not text:
+        return []
+
+    sentences = []
+    for sentence in Utils.sentences(text):
+        subbed = normal.sub(sentence)
+        words = tuple(re.sub(punctuation, " ", subbed.upper()).split())
+        sentences.append((sentence, subbed, words))
+
+    return sentences
+
+
+def single_pass(text: str, normalizer: Normalizer) -> Sentences:
+    return [
+        (sentence.text, sentence.subbed, sentence.words)
+        for sentence in normalizer.normalize(text)
+    ]
+
+
+def timed(
+    normalize: t.Callable[[str], t.Any], messages: t.Sequence[str], rounds: int
+) -> float:
+    """Best time per message over `rounds` runs, in seconds."""
+    best = float("inf")
+
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for message in messages:
+            normalize(message)
+        best = min(best, time.perf_counter() - start)
+
+    return best / len(messages)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--count", type=int, default=500, help="messages")
+    parser.add_argument("--length", type=int, default=2000, help="characters each")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    skill = AIMLSkill(
+        config.aiml_path,
+        brain_snapshot=config.brain_snapshot,
+        response_cache_size=0,
+        collapse_redirects=False,
+        ignored_characters=config.aiml_ignored_characters,
+    )
+    normal = skill.kernel._subbers["normal"]
+    normalizer = skill.kernel.normalizer
+    punctuation = skill.kernel._brain._puncStripRE
+    skill.close()
+
+    messages = pasted_messages(args.count, args.length, random.Random(args.seed))
+    ignored = config.aiml_ignored_characters
+
+    mismatches = 0
+    for message in messages:
+        if chained(message, ignored, normal, punctuation) != single_pass(
+            message, normalizer
+        ):
+            mismatches += 1
+            if mismatches <= 5:
+                print(f"Mismatch on {message[:60]!r}...")
+
+    chained_time = timed(
+        lambda text: chained(text, ignored, normal, punctuation), messages, args.rounds
+    )
+    single_time = timed(normalizer.normalize, messages, args.rounds)
+
+    print(f"Messages:    {len(messages)} of about {args.length} characters")
+    print(f"Mismatches:  {mismatches}")
+    print(f"Chained:     {chained_time * 1e6:.1f}us per message")
+    print(f"Single pass: {single_time * 1e6:.1f}us per message")
+    print(f"Speedup:     {chained_time / single_time:.2f}x")
+
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,413 @@
+"""
+Generate conversations that exercise the categories of the loaded corpus.
+
+Inputs are built from the patterns of the brain, with wildcards filled in
+with words of other patterns, so they reach real categories instead of the
+catch-alls. Openings are drawn with skewed (Zipf) weights like real traffic,
+and once the bot answered, a session may follow up with an input of a
+category whose `<that>` and topic match the answer, the way games and
+questions continue a conversation.
+
+Answers are needed to pick follow-ups, so the turns are sent to the kernel
+as they're generated and written out as JSON lines.
+
+    python -m bot.bench.workload [--count N] [--sessions N] [--seed N] [--output FILE]
+"""
+
+import argparse
+import bisect
+import contextlib
+import gzip
+import itertools
+import json
+import os
+import random
+import signal
+import sys
+import time
+import typing as t
+
+from aiml.PatternMgr import PatternMgr
+from aiml.WordSub import WordSub
+from loguru import logger
+
+from bot.core.kernel import ContextTrackingPatternMgr
+from bot.core.transcripts import transcript_segments
+
+# A session ID and what the user says in it.
+Turn = t.Tuple[str, str]
+
+
+class Category(t.NamedTuple):
+    """The keys of a category's path in the trie, wildcards included."""
+
+    pattern: t.Tuple[t.Any, ...]
+    that: t.Tuple[t.Any, ...]
+    topic: t.Tuple[t.Any, ...]
+
+
+_DEFAULT_CONTEXT = (PatternMgr._STAR,)
+
+
+def categories(root: dict) -> t.List[Category]:
+    """Every category of a pattern trie, in a stable order."""
+    found = []
+    # Node, keys so far at its level, and the pattern and `<that>` above it.
+    stack: t.List[t.Tuple[dict, tuple, t.Optional[tuple], t.Optional[tuple]]] = [
+        (root, (), None, None)
+    ]
+
+    while stack:
+        node, keys, pattern, that = stack.pop()
+        for key, child in node.items():
+            if key == PatternMgr._TEMPLATE:
+                found.append(Category(pattern, that, keys))
+            elif key == ContextTrackingPatternMgr._DEFAULT_CONTEXT:
+                found.append(Category(keys, _DEFAULT_CONTEXT, _DEFAULT_CONTEXT))
+            elif key == PatternMgr._THAT:
+                stack.append((child, (), keys, None))
+            elif key == PatternMgr._TOPIC:
+                stack.append((child, (), pattern, keys))
+            else:
+                stack.append((child, keys + (key,), pattern, that))
+
+    found.sort(key=lambda category: tuple(map(str, itertools.chain(*category))))
+    return found
+
+
+def _pattern_text(keys: t.Sequence[t.Any]) -> str:
+    names = {PatternMgr._STAR: "*", PatternMgr._UNDERSCORE: "_"}
+    return " ".join(names.get(key, key) for key in keys)
+
+
+class UtteranceGenerator:
+    """
+    A seeded stream of turns over `sessions` concurrent sessions.
+
+    Call `answered` with the bot's answer after each turn, so the session
+    can follow up on it. Sessions run scripts of up to `max_turns` turns,
+    taking a matching follow-up with probability `follow_up` and starting
+    over with a new opening otherwise.
+    """
+
+    def __init__(
+        self,
+        root: dict,
+        seed: int = 0,
+        sessions: int = 100,
+        zipf: float = 1.0,
+        follow_up: float = 0.8,
+        max_turns: int = 8,
+        bot_name: str = "Nameless",
+        normal: t.Optional[WordSub] = None,
+    ) -> None:
+        self.rng = random.Random(seed)
+        self.follow_up = follow_up
+        self.max_turns = max_turns
+        self.bot_name = bot_name
+        self.normal = normal
+
+        self.categories = categories(root)
+        self.vocabulary = sorted(
+            {
+                key.lower()
+                for category in self.categories
+                for key in category.pattern
+                if isinstance(key, str)
+            }
+        )
+
+        # Openings are the categories without a context, ranked at random.
+        self.openings = [
+            index
+            for index, category in enumerate(self.categories)
+            if category.that == _DEFAULT_CONTEXT and category.topic == _DEFAULT_CONTEXT
+        ]
+        self.rng.shuffle(self.openings)
+        self._cumulative = list(
+            itertools.accumulate(
+                1 / (rank**zipf) for rank in range(1, len(self.openings) + 1)
+            )
+        )
+
+        # Answers are matched against the `<that>` and topic of the rest.
+        self._follow_ups = PatternMgr()
+        follow_ups: t.Dict[t.Tuple[str, str], t.List[int]] = {}
+        for index, category in enumerate(self.categories):
+            if category.that == _DEFAULT_CONTEXT and category.topic == _DEFAULT_CONTEXT:
+                continue
+
+            key = (_pattern_text(category.that), _pattern_text(category.topic))
+            if key not in follow_ups:
+                follow_ups[key] = []
+                self._follow_ups.add((key[0], "*", key[1]), follow_ups[key])
+            follow_ups[key].append(index)
+
+        self.excluded: t.Set[int] = set()
+
+        self._session_ids = [f"load-{slot}" for slot in range(sessions)]
+        # Per session: turns into the current script, the category of the
+        # last turn and whether the bot's answer to it came in.
+        self._scripts: t.Dict[str, t.List[t.Any]] = {
+            session: [0, None, True] for session in self._session_ids
+        }
+        self._answers: t.Dict[str, t.Tuple[str, str]] = {}
+
+    @classmethod
+    def for_skill(cls, skill: t.Any, **kwargs: t.Any) -> "UtteranceGenerator":
+        """A generator over the brain of an in-process `AIMLSkill`."""
+        kernel = skill.kernel
+        return cls(
+            kernel._brain._root,
+            bot_name=kernel._brain._botName,
+            normal=kernel._subbers["normal"],
+            **kwargs,
+        )
+
+    def utterance(self, index: t.Optional[int] = None) -> str:
+        """An input for the category at `index`, or for a weighted opening."""
+        if index is None:
+            index = self._opening()
+
+        words = []
+        for key in self.categories[index].pattern:
+            if key in (PatternMgr._STAR, PatternMgr._UNDERSCORE):
+                words += self.rng.choices(self.vocabulary, k=self.rng.randint(1, 3))
+            elif key == PatternMgr._BOT_NAME:
+                words.append(self.bot_name)
+            else:
+                words.append(key.lower())
+
+        return " ".join(words)
+
+    def _opening(self) -> int:
+        while True:
+            rank = bisect.bisect(
+                self._cumulative, self.rng.random() * self._cumulative[-1]
+            )
+            index = self.openings[min(rank, len(self.openings) - 1)]
+            if index not in self.excluded:
+                return index
+
+    def _follow_up(self, session: str) -> t.Optional[int]:
+        that, topic = self._answers.pop(session, ("", ""))
+        if self.normal is not None:
+            that, topic = self.normal.sub(that), self.normal.sub(topic)
+
+        candidates = self._follow_ups.match(that, "", topic) if that else None
+        if not candidates:
+            return None
+
+        candidates = [index for index in candidates if index not in self.excluded]
+        return self.rng.choice(candidates) if candidates else None
+
+    def next_turn(self) -> Turn:
+        session = self.rng.choice(self._session_ids)
+        script = self._scripts[session]
+        turns, _, answered = script
+
+        index = None
+        if answered and 0 < turns < self.max_turns:
+            if self.rng.random() < self.follow_up:
+                index = self._follow_up(session)
+        if index is None:
+            index = self._opening()
+            turns = 0
+
+        script[:] = [turns + 1, index, False]
+        return session, self.utterance(index)
+
+    def answered(self, session: str, that: str, topic: str) -> None:
+        """The bot's last answer in `session` and the session's topic."""
+        script = self._scripts.get(session)
+        if script is not None:
+            script[2] = True
+            self._answers[session] = (that, topic)
+
+    def exclude(self, session: str) -> None:
+        """Leave out the category of the last turn of `session` from now on."""
+        script = self._scripts.get(session)
+        if script is not None and script[1] is not None:
+            self.excluded.add(script[1])
+            script[:] = [0, None, True]
+
+
+class Replay:
+    """Turns read back from a file, with the same interface as the generator."""
+
+    def __init__(self, turns: t.Sequence[Turn]) -> None:
+        self.turns = list(turns)
+        self.excluded: t.Set[str] = set()
+
+        self._position = 0
+        self._last: t.Dict[str, str] = {}
+
+    @classmethod
+    def from_file(cls, path: str, sessions: int, seed: int = 0) -> "Replay":
+        """
+        Read JSON lines as written by this module, or plain lines of text,
+        which are spread over `sessions` sessions at random.
+
+        The transcripts of `bot.core.transcripts` are read too, a segment or
+        a directory of them, with each user of a guild in a session.
+        """
+        rng = random.Random(seed)
+        paths = transcript_segments(path) if os.path.isdir(path) else [path]
+        turns = []
+        for path in paths:
+            opener = gzip.open if str(path).endswith(".gz") else open
+            with opener(path, "rt", encoding="utf-8") as file:
+                for line in file:
+                    line = line.strip()
+                    if line.startswith("{"):
+                        turn = json.loads(line)
+                        if "input" in turn:
+                            session = f"{turn['guild']}-{turn['user']}"
+                            turns.append((session, turn["input"]))
+                        else:
+                            turns.append((turn["session"], turn["text"]))
+                    elif line:
+                        turns.append((f"replay-{rng.randrange(sessions)}", line))
+
+        return cls(turns)
+
+    def next_turn(self) -> Turn:
+        for _ in range(len(self.turns)):
+            session, text = self.turns[self._position]
+            self._position = (self._position + 1) % len(self.turns)
+            if text not in self.excluded:
+                self._last[session] = text
+                return session, text
+
+        raise ValueError("Every turn of the replay was excluded")
+
+    def answered(self, session: str, that: str, topic: str) -> None:
+        pass
+
+    def exclude(self, session: str) -> None:
+        if session in self._last:
+            self.excluded.add(self._last[session])
+
+
+Workload = t.Union[UtteranceGenerator, Replay]
+
+
+# -- Driving a kernel --
+# Some categories of the corpus `<srai>` into each other so often, depending
+# on the session's predicates, that stock AIML takes minutes to give up on
+# them. Every turn gets a deadline instead, and the categories of the ones
+# that miss it are left out of the workload from then on.
+class TimedOut(Exception):
+    pass
+
+
+def _time_out(*_: t.Any) -> None:
+    raise TimedOut
+
+
+@contextlib.contextmanager
+def deadline(seconds: float) -> t.Iterator[None]:
+    """Raise `TimedOut` in the main thread once `seconds` have passed."""
+    previous = signal.signal(signal.SIGALRM, _time_out)
+    # python-aiml has a few bare `except:`s, which can swallow the first one.
+    signal.setitimer(signal.ITIMER_REAL, seconds, 0.01)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+    if time.perf_counter() - start >= seconds:
+        raise TimedOut
+
+
+def context(skill: t.Any, session: str) -> t.Tuple[str, str]:
+    """The last answer of the in-process kernel in `session`, and the topic."""
+    kernel = skill.kernel
+    answers = kernel.getPredicate(kernel._outputHistory, session)
+
+    return (answers[-1] if answers else ""), kernel.getPredicate("topic", session)
+
+
+def converse(
+    skill: t.Any, workload: Workload, count: int, timeout: float
+) -> t.Iterator[t.Tuple[Turn, t.Optional[float]]]:
+    """
+    Send `count` turns of `workload` to the skill one by one, yielding each
+    with the seconds it took, or None if it missed the deadline.
+    """
+    for _ in range(count):
+        session, text = turn = workload.next_turn()
+        try:
+            with deadline(timeout):
+                start = time.perf_counter()
+                skill.process_step(text, session)
+                elapsed = time.perf_counter() - start
+        except TimedOut:
+            # The interrupted session is left halfway through the input.
+            skill.reset_session(session)
+            workload.exclude(session)
+            yield turn, None
+        else:
+            workload.answered(session, *context(skill, session))
+            yield turn, elapsed
+
+
+def main() -> int:
+    from bot import config
+    from bot.core.aiml_skill import AIMLSkill
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", help="write the turns here instead of stdout")
+    parser.add_argument("--count", type=int, default=10000, help="turns")
+    parser.add_argument("--sessions", type=int, default=100)
+    parser.add_argument("--zipf", type=float, default=1.0, help="0 for uniform")
+    parser.add_argument("--follow-up", type=float, default=0.8)
+    parser.add_argument("--max-turns", type=int, default=8)
+    parser.add_argument("--timeout", type=float, default=0.25, help="per turn")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logger.configure(handlers=[dict(sink=sys.stderr, level="ERROR")])
+
+    skill = AIMLSkill(
+        config.aiml_path,
+        brain_snapshot=config.brain_snapshot,
+        matcher=config.aiml_matcher,
+        collapse_redirects=config.aiml_collapse_redirects,
+        ignored_characters=config.aiml_ignored_characters,
+    )
+    generator = UtteranceGenerator.for_skill(
+        skill,
+        seed=args.seed,
+        sessions=args.sessions,
+        zipf=args.zipf,
+        follow_up=args.follow_up,
+        max_turns=args.max_turns,
+    )
+
+    output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    written = 0
+    try:
+        for (session, text), elapsed in converse(
+            skill, generator, args.count, args.timeout
+        ):
+            if elapsed is not None:
+                output.write(json.dumps({"session": session, "text": text}) + "\n")
+                written += 1
+    finally:
+        skill.close()
+        if output is not sys.stdout:
+            output.close()
+
+    print(
+        f"Wrote {written} turns, left out {len(generator.excluded)} categories "
+        "that took too long",
+        file=sys.stderr,
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,5 @@
 import io
+import math
 import os
 import platform
 import textwrap
@@ -193,6 +194,68 @@ class Sudo(*STANDARD_FEATURES, *OPTIONAL_FEATURES, Cog):
             )
         )
 
+    @staticmethod
+    def format_duration(seconds: t.Optional[float]) -> str:
+        if seconds is None:
+            return "-"
+        if seconds < 1e-3:
+            return f"{seconds * 1e6:.0f}µs"
+        if seconds < 1:
+            return f"{seconds * 1e3:.1f}ms"
+        return f"{seconds:.2f}s"
+
+    @sudo.command()
+    async def perf(self, ctx: Context, action: t.Optional[str] = None) -> None:
+        """
+        Show latency percentiles of every stage of answering a message.
+
+        `perf reset` - Start the histograms over
+        """
+        aiml_skill = self.bot.aiml_kernel
+
+        if action == "reset":
+            await self.bot.loop.run_in_executor(None, aiml_skill.reset_stage_timings)
+            await ctx.message.add_reaction("✅")
+            return
+        if action is not None:
+            await ctx.send("Invalid action, only `reset` is supported!")
+            return
+
+        timings = await self.bot.loop.run_in_executor(None, aiml_skill.stage_timings)
+
+        rows = [("Stage", "Count", "p50", "p95", "p99", "Max")]
+        for stage, summary in timings.summary().items():
+            if stage == "srai_depth":
+                values = [
+                    "-" if summary[key] is None else f"{summary[key]:.0f}"
+                    for key in ("p50", "p95", "p99", "max")
+                ]
+            else:
+                values = [
+                    self.format_duration(summary[key])
+                    for key in ("p50", "p95", "p99", "max")
+                ]
+            rows.append((stage, str(summary["count"]), *values))
+
+        widths = [
+            max(len(row[column]) for row in rows) for column in range(len(rows[0]))
+        ]
+        table = "\n".join(
+            "  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip()
+            for row in rows
+        )
+
+        since = humanize.naturaltime(
+            datetime.now() - datetime.fromtimestamp(timings.since)
+        )
+        await ctx.send(
+            embed=Embed(
+                title="Message latency",
+                description=f"Since {since}:\n```\n{table}\n```",
+                color=Color.blue(),
+            )
+        )
+
     @sudo.command()
     async def stats(self, ctx: Context) -> None:
         """Show full bot stats."""
@@ -223,6 +286,67 @@ class Sudo(*STANDARD_FEATURES, *OPTIONAL_FEATURES, Cog):
         embed.add_field(name="**❯ System**", value=system, inline=False)
         embed.add_field(name="**❯ Shard info**", value=shard_info, inline=False)
 
+        if self.bot.cluster_link is not None:
+            clusters = self.bot.cluster_link.clusters.values()
+            answered = sum(
+                cluster.get("messages", {}).get("answered", 0) for cluster in clusters
+            )
+            cluster_info = textwrap.dedent(
+                f"""
+                • Current cluster: **`{self.bot.cluster}`** of **`{self.bot.cluster_count}`**
+                • Clusters up: **`{sum(cluster["alive"] for cluster in clusters)}`** (**`{sum(cluster["restarts"] for cluster in clusters)}`** restarts)
+                • Servers: **`{sum(cluster.get("guilds", 0) for cluster in clusters)}`**
+                • Members: **`{sum(cluster.get("members", 0) for cluster in clusters)}`**
+                • Messages answered: **`{answered}`**
+                """
+            )
+            embed.add_field(
+                name="**❯ Cluster info** (all clusters)", value=cluster_info, inline=False
+            )
+
+        aiml_skill = self.bot.aiml_kernel
+        sessions = await self.bot.loop.run_in_executor(None, aiml_skill.session_stats)
+        cache = await self.bot.loop.run_in_executor(None, aiml_skill.cache_stats)
+        memory = await self.bot.loop.run_in_executor(None, aiml_skill.memory_stats)
+        lazy = await self.bot.loop.run_in_executor(None, aiml_skill.lazy_stats)
+        tenants = await self.bot.loop.run_in_executor(None, aiml_skill.tenant_stats)
+        routes = self.bot.tenants.stats()
+        batches = self.bot.message_batcher.stats()
+        outbox = self.bot.outbox.stats()
+        admission = self.bot.admission.stats()
+        aiml_info = textwrap.dedent(
+            f"""
+            • Categories: **`{aiml_skill.num_categories()}`**
+            • Live sessions: **`{sessions["sessions"]}`**
+            • Evicted sessions: **`{sessions.get("evictions", 0)}`** (LRU) / **`{sessions.get("expirations", 0)}`** (idle)
+            • Response cache: **`{cache["cache_hits"]}`** hits / **`{cache["cache_misses"]}`** misses (**`{cache["cached"]}`** cached)
+            • Shed messages: **`{admission["shed_user_rate"]}`** (user) / **`{admission["shed_channel_rate"]}`** (channel) / **`{admission["shed_overloaded"]}`** (overload)
+            • Message batches: **`{batches["batches"]}`** (**`{batches["batched_messages"]}`** messages)
+            • Replies sent: **`{outbox["outbound_replies"]}`** in **`{outbox["outbound_messages"]}`** messages (**`{outbox["outbound_queued"]}`** queued)
+            • Memory: **`{humanize.naturalsize(memory["trie"])}`** trie / **`{humanize.naturalsize(memory["templates"])}`** templates / **`{humanize.naturalsize(memory["sessions"])}`** sessions
+            """
+        )
+        if self.bot.transcripts is not None:
+            transcripts = self.bot.transcripts.stats()
+            aiml_info += (
+                f"• Transcripts: **`{transcripts['transcript_records']}`** written "
+                f"(**`{transcripts['transcript_dropped']}`** dropped / **`{transcripts['transcript_failed']}`** failed)\n"
+            )
+        if aiml_skill.lazy_files:
+            aiml_info += (
+                f"• Lazy topics: **`{lazy.get('lazy_loaded', 0)}`** loaded "
+                f"(**`{lazy.get('lazy_loads', 0)}`** loads / **`{lazy.get('lazy_unloads', 0)}`** unloads) "
+                f"of **`{len(aiml_skill.lazy_files)}`** files"
+            )
+        if aiml_skill.tenants_path:
+            aiml_info += (
+                f"• Tenants: **`{tenants.get('tenants_loaded', 0)}`** loaded "
+                f"(**`{tenants.get('tenant_loads', 0)}`** loads / **`{tenants.get('tenant_unloads', 0)}`** unloads) "
+                f"of **`{len(aiml_skill.tenant_names())}`**, "
+                f"in **`{routes['listening_channels']}`** channels"
+            )
+        embed.add_field(name="**❯ AIML info**", value=aiml_info, inline=False)
+
         process = psutil.Process()
         with process.oneshot():
             memory_usage = process.memory_full_info().uss / 1024 ** 2
@@ -270,9 +394,19 @@ class Sudo(*STANDARD_FEATURES, *OPTIONAL_FEATURES, Cog):
 
         await ctx.send(embed=embed)
 
+    @staticmethod
+    def format_latency(latency: t.Optional[float]) -> str:
+        if latency is None or not math.isfinite(latency):
+            return "-"
+        return f"{round(latency * 1000)}ms"
+
     @sudo.command()
     async def shards(self, ctx: Context) -> None:
         """Get the shard info about the bot."""
+        if self.bot.cluster_link is not None:
+            await self.cluster_shards(ctx)
+            return
+
         shard_info = ""
 
         for key, item in self.bot.shards.items():
@@ -295,6 +429,33 @@ class Sudo(*STANDARD_FEATURES, *OPTIONAL_FEATURES, Cog):
             )
         )
 
+    async def cluster_shards(self, ctx: Context) -> None:
+        """The shards of every cluster, as they last reported them."""
+        cluster_info = ""
+
+        for cluster_id, cluster in sorted(self.bot.cluster_link.clusters.items()):
+            status = "up" if cluster["alive"] else "down"
+            cluster_info += (
+                f"**`[Cluster {cluster_id}]`** {status}, "
+                f"pid `{cluster.get('pid', '-')}`, "
+                f"`{cluster['restarts']}` restarts\n"
+            )
+            for shard_id, latency in sorted(cluster.get("shards", {}).items()):
+                cluster_info += (
+                    f"Shard `{shard_id}`: **`{self.format_latency(latency)}`**\n"
+                )
+
+        await ctx.send(
+            embed=Embed(
+                title="Cluster info",
+                description=(
+                    f"Current cluster: `{self.bot.cluster}` (shards `{self.bot.shard_ids}`)\n"
+                    f"Shard count: `{self.bot.shard_count}`\n\n" + cluster_info
+                ),
+                color=Color.blue(),
+            )
+        )
+
     @staticmethod
     def cleanup_code(content: str) -> str:
         """Automatically removes code blocks from the code."""
@@ -1,9 +1,14 @@
+import time
 from datetime import datetime
 
 import discord
 from discord.ext.commands import Cog, command, cooldown, BucketType
 from loguru import logger
 
+from bot.core.admission import Verdict
+from bot.core.aiml_skill import ReloadInProgress
+from bot.core.inference import InferenceQueueFull
+
 
 class Main(Cog):
     def __init__(self, bot) -> None:
@@ -11,26 +16,80 @@ class Main(Cog):
 
     @Cog.listener("on_message")
     async def on_message_handle(self, message):
-        if message.author.bot or str(message.channel) != self.bot.channel_name:
+        if message.author.bot:
+            return
+
+        route = self.bot.tenants.route(message.channel)
+        if not route.listening:
             return
 
         if message.content is None:
             logger.error("Empty message received!")
             return
 
-        text = message.content
-        for character in ["/", "'", ".", "\\", "(", ")", '"', "\n", "@", "<", ">"]:
-            text = text.replace(character, "")
+        self.bot.message_stats["received"] += 1
+        admission = self.bot.admission
+        verdict = admission.admit(message.author.id, message.channel.id)
+        if verdict is not Verdict.ADMITTED:
+            self.bot.message_stats["shed"] += 1
+            if verdict is Verdict.OVERLOADED and admission.shed_response:
+                await self.bot.outbox.send(
+                    message.channel,
+                    f"`{message.author.name}`: {admission.shed_response}",
+                )
+            return
+
+        try:
+            await self._answer(message, route.tenant)
+        finally:
+            admission.release()
 
-        response = self.bot.aiml_kernel([text], [{"user_id": message.author.id}])
-        response = response[0][0].replace("://", "").replace("@", "")
+    @Cog.listener()
+    async def on_guild_channel_update(self, before, after) -> None:
+        if before.name != after.name:
+            self.bot.tenants.forget(after.id)
+
+    @Cog.listener()
+    async def on_guild_channel_delete(self, channel) -> None:
+        self.bot.tenants.forget(channel.id)
+
+    async def _answer(self, message, tenant) -> None:
+        timings = self.bot.aiml_kernel.timings
+        start = time.perf_counter()
+
+        # The kernel drops the ignored characters along with the rest of its
+        # input normalization.
+        try:
+            response, _, patterns = await self.bot.message_batcher.respond(
+                message.content, message.author.id, tenant
+            )
+        except InferenceQueueFull as exc:
+            logger.warning(f"Dropping message from {message.author.id}: {exc}")
+            self.bot.message_stats["dropped"] += 1
+            return
+
+        sanitize_start = time.perf_counter()
+        response = response.replace("://", "").replace("@", "")
 
         response = f"`{message.author.name}`: {response}"
 
         if len(response) > 1800:
             response = response[0:1800]
 
-        await message.channel.send(response)
+        timings.observe("sanitize", time.perf_counter() - sanitize_start)
+
+        # Which times how long it waited to be sent, and the sending.
+        await self.bot.outbox.send(message.channel, response)
+
+        self.bot.message_stats["answered"] += 1
+        elapsed = time.perf_counter() - start
+        timings.observe("total", elapsed)
+
+        if self.bot.transcripts is not None:
+            guild = message.guild.id if message.guild is not None else None
+            self.bot.transcripts.record(
+                guild, message.author.id, message.content, patterns, elapsed
+            )
 
     @command()
     @cooldown(1, 600, BucketType.user)
@@ -38,13 +97,57 @@ class Main(Cog):
         now = datetime.now()
 
         self.bot.last_reset_time = now
-        await ctx.channel.send(
+        status = await ctx.channel.send(
             embed=discord.Embed(
                 description="Resetting info", color=discord.Color.green()
             )
         )
-        self.bot.aiml_kernel.kernel.resetBrain()
-        self.bot.aiml_kernel._load_scripts()
+
+        try:
+            categories, elapsed = await self.bot.aiml_kernel.areload()
+            # Tenants may have been added or removed along with the corpus.
+            self.bot.tenants.clear()
+        except ReloadInProgress:
+            await status.edit(
+                embed=discord.Embed(
+                    description="A reset is already in progress",
+                    color=discord.Color.red(),
+                )
+            )
+            return
+
+        await status.edit(
+            embed=discord.Embed(
+                description=f"Reset done, reloaded {categories} categories in {elapsed:.2f}s",
+                color=discord.Color.green(),
+            )
+        )
+
+    @command()
+    @cooldown(1, 30, BucketType.user)
+    async def forget(self, ctx) -> None:
+        """Make the bot forget your conversation with it."""
+        try:
+            # Messages still waiting for their batch would land in the new session.
+            await self.bot.message_batcher.drain()
+            await self.bot.aiml_kernel.areset_session(
+                ctx.author.id, self.bot.tenants.route(ctx.channel).tenant
+            )
+        except InferenceQueueFull:
+            await ctx.channel.send(
+                embed=discord.Embed(
+                    description="I'm too busy right now, try again in a moment",
+                    color=discord.Color.red(),
+                )
+            )
+            return
+
+        await ctx.channel.send(
+            embed=discord.Embed(
+                description=f"Forgot our conversation, `{ctx.author.name}`",
+                color=discord.Color.green(),
+            )
+        )
 
 
 def setup(bot) -> None:
@@ -15,3 +15,88 @@ log_format = (
     "<cyan>{name: <18}</cyan> | <level>{message}</level>"
 )
 log_file_size = "150 MB"
+
+# -- AIML configuration --
+aiml_path = "./bot/aiml"
+brain_snapshot = os.getenv("BRAIN_SNAPSHOT", "cache/brain.snapshot")
+aiml_compile_workers = int(os.getenv("AIML_COMPILE_WORKERS", 0))  # <= 1 parses serially
+# Written by `python -m bot.bench.corpus --write-plan`, to leave the categories
+# later files replace out of a load. Empty loads every category.
+aiml_shadow_plan = os.getenv("AIML_SHADOW_PLAN", "")
+# Written by `python -m bot.bench.corpus --lazy ... --write-manifest`, to load the
+# categories of those topic files once an input needs them. Empty loads them up front.
+aiml_lazy_manifest = os.getenv("AIML_LAZY_MANIFEST", "")
+aiml_lazy_idle = float(os.getenv("AIML_LAZY_IDLE", 30 * 60))  # Seconds before unloading
+# A directory of AIML directories named after guild IDs, whose categories the
+# bot answers those guilds with on top of the rest. Empty has every guild share
+# one brain. Turns the lazy manifest off.
+aiml_tenants_path = os.getenv("AIML_TENANTS_PATH", "")
+aiml_tenant_idle = float(os.getenv("AIML_TENANT_IDLE", 30 * 60))  # Seconds idle
+aiml_max_tenants = int(os.getenv("AIML_MAX_TENANTS", 16))  # Loaded at once, per process
+aiml_inference_workers = int(os.getenv("AIML_INFERENCE_WORKERS", 2))
+# Messages waiting to be answered or being answered, batched or not, beyond
+# which new ones are dropped.
+aiml_inference_queue_depth = int(os.getenv("AIML_INFERENCE_QUEUE_DEPTH", 100))
+# Messages are answered in batches of up to this many, collected for up to
+# the window (in seconds). A window of 0 answers every message on its own.
+aiml_batch_window = float(os.getenv("AIML_BATCH_WINDOW", 0.01))
+aiml_batch_size = int(os.getenv("AIML_BATCH_SIZE", 16))
+aiml_worker_processes = int(os.getenv("AIML_WORKER_PROCESSES", 0))  # 0 runs in-process
+aiml_max_sessions = int(os.getenv("AIML_MAX_SESSIONS", 10000))
+aiml_session_ttl = float(os.getenv("AIML_SESSION_TTL", 24 * 60 * 60))  # Seconds idle
+aiml_history_length = int(os.getenv("AIML_HISTORY_LENGTH", 10))
+aiml_matcher = os.getenv("AIML_MATCHER", "fast")  # "fast" or "stock"
+# Follow chains of `<srai>` redirect categories at load time, 0 turns it off.
+aiml_collapse_redirects = bool(int(os.getenv("AIML_COLLAPSE_REDIRECTS", 1)))
+# Dropped from messages before the bot answers them.
+aiml_ignored_characters = os.getenv("AIML_IGNORED_CHARACTERS", "/'.\\()\"\n@<>")
+# Responses of stateless categories to remember, 0 turns the cache off.
+aiml_response_cache_size = int(os.getenv("AIML_RESPONSE_CACHE_SIZE", 10000))
+# Sessions are kept in memory only if this is empty. Each cluster keeps its own,
+# in `<name>-cluster-<ID>.sqlite3` next to it.
+aiml_session_db = os.getenv("AIML_SESSION_DB", "cache/sessions.sqlite3")
+aiml_session_flush_interval = float(os.getenv("AIML_SESSION_FLUSH_INTERVAL", 5))
+# Replies are sent to a channel at most this many per period (in seconds), its
+# Discord rate limit, and merged into fewer messages while they pile up.
+outbound_rate = int(os.getenv("OUTBOUND_RATE", 5))
+outbound_period = float(os.getenv("OUTBOUND_PERIOD", 5))
+
+# -- Transcripts --
+# A directory to keep a transcript of every message answered in, as compressed
+# JSON lines that `python -m bot.bench --replay` reads. Empty turns it off.
+# Each cluster keeps its own in a `cluster-<ID>` directory in it.
+transcript_path = os.getenv("TRANSCRIPT_PATH", "")
+# Records waiting to be written, beyond which new ones are dropped.
+transcript_queue_size = int(os.getenv("TRANSCRIPT_QUEUE_SIZE", 10000))
+transcript_flush_interval = float(os.getenv("TRANSCRIPT_FLUSH_INTERVAL", 1))
+transcript_segment_size = int(os.getenv("TRANSCRIPT_SEGMENT_MB", 64)) * 2**20
+transcript_keep = int(os.getenv("TRANSCRIPT_KEEP", 0))  # Segments kept, 0 keeps all
+
+# -- Admission control --
+# Messages a user, and the whole channel, may send per second on average and
+# in a burst before the rest are ignored. A rate of 0 turns the limit off.
+admission_user_rate = float(os.getenv("ADMISSION_USER_RATE", 1))
+admission_user_burst = int(os.getenv("ADMISSION_USER_BURST", 5))
+admission_channel_rate = float(os.getenv("ADMISSION_CHANNEL_RATE", 20))
+admission_channel_burst = int(os.getenv("ADMISSION_CHANNEL_BURST", 40))
+# Messages being answered at once, beyond which new ones are shed, and what
+# they are answered with instead. Empty ignores them.
+admission_max_pending = int(os.getenv("ADMISSION_MAX_PENDING", 200))
+admission_shed_response = os.getenv("ADMISSION_SHED_RESPONSE", "")
+
+# -- Clusters --
+# Used by `python -m bot.launcher`, which runs the shards over this many
+# processes. 0 runs one per CPU core, but never more than there are shards.
+cluster_count = int(os.getenv("CLUSTER_COUNT", 0))
+shard_count = int(os.getenv("SHARD_COUNT", 0))  # 0 asks Discord for its recommendation
+# Seconds between the reports every cluster sends the launcher, and gets
+# those of the others back in, for `sudo stats` and `sudo shards`.
+cluster_stats_interval = float(os.getenv("CLUSTER_STATS_INTERVAL", 10))
+# Seconds before a crashed cluster is restarted, doubling while it keeps crashing.
+cluster_restart_delay = float(os.getenv("CLUSTER_RESTART_DELAY", 5))
+
+# -- Metrics configuration --
+# Prometheus metrics are served at http://<host>:<port>/metrics, 0 turns them off.
+# Each cluster serves its own, on the port after the previous cluster's.
+metrics_host = os.getenv("METRICS_HOST", "127.0.0.1")
+metrics_port = int(os.getenv("METRICS_PORT", 9110))
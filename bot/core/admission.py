@@ -0,0 +1,110 @@
+import collections
+import enum
+import time
+import typing as t
+
+from bot.core.utils import TokenBucket
+
+
+class Verdict(enum.Enum):
+    """What admission control decided about a message."""
+
+    ADMITTED = "admitted"
+    USER_RATE = "user_rate"  # Its author sent too many
+    CHANNEL_RATE = "channel_rate"  # Its channel got too many
+    OVERLOADED = "overloaded"  # Too many are being answered already
+
+
+class AdmissionControl:
+    """
+    Decide whether a message is answered, before it costs any work.
+
+    A message is shed if its author or its channel ran out of tokens in
+    their bucket, or if `max_pending` admitted messages are still being
+    answered. Only the last is a matter of load, which `shed_response`
+    (when set) is sent back for instead of ignoring the message, so those
+    are told to come back later while spam goes unanswered.
+
+    The buckets of up to `max_buckets` users and channels are kept, those
+    used least recently going first. Rates of 0 turn their limit off.
+    """
+
+    def __init__(
+        self,
+        user_rate: float = 1.0,
+        user_burst: int = 5,
+        channel_rate: float = 20.0,
+        channel_burst: int = 40,
+        max_pending: int = 200,
+        shed_response: str = "",
+        max_buckets: int = 10000,
+    ) -> None:
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.channel_rate = channel_rate
+        self.channel_burst = channel_burst
+        self.max_pending = max_pending
+        self.shed_response = shed_response
+        self.max_buckets = max_buckets
+
+        self.pending = 0
+        self.admitted = 0
+        self.shed: t.Counter[Verdict] = collections.Counter()
+
+        self._buckets: t.OrderedDict[t.Hashable, TokenBucket] = (
+            collections.OrderedDict()
+        )
+
+    def admit(self, user_id: t.Any, channel_id: t.Any) -> Verdict:
+        """
+        Decide on a message, counting it as pending if it is admitted. Each
+        admitted message has to be `release`d once it has been answered.
+        """
+        now = time.monotonic()
+
+        if self.pending >= self.max_pending:
+            verdict = Verdict.OVERLOADED
+        # The user's first, so a flood from one doesn't use up the channel's.
+        elif not self._take(("user", user_id), self.user_rate, self.user_burst, now):
+            verdict = Verdict.USER_RATE
+        elif not self._take(
+            ("channel", channel_id), self.channel_rate, self.channel_burst, now
+        ):
+            verdict = Verdict.CHANNEL_RATE
+        else:
+            self.pending += 1
+            self.admitted += 1
+            return Verdict.ADMITTED
+
+        self.shed[verdict] += 1
+        return verdict
+
+    def release(self) -> None:
+        """Stop counting an admitted message as pending."""
+        self.pending -= 1
+
+    def _take(self, key: t.Hashable, rate: float, burst: int, now: float) -> bool:
+        if rate <= 0:
+            return True
+
+        buckets = self._buckets
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(rate, burst, now)
+            if len(buckets) > self.max_buckets:
+                buckets.popitem(last=False)
+        else:
+            buckets.move_to_end(key)
+
+        return bucket.take(now)
+
+    def stats(self) -> t.Dict[str, int]:
+        return {
+            "admission_pending": self.pending,
+            "admission_admitted": self.admitted,
+            **{
+                f"shed_{verdict.value}": self.shed[verdict]
+                for verdict in Verdict
+                if verdict is not Verdict.ADMITTED
+            },
+        }
@@ -1,10 +1,29 @@
+import asyncio
+import collections
+import functools
+import threading
+import time
 import typing as t
 import uuid
 from pathlib import Path
 
-import aiml
 from loguru import logger
 
+from bot.core import compiler, corpus, lazy, snapshot
+from bot.core.inference import InferencePool
+from bot.core.kernel import CachingKernel
+from bot.core.matcher import MATCHERS
+from bot.core.normalize import Sentence
+from bot.core.perf import StageTimings
+from bot.core.redirects import collapse_redirects
+from bot.core.sessions import MemorySessionStore, SessionStore
+from bot.core.tenants import TenantOverlays, tenant_dirs
+from bot.core.workers import KernelWorkerPool
+
+
+class ReloadInProgress(Exception):
+    """Raised when a reload is requested while another one is still running."""
+
 
 class AIMLSkill:
     def __init__(
@@ -13,36 +32,521 @@ class AIMLSkill:
         positive_confidence: float = 0.7,
         null_response: str = "I don't know what to answer you",
         null_confidence: float = 0.3,
+        brain_snapshot: t.Optional[str] = None,
+        compile_workers: int = 0,
+        shadow_plan: t.Optional[str] = None,
+        lazy_manifest: t.Optional[str] = None,
+        lazy_idle: float = 30 * 60,
+        tenants_path: t.Optional[str] = None,
+        tenant_idle: float = 30 * 60,
+        max_tenants: int = 16,
+        inference_workers: int = 2,
+        inference_queue_depth: int = 100,
+        worker_processes: int = 0,
+        session_store: t.Optional[t.Callable[[], SessionStore]] = None,
+        history_length: int = 10,
+        response_cache_size: int = 10000,
+        matcher: str = "fast",
+        collapse_redirects: bool = True,
+        ignored_characters: str = "",
     ) -> None:
         self.path_to_aiml_scripts = Path(path_to_aiml_scripts).expanduser().resolve()
+        self.brain_snapshot = (
+            Path(brain_snapshot).expanduser().resolve() if brain_snapshot else None
+        )
+        self.compile_workers = compile_workers
+        self.shadow_plan = (
+            Path(shadow_plan).expanduser().resolve() if shadow_plan else None
+        )
+        self.lazy_manifest = (
+            Path(lazy_manifest).expanduser().resolve() if lazy_manifest else None
+        )
+        self.lazy_idle = lazy_idle
+        self.tenants_path = (
+            Path(tenants_path).expanduser().resolve() if tenants_path else None
+        )
+        self.tenant_idle = tenant_idle
+        self.max_tenants = max_tenants
+        if self.tenants_path and self.lazy_manifest:
+            # Grafting into the base trie would miss the nodes overlays copied.
+            logger.warning(
+                "AIML lazy topics don't go with tenants, loading every category up front"
+            )
+            self.lazy_manifest = None
+        # What the manifest leaves to load on demand, as of the last `_load_scripts`.
+        self.lazy_files: t.Dict[Path, lazy.LazyFile] = {}
+        self.load_timings: t.List[compiler.FileTiming] = []
+        self.load_time = 0.0  # Seconds the last `_load_scripts` took
 
         self.positive_confidence = positive_confidence
         self.null_confidence = null_confidence
         self.null_response = null_response
 
-        self.kernel = aiml.Kernel()
-        self.kernel._verboseMode = False
+        self.session_store = session_store or MemorySessionStore
+        self.history_length = history_length
+        self.response_cache_size = response_cache_size
+        self.matcher = MATCHERS[matcher]
+        self.collapse_redirects = collapse_redirects
+        self.ignored_characters = ignored_characters
+        # Shared by every kernel, so they outlive reloads.
+        self.timings = StageTimings()
+
+        self.inference = InferencePool(inference_workers, inference_queue_depth)
+        self._reload_lock = threading.Lock()
 
-        self._load_scripts()
+        self.kernel = self._new_kernel()
+        # What `rebuild_kernel` reported of the brain the zygote of the workers
+        # loaded on the last reload, which this process doesn't load itself.
+        self._zygote_brain: t.Optional[t.Dict[str, int]] = None
+
+        self.workers = None
+        if worker_processes > 0:
+            self.start_workers(worker_processes)
 
         logger.info("AIML kernel initialized!")
 
-    def _load_scripts(self) -> None:
-        all_files = sorted(self.path_to_aiml_scripts.rglob("*.*"))
-        learned_files = []
+    def use_session_store(self, session_store: t.Callable[[], SessionStore]) -> None:
+        """
+        Keep the sessions in stores made by `session_store` from now on, in a
+        process the loaded skill was forked into before it answered anything.
+        """
+        self.session_store = session_store
+
+        kernel = self.kernel
+        sessions = session_store()
+        sessions.bind(kernel._respondLock)
+
+        kernel._sessions.close()
+        kernel._sessions = sessions
+        kernel._addSession(kernel._globalSessionID)
+
+    def start_workers(self, processes: int) -> None:
+        """
+        Serve calls from `processes` worker processes forked from this one.
+
+        Done by `__init__` if asked to, or later, by each process a skill
+        loaded without workers is forked into, as workers don't survive a fork.
+        """
+        if self.workers is None:
+            # Workers replaced on reload add their histograms to these.
+            self.workers = KernelWorkerPool(
+                self, processes, collect=("stage_timings", self.timings.merge)
+            )
+
+    def _aiml_files(self) -> t.List[Path]:
+        return compiler.corpus_files(self.path_to_aiml_scripts)
+
+    def _new_kernel(self, reset_sessions: bool = False) -> CachingKernel:
+        kernel = CachingKernel(
+            self.response_cache_size,
+            self.matcher,
+            self.ignored_characters,
+            self.timings,
+        )
+        kernel._verboseMode = False
+
+        self._load_scripts(kernel)
+        if self.lazy_files:
+            kernel.lazy = lazy.LazyTopics(
+                self.lazy_files, kernel.graft, kernel.prune, self.lazy_idle
+            )
+            kernel._brain.loader = kernel.lazy.ensure
+        kernel.prepare()
+
+        if self.collapse_redirects:
+            self._collapse_redirects(kernel)
+
+        kernel.measure()
+
+        if self.response_cache_size > 0:
+            start = time.perf_counter()
+            counts = kernel.analyze()
+            logger.info(
+                f"AIML categories classified in {time.perf_counter() - start:.2f}s: "
+                + ", ".join(f"{count} {purity}" for purity, count in counts.items())
+            )
+
+        sessions = self.session_store()
+        if reset_sessions:
+            sessions.reset()
+        sessions.bind(kernel._respondLock)
+
+        kernel._maxHistorySize = self.history_length
+        kernel._sessions = sessions
+        kernel._addSession(kernel._globalSessionID)
+
+        if self.tenants_path:
+            kernel.tenants = TenantOverlays(
+                tenant_dirs(self.tenants_path),
+                functools.partial(self._new_overlay, kernel),
+                self.tenant_idle,
+                self.max_tenants,
+            )
+            logger.info(
+                f"{len(kernel.tenants.paths)} AIML tenants to load on demand "
+                f"from {self.tenants_path}"
+            )
+
+        return kernel
+
+    def _new_overlay(
+        self, base: CachingKernel, tenant: str, path: Path
+    ) -> CachingKernel:
+        """A tenant's kernel, with its corpus learned on top of the base brain."""
+        kernel = base.overlay()
+        compiler.compile_serial(kernel, compiler.corpus_files(path))
+        kernel.prepare()
+
+        # Its categories may change where any `<srai>` ends up.
+        if self.collapse_redirects:
+            collapse_redirects(kernel)
+        if self.response_cache_size > 0:
+            kernel.analyze()
 
-        for each_file_path in all_files:
-            if each_file_path.suffix in [".aiml", ".xml"]:
-                self.kernel.learn(str(each_file_path))
-                learned_files.append(each_file_path)
+        return kernel
 
-        if not learned_files:
+    @staticmethod
+    def _collapse_redirects(kernel: CachingKernel) -> None:
+        start = time.perf_counter()
+        report = collapse_redirects(kernel)
+
+        logger.info(
+            f"AIML <srai> redirects collapsed in {time.perf_counter() - start:.2f}s: "
+            f"{report.collapsed} <srai>s skip {report.hops_removed} hops "
+            f"({report.literal} literal and {report.starred} starred redirect categories)"
+        )
+        if report.chains:
+            logger.info(
+                "Longest AIML redirect chains: "
+                + ", ".join(
+                    f"{text!r} -> {final!r} ({hops} hops)"
+                    for text, final, hops in report.chains[:3]
+                )
+            )
+        for cycle in report.cycles:
+            logger.warning(
+                "AIML <srai> redirects loop back on themselves: "
+                + " -> ".join(map(repr, cycle + cycle[:1]))
+            )
+
+    def _load_scripts(self, kernel: CachingKernel) -> None:
+        start = time.perf_counter()
+        aiml_files = self._aiml_files()
+
+        if not aiml_files:
             logger.warning(
                 f"No .aiml or .xml files found for AIML Kernel in directory {self.path_to_aiml_scripts}"
             )
+            return
+
+        digest = None
+        if self.brain_snapshot or self.shadow_plan or self.lazy_manifest:
+            digest = snapshot.corpus_digest(self.path_to_aiml_scripts, aiml_files)
+
+        self.lazy_files = {}
+        if self.lazy_manifest:
+            lazy_files = lazy.load_manifest(
+                self.lazy_manifest, self.path_to_aiml_scripts, digest
+            )
+            if lazy_files is None:
+                logger.warning(
+                    f"No AIML lazy manifest for this corpus at {self.lazy_manifest}, "
+                    "loading every category up front (`python -m bot.bench.corpus "
+                    "--lazy ... --write-manifest` makes one)"
+                )
+            else:
+                self.lazy_files = lazy_files
+
+        if self.brain_snapshot:
+            snapshot_digest = digest
+            if self.lazy_files:
+                # Leaving the lazy categories out makes for another brain.
+                snapshot_digest = snapshot.corpus_digest(
+                    self.path_to_aiml_scripts,
+                    aiml_files,
+                    [
+                        f"lazy:{path.relative_to(self.path_to_aiml_scripts).as_posix()}"
+                        for path in self.lazy_files
+                    ],
+                )
+
+            if snapshot.load_snapshot(kernel, self.brain_snapshot, snapshot_digest):
+                self.load_time = time.perf_counter() - start
+                logger.info(
+                    f"AIML brain loaded from snapshot {self.brain_snapshot} in "
+                    f"{self.load_time:.2f}s ({kernel.numCategories()} categories)"
+                )
+                return
+
+        skip = {}
+        if self.shadow_plan:
+            plan = corpus.load_plan(self.shadow_plan, self.path_to_aiml_scripts, digest)
+            if plan is None:
+                logger.warning(
+                    f"No AIML shadow plan for this corpus at {self.shadow_plan}, loading "
+                    "every category (`python -m bot.bench.corpus --write-plan` makes one)"
+                )
+            else:
+                aiml_files = [path for path in aiml_files if path not in plan.files]
+                skip = plan.categories
+                logger.info(
+                    f"Skipping {len(plan.files)} shadowed AIML files and "
+                    f"{sum(map(len, skip.values()))} shadowed categories of others"
+                )
+
+        if self.lazy_files:
+            skip = dict(skip)
+            for path, lazy_file in self.lazy_files.items():
+                skip[path] = skip.get(path, frozenset()) | lazy_file.categories
+            aiml_files = [
+                path
+                for path in aiml_files
+                if path not in self.lazy_files or self.lazy_files[path].eager
+            ]
+            logger.info(
+                f"Leaving {sum(len(file.categories) for file in self.lazy_files.values())} "
+                f"categories of {len(self.lazy_files)} AIML topic files to load on demand"
+            )
+
+        if self.compile_workers > 1:
+            self.load_timings = compiler.compile_parallel(
+                kernel, aiml_files, self.compile_workers, skip
+            )
+            mode = f"with {self.compile_workers} processes"
+        else:
+            self.load_timings = compiler.compile_serial(kernel, aiml_files, skip)
+            mode = "serially"
+        kernel.compact()
+
+        self.load_time = time.perf_counter() - start
+        logger.info(
+            f"AIML brain parsed from {len(aiml_files)} files {mode} in "
+            f"{self.load_time:.2f}s ({kernel.numCategories()} categories)"
+        )
+        compiler.log_timings(self.load_timings, self.path_to_aiml_scripts)
+
+        if self.brain_snapshot:
+            try:
+                snapshot.save_snapshot(kernel, self.brain_snapshot, snapshot_digest)
+            except OSError as exc:
+                logger.warning(
+                    f"Could not write AIML brain snapshot {self.brain_snapshot}: {exc!r}"
+                )
+            else:
+                logger.info(f"AIML brain snapshot written to {self.brain_snapshot}")
+
+    def reload(self) -> t.Tuple[int, float]:
+        """
+        Rebuild the brain from the corpus and swap it in once it is complete.
+
+        Messages keep being answered by the old kernel while the new one is
+        built, and calls already running on it finish there. Every session is
+        reset, like the brain. Returns the new category count and how long the
+        reload took.
+
+        With worker processes, only the zygote they are forked from loads the
+        new brain, and this process keeps the kernel it started with.
+        """
+        if not self._reload_lock.acquire(blocking=False):
+            raise ReloadInProgress("The AIML brain is already being reloaded")
+
+        try:
+            start = time.perf_counter()
+            if self.workers is None:
+                old_kernel = self.kernel
+                self.kernel = self._new_kernel(reset_sessions=True)
+                old_kernel._sessions.close()
+            else:
+                # The workers' stores are new, but may read the same database.
+                self.kernel._sessions.reset()
+                # Forking here, with every other thread running, could leave
+                # the workers with a lock that is never released, so the
+                # zygote they are forked from loads the new brain itself.
+                self._zygote_brain = self.workers.reload("rebuild_kernel")
+
+            elapsed = time.perf_counter() - start
+        finally:
+            self._reload_lock.release()
+
+        categories = self.num_categories()
+        logger.info(f"AIML brain reloaded in {elapsed:.2f}s ({categories} categories)")
+
+        return categories, elapsed
+
+    def rebuild_kernel(self) -> t.Dict[str, int]:
+        """
+        `reload` as the zygote of the workers does it, the sessions already
+        reset, returning the `brain_stats` of the new brain.
+        """
+        # It can't run a process pool, as it has its children reaped.
+        self.compile_workers = 0
+
+        old_kernel = self.kernel
+        self.kernel = self._new_kernel()
+        old_kernel._sessions.close()
+
+        return self.brain_stats()
+
+    async def areload(self) -> t.Tuple[int, float]:
+        """Run `reload` in a background thread."""
+        return await asyncio.get_running_loop().run_in_executor(None, self.reload)
 
-    def process_step(self, utterance_str: str, user_id: any) -> t.Tuple[str, float]:
-        response = self.kernel.respond(utterance_str, sessionID=user_id)
+    def reset_session(self, user_id: t.Any, tenant: t.Optional[str] = None) -> bool:
+        """
+        Forget one user's predicates and history with a tenant (or the base
+        brain), leaving the brain and every other session untouched. Returns
+        whether the user had a session.
+        """
+        if self.workers is not None:
+            return self.workers.call(user_id, "reset_session", user_id, tenant).result()
+
+        kernel = self.kernel
+        tenant = self._tenant(kernel, tenant)
+        if tenant is not None:
+            # Its kernel shares the sessions, so it needn't be loaded.
+            user_id = (tenant, user_id)
+
+        with kernel._respondLock:
+            existed = user_id in kernel._sessions
+            kernel._deleteSession(user_id)
+
+        return existed
+
+    async def areset_session(
+        self, user_id: t.Any, tenant: t.Optional[str] = None
+    ) -> bool:
+        """Asynchronous version of `reset_session`, ordered after the user's messages."""
+        return await self.inference.run([user_id], self.reset_session, user_id, tenant)
+
+    def session_stats(self) -> t.Dict[str, int]:
+        """Session store counters, summed over the worker processes if there are any."""
+        if self.workers is None:
+            return self.kernel._sessions.stats()
+
+        return self._sum_worker_stats("session_stats")
+
+    def cache_stats(self) -> t.Dict[str, int]:
+        """Response cache counters, summed over the worker processes if there are any."""
+        if self.workers is None:
+            return self.kernel.cache.stats()
+
+        return self._sum_worker_stats("cache_stats")
+
+    def brain_stats(self) -> t.Dict[str, int]:
+        """The category count and `brain_memory` of the brain answering."""
+        if self._zygote_brain is not None:
+            return dict(self._zygote_brain)
+
+        return {
+            "categories": self.kernel.numCategories(),
+            **self.kernel.brain_memory(),
+        }
+
+    def num_categories(self) -> int:
+        return self.brain_stats()["categories"]
+
+    def memory_stats(self) -> t.Dict[str, int]:
+        """
+        Bytes taken up by the trie, the templates and the sessions. Worker
+        processes are forked with the same brain, so only their sessions add up.
+        """
+        stats = self.brain_stats()
+        del stats["categories"]
+        if self.workers is None:
+            stats.update(self.session_memory())
+        else:
+            stats.update(self._sum_worker_stats("session_memory"))
+
+        return stats
+
+    def session_memory(self) -> t.Dict[str, int]:
+        return self.kernel.session_memory()
+
+    def lazy_stats(self) -> t.Dict[str, int]:
+        """Lazy topic counters, summed over the worker processes if there are any."""
+        if self.workers is None:
+            lazy_topics = self.kernel.lazy
+            return lazy_topics.stats() if lazy_topics is not None else {}
+
+        return self._sum_worker_stats("lazy_stats")
+
+    def tenant_stats(self) -> t.Dict[str, int]:
+        """Tenant overlay counters, summed over the worker processes if there are any."""
+        if self.workers is None:
+            tenants = self.kernel.tenants
+            return tenants.stats() if tenants is not None else {}
+
+        return self._sum_worker_stats("tenant_stats")
+
+    def stage_timings(self) -> StageTimings:
+        """
+        Latency histograms of every stage, merged over the worker processes,
+        those replaced on reload included.
+        """
+        timings = StageTimings()
+        timings.merge(self.timings)
+
+        if self.workers is not None:
+            for future in self.workers.broadcast("stage_timings"):
+                timings.merge(future.result())
+
+        return timings
+
+    def reset_stage_timings(self) -> None:
+        """Start the latency histograms over, in the worker processes too."""
+        self.timings.reset()
+
+        if self.workers is not None:
+            for future in self.workers.broadcast("reset_stage_timings"):
+                future.result()
+
+    def _sum_worker_stats(self, method: str) -> t.Dict[str, int]:
+        totals = collections.Counter()
+        for future in self.workers.broadcast(method):
+            totals.update(future.result())
+
+        return dict(totals)
+
+    def normalize(self, utterance_str: str) -> t.List[Sentence]:
+        """
+        The sentences the kernel answers for an utterance, with the ignored
+        characters dropped and the substitutions applied. Their `words` and
+        `key` are stable forms of the input to cache or deduplicate on.
+        """
+        return self.kernel.normalize(utterance_str)
+
+    def tenant_names(self) -> t.FrozenSet[str]:
+        """The tenants the brain has overlays for."""
+        tenants = self.kernel.tenants
+        return frozenset(tenants.paths) if tenants is not None else frozenset()
+
+    @staticmethod
+    def _tenant(kernel: CachingKernel, tenant: t.Optional[str]) -> t.Optional[str]:
+        """`tenant` if the kernel has an overlay for it, None for the base brain."""
+        tenants = kernel.tenants
+        return tenant if tenants is not None and tenant in tenants.paths else None
+
+    def process_step(
+        self, utterance_str: str, user_id: any, tenant: t.Optional[str] = None
+    ) -> t.Tuple[str, float]:
+        return self.match_step(utterance_str, user_id, tenant)[:2]
+
+    def match_step(
+        self, utterance_str: str, user_id: t.Any, tenant: t.Optional[str] = None
+    ) -> t.Tuple[str, float, t.Tuple[str, ...]]:
+        """`process_step`, along with the pattern each sentence matched."""
+        if self.workers is not None:
+            return self.workers.call(
+                user_id, "match_step", utterance_str, user_id, tenant
+            ).result()
+
+        kernel = self.kernel
+        tenant = self._tenant(kernel, tenant)
+        if tenant is not None:
+            # Each tenant talks to a user in a session of its own.
+            kernel, user_id = kernel.tenants.kernel(tenant), (tenant, user_id)
+
+        response, patterns = kernel.respond_matched(utterance_str, sessionID=user_id)
 
         if response:
             confidence = self.positive_confidence
@@ -50,15 +554,15 @@ class AIMLSkill:
             response = self.null_response
             confidence = self.null_confidence
 
-        return response, confidence
+        return response, confidence, patterns
 
     @staticmethod
     def _generate_user_id() -> str:
         return uuid.uuid1().hex
 
-    def __call__(
-        self, utterances_batch: t.List[str], states_batch: t.Optional[t.List] = None
-    ) -> t.Tuple[t.List[str], t.List[float], list]:
+    def _resolve_states(
+        self, utterances_batch: t.List[str], states_batch: t.Optional[t.List]
+    ) -> t.Tuple[list, list]:
         output_states_batch = []
         user_ids = []
 
@@ -80,7 +584,112 @@ class AIMLSkill:
             user_ids.append(user_id)
             output_states_batch.append(new_state)
 
-        confident_responses = map(self.process_step, utterances_batch, user_ids)
-        responses_batch, confidences_batch = zip(*confident_responses)
+        return user_ids, output_states_batch
+
+    def __call__(
+        self, utterances_batch: t.List[str], states_batch: t.Optional[t.List] = None
+    ) -> t.Tuple[t.List[str], t.List[float], list]:
+        user_ids, output_states_batch = self._resolve_states(
+            utterances_batch, states_batch
+        )
+
+        if self.workers is not None:
+            # Submit the whole batch before waiting, so it fans out over the workers.
+            futures = [
+                self.workers.call(user_id, "match_step", utterance, user_id, tenant)
+                for utterance, user_id, tenant in zip(
+                    utterances_batch, user_ids, self._tenants(output_states_batch)
+                )
+            ]
+            matched = [future.result() for future in futures]
+        else:
+            matched = map(
+                self.match_step,
+                utterances_batch,
+                user_ids,
+                self._tenants(output_states_batch),
+            )
+
+        return self._unzip(matched, output_states_batch)
+
+    async def _call_workers(
+        self, utterances_batch: t.List[str], states_batch: t.Optional[t.List]
+    ) -> t.Tuple[t.List[str], t.List[float], list]:
+        user_ids, output_states_batch = self._resolve_states(
+            utterances_batch, states_batch
+        )
+
+        matched = await asyncio.gather(
+            *(
+                asyncio.wrap_future(
+                    self.workers.call(user_id, "match_step", utterance, user_id, tenant)
+                )
+                for utterance, user_id, tenant in zip(
+                    utterances_batch, user_ids, self._tenants(output_states_batch)
+                )
+            )
+        )
+
+        return self._unzip(matched, output_states_batch)
+
+    @staticmethod
+    def _tenants(states_batch: list) -> t.List[t.Optional[str]]:
+        return [state.get("tenant") for state in states_batch]
+
+    @staticmethod
+    def _unzip(
+        matched: t.Iterable[t.Tuple[str, float, t.Tuple[str, ...]]], states_batch: list
+    ) -> t.Tuple[t.List[str], t.List[float], list]:
+        """The responses and confidences, with the patterns put in the states."""
+        responses_batch, confidences_batch = [], []
+        for (response, confidence, patterns), state in zip(matched, states_batch):
+            responses_batch.append(response)
+            confidences_batch.append(confidence)
+            state["patterns"] = patterns
+
+        return responses_batch, confidences_batch, states_batch
+
+    async def respond(
+        self, utterance_str: str, user_id: t.Any, tenant: t.Optional[str] = None
+    ) -> t.Tuple[str, float]:
+        """Asynchronous version of `process_step`, in order for each user."""
+        responses, confidences, _ = await self.acall(
+            [utterance_str], [{"user_id": user_id, "tenant": tenant}]
+        )
+        return responses[0], confidences[0]
+
+    async def acall(
+        self,
+        utterances_batch: t.List[str],
+        states_batch: t.Optional[t.List] = None,
+        reserved: bool = False,
+    ) -> t.Tuple[t.List[str], t.List[float], list]:
+        """
+        Asynchronous version of `__call__` that doesn't block the event loop.
+
+        Room in the inference queue is taken for every utterance, unless it
+        was `reserved` for them already.
+        """
+        user_ids = [
+            state["user_id"]
+            for state in states_batch or []
+            if state and "user_id" in state
+        ]
+        # Worker processes are awaited directly instead of tying up a pool thread.
+        handler = self._call_workers if self.workers is not None else self
+
+        return await self.inference.run(
+            user_ids,
+            handler,
+            utterances_batch,
+            states_batch,
+            size=len(utterances_batch),
+            reserved=reserved,
+        )
+
+    def close(self) -> None:
+        self.inference.shutdown()
+        self.kernel._sessions.close()
 
-        return responses_batch, confidences_batch, output_states_batch
+        if self.workers is not None:
+            self.workers.close()
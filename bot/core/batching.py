@@ -0,0 +1,114 @@
+import asyncio
+import typing as t
+
+# An utterance waiting to be sent, its user and tenant and the future of its reply.
+_Message = t.Tuple[str, t.Any, t.Optional[str], asyncio.Future]
+
+
+class MessageBatcher:
+    """
+    Collect incoming messages into batches for `AIMLSkill.acall`.
+
+    A batch is sent once it holds `max_size` messages or `window` seconds
+    after its first message came in, whichever is first, so a burst of
+    messages costs one dispatch to the inference backend instead of one
+    each. The skill answers a batch in order and orders batches per user,
+    so every user still gets their replies in the order they wrote.
+
+    That ordering is per batch: one waits for every earlier batch holding a
+    message of any of its users, so users who write at the same time as
+    someone already waiting on a batch wait along. A smaller `max_size`
+    couples fewer users together.
+
+    Each message takes its place in the inference queue as it comes in, and
+    is turned away on its own with `InferenceQueueFull` if there is none,
+    instead of failing the batch it would have been part of.
+
+    A `window` of 0 or a `max_size` of 1 sends every message on its own.
+    """
+
+    def __init__(self, skill: t.Any, window: float = 0.01, max_size: int = 16) -> None:
+        self.skill = skill
+        self.window = window
+        self.max_size = max_size
+
+        self.batches = 0
+        self.messages = 0
+
+        self._pending: t.List[_Message] = []
+        self._timer: t.Optional[asyncio.TimerHandle] = None
+        self._dispatching: t.Set[asyncio.Task] = set()
+
+    async def respond(
+        self, utterance_str: str, user_id: t.Any, tenant: t.Optional[str] = None
+    ) -> t.Tuple[str, float, t.Tuple[str, ...]]:
+        """
+        Answer a message, with the brain of `tenant` if set, as part of the
+        next batch. Along with the response and its confidence comes the
+        pattern each sentence of the message matched.
+        """
+        self.skill.inference.reserve()
+
+        loop = asyncio.get_running_loop()
+        reply = loop.create_future()
+        self._pending.append((utterance_str, user_id, tenant, reply))
+
+        if len(self._pending) >= self.max_size or self.window <= 0:
+            self.flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self.flush)
+
+        return await reply
+
+    def flush(self) -> None:
+        """Send the messages collected so far without waiting any longer."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        if not self._pending:
+            return
+
+        batch, self._pending = self._pending, []
+        task = asyncio.ensure_future(self._dispatch(batch))
+        self._dispatching.add(task)
+        task.add_done_callback(self._dispatching.discard)
+
+    async def drain(self) -> None:
+        """Send the collected messages and wait until every batch is answered."""
+        self.flush()
+        if self._dispatching:
+            await asyncio.wait(set(self._dispatching))
+
+    async def _dispatch(self, batch: t.List[_Message]) -> None:
+        self.batches += 1
+        self.messages += len(batch)
+
+        try:
+            responses, confidences, states = await self.skill.acall(
+                [utterance for utterance, _, _, _ in batch],
+                [
+                    {"user_id": user_id, "tenant": tenant}
+                    for _, user_id, tenant, _ in batch
+                ],
+                reserved=True,
+            )
+        except Exception as exc:
+            for _, _, _, reply in batch:
+                if not reply.done():
+                    reply.set_exception(exc)
+            return
+
+        for (*_, reply), response, confidence, state in zip(
+            batch, responses, confidences, states
+        ):
+            # The sender may have given up waiting in the meantime.
+            if not reply.done():
+                reply.set_result((response, confidence, state.get("patterns", ())))
+
+    def stats(self) -> t.Dict[str, int]:
+        return {
+            "batches": self.batches,
+            "batched_messages": self.messages,
+            "pending_messages": len(self._pending),
+        }
@@ -0,0 +1,248 @@
+import gc
+import math
+import multiprocessing
+import signal
+import threading
+import time
+import typing as t
+from multiprocessing.connection import Connection, wait
+
+import aiohttp
+from discord.http import Route
+from loguru import logger
+
+# What a cluster reports about itself, and what every cluster is told back:
+# the latest report of each, by cluster ID.
+Snapshot = t.Dict[str, t.Any]
+
+# Seconds a shard has to wait after another one of its bucket identified.
+IDENTIFY_INTERVAL = 5.0
+
+
+class ClusterLaunchError(Exception):
+    """Raised when the shard count can't be had from Discord."""
+
+
+async def recommended_shards(token: str) -> t.Tuple[int, int]:
+    """
+    The shard count Discord recommends for the bot, and how many shards
+    may identify at once (its `max_concurrency`).
+    """
+    async with aiohttp.ClientSession() as session:
+        async with session.get(
+            f"{Route.BASE}/gateway/bot", headers={"Authorization": f"Bot {token}"}
+        ) as response:
+            if response.status != 200:
+                raise ClusterLaunchError(
+                    f"Discord answered {response.status} for the gateway info"
+                )
+            data = await response.json()
+
+    return data["shards"], data["session_start_limit"]["max_concurrency"]
+
+
+def shard_ranges(shard_count: int, cluster_count: int) -> t.List[t.List[int]]:
+    """Split the shards into `cluster_count` contiguous ranges of even size."""
+    return [
+        list(
+            range(
+                cluster * shard_count // cluster_count,
+                (cluster + 1) * shard_count // cluster_count,
+            )
+        )
+        for cluster in range(cluster_count)
+    ]
+
+
+def identify_delay(shards: int, max_concurrency: int) -> float:
+    """Seconds the shards of one cluster take to identify one after another."""
+    return math.ceil(shards / max(max_concurrency, 1)) * IDENTIFY_INTERVAL
+
+
+class ClusterLink:
+    """
+    A cluster's end of the connection to the supervisor.
+
+    `exchange` sends the supervisor this cluster's snapshot and gets the
+    latest one of every cluster back, which is kept in `clusters`.
+    """
+
+    def __init__(self, cluster_id: int, connection: Connection) -> None:
+        self.cluster_id = cluster_id
+        self.connection = connection
+        self.clusters: t.Dict[int, Snapshot] = {}
+
+        self._lock = threading.Lock()
+
+    def exchange(self, snapshot: Snapshot) -> t.Dict[int, Snapshot]:
+        """Blocking; raises `EOFError` or `OSError` once the supervisor is gone."""
+        with self._lock:
+            self.connection.send(snapshot)
+            self.clusters = self.connection.recv()
+
+        return self.clusters
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+class _Cluster:
+    def __init__(
+        self, index: int, process: multiprocessing.Process, connection: Connection
+    ) -> None:
+        self.index = index
+        self.process = process
+        self.connection = connection
+        self.snapshot: Snapshot = {}
+
+
+class ClusterSupervisor:
+    """
+    Fork a process for each cluster and keep them running.
+
+    `target(cluster_id, connection, delay)` is run in every forked process,
+    with its end of a pipe to hand to a `ClusterLink` and the seconds to
+    wait before connecting. Whatever is loaded before `run` (the brain
+    above all) is shared copy-on-write by the clusters, and by those
+    restarted later, as they are forked from the same parent.
+
+    Clusters that crash, exiting with a non-zero code, are restarted after
+    `restart_delay` seconds, doubling with each crash in a row up to a
+    minute. The ones that exit cleanly stay down, and `run` returns once
+    none are left.
+    """
+
+    def __init__(
+        self,
+        target: t.Callable[[int, Connection, float], None],
+        cluster_count: int,
+        start_delay: float = 0.0,
+        restart_delay: float = 5.0,
+    ) -> None:
+        self.target = target
+        self.cluster_count = cluster_count
+        self.start_delay = start_delay
+        self.restart_delay = restart_delay
+        self.restarts = [0] * cluster_count
+
+        self._context = multiprocessing.get_context("fork")
+        self._clusters: t.Dict[int, _Cluster] = {}
+        # When crashed clusters are due to be started again.
+        self._due: t.Dict[int, float] = {}
+        self._crashes = [0] * cluster_count
+        self._closing = False
+
+    def _spawn(self, index: int, delay: float) -> None:
+        parent_connection, child_connection = self._context.Pipe()
+        process = self._context.Process(
+            target=self.target,
+            args=(index, child_connection, delay),
+            name=f"cluster-{index}",
+        )
+        process.start()
+        child_connection.close()
+
+        self._clusters[index] = _Cluster(index, process, parent_connection)
+        logger.info(f"Started cluster {index} (pid {process.pid})")
+
+    def run(self) -> None:
+        """Start the clusters and supervise them until they have all exited."""
+        signal.signal(signal.SIGINT, self._shut_down)
+        signal.signal(signal.SIGTERM, self._shut_down)
+
+        # Keep the collector from writing to, and thereby copying, the pages
+        # the clusters share.
+        gc.freeze()
+        for index in range(self.cluster_count):
+            # Shards of later clusters only identify once earlier ones have.
+            self._spawn(index, index * self.start_delay)
+
+        while self._clusters or (self._due and not self._closing):
+            self._poll()
+
+        logger.info("Every cluster has exited")
+
+    def _poll(self) -> None:
+        now = time.monotonic()
+        for index, due in list(self._due.items()):
+            if due <= now and not self._closing:
+                del self._due[index]
+                self.restarts[index] += 1
+                self._spawn(index, 0.0)
+
+        by_connection = {
+            cluster.connection: cluster for cluster in self._clusters.values()
+        }
+        by_sentinel = {
+            cluster.process.sentinel: cluster for cluster in self._clusters.values()
+        }
+        timeout = min((due - now for due in self._due.values()), default=1.0)
+        ready = wait([*by_connection, *by_sentinel], timeout=max(timeout, 0.0))
+
+        for item in ready:
+            if item in by_connection:
+                self._answer(by_connection[item])
+
+        for item in ready:
+            if item in by_sentinel:
+                self._reap(by_sentinel[item])
+
+    def _answer(self, cluster: _Cluster) -> None:
+        try:
+            cluster.snapshot = cluster.connection.recv()
+            cluster.connection.send(self.snapshots())
+        except (EOFError, OSError):
+            # It's exiting, which its sentinel will tell.
+            pass
+
+    def _reap(self, cluster: _Cluster) -> None:
+        cluster.process.join()
+        cluster.connection.close()
+        del self._clusters[cluster.index]
+
+        code = cluster.process.exitcode
+        if code == 0 or self._closing:
+            logger.info(f"Cluster {cluster.index} exited with code {code}")
+            self._crashes[cluster.index] = 0
+            return
+
+        # A cluster that ran for a while before crashing starts over quickly.
+        uptime = time.time() - cluster.snapshot.get("started", time.time())
+        if uptime > 10 * 60:
+            self._crashes[cluster.index] = 0
+        delay = min(self.restart_delay * 2 ** self._crashes[cluster.index], 60.0)
+        self._crashes[cluster.index] += 1
+
+        logger.warning(
+            f"Cluster {cluster.index} (pid {cluster.process.pid}) exited with "
+            f"code {code}, restarting it in {delay:.0f}s"
+        )
+        self._due[cluster.index] = time.monotonic() + delay
+
+    def snapshots(self) -> t.Dict[int, Snapshot]:
+        """The latest snapshot of every cluster, including ones that are down."""
+        snapshots = {}
+        for index in range(self.cluster_count):
+            cluster = self._clusters.get(index)
+            snapshots[index] = {
+                **(cluster.snapshot if cluster is not None else {}),
+                "alive": cluster is not None and cluster.process.is_alive(),
+                "restarts": self.restarts[index],
+            }
+
+        return snapshots
+
+    def _shut_down(self, signum: int, _: t.Any) -> None:
+        if self._closing:
+            # Asked twice, for clusters that don't close in time.
+            for cluster in self._clusters.values():
+                cluster.process.kill()
+            return
+
+        logger.info(f"Shutting the clusters down ({signal.Signals(signum).name})")
+        self._closing = True
+        self._due.clear()
+        for cluster in self._clusters.values():
+            if cluster.process.is_alive():
+                # Each bot closes itself on SIGTERM.
+                cluster.process.terminate()
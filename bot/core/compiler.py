@@ -0,0 +1,168 @@
+import time
+import typing as t
+import xml.sax
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import aiml
+from aiml.AimlParser import create_parser
+from aiml.PatternMgr import PatternMgr
+from loguru import logger
+
+from bot.core.utils import paused_gc
+
+FileTiming = t.Tuple[Path, float]
+# The pattern, `<that>` and topic of a category, which its place in the trie follows.
+CategoryKey = t.Tuple[str, str, str]
+
+
+def corpus_files(root: Path) -> t.List[Path]:
+    """The AIML files under `root`, in the order they are loaded."""
+    return [
+        path for path in sorted(root.rglob("*.*")) if path.suffix in [".aiml", ".xml"]
+    ]
+
+
+def category_key(key: t.Tuple[str, str, str]) -> CategoryKey:
+    """The key of a category as parsed, with the words of each part single spaced."""
+    return tuple(" ".join(part.split()) for part in key)
+
+
+def parse_categories(path: str) -> t.Optional[t.Dict[t.Tuple[str, str, str], list]]:
+    """Parse an AIML file into its categories, or None if it isn't well-formed."""
+    parser = create_parser()
+    handler = parser.getContentHandler()
+    handler.setEncoding(None)
+
+    try:
+        parser.parse(path)
+    except xml.sax.SAXParseException as exc:
+        logger.error(f"Failed to parse AIML file {path}: {exc}")
+        return None
+
+    return handler.categories
+
+
+def parse_file(
+    path: str, skip: t.AbstractSet[CategoryKey] = frozenset()
+) -> t.Tuple[t.Optional[dict], float]:
+    """
+    Parse a single AIML file into its own pattern trie, timing the parse.
+    Categories in `skip` are left out.
+    """
+    start = time.perf_counter()
+
+    with paused_gc():
+        categories = parse_categories(path)
+        if categories is None:
+            return None, time.perf_counter() - start
+
+        brain = PatternMgr()
+        for key, template in categories.items():
+            if not skip or category_key(key) not in skip:
+                brain.add(key, template)
+
+    return brain._root, time.perf_counter() - start
+
+
+def merge_trie(target: dict, source: dict) -> None:
+    """Merge the `source` trie into `target`, letting templates from `source` win."""
+    stack = [(target, source)]
+
+    while stack:
+        target_node, source_node = stack.pop()
+
+        for key, source_child in source_node.items():
+            if key == PatternMgr._TEMPLATE or key not in target_node:
+                target_node[key] = source_child
+            else:
+                stack.append((target_node[key], source_child))
+
+
+def count_templates(root: dict) -> int:
+    """Count the categories stored in a pattern trie."""
+    count = 0
+    stack = [root]
+
+    while stack:
+        node = stack.pop()
+        for key, child in node.items():
+            if key == PatternMgr._TEMPLATE:
+                count += 1
+            else:
+                stack.append(child)
+
+    return count
+
+
+def compile_serial(
+    kernel: aiml.Kernel,
+    files: t.Sequence[Path],
+    skip: t.Mapping[Path, t.AbstractSet[CategoryKey]] = {},
+) -> t.List[FileTiming]:
+    """
+    Learn the files one after another in the given order, leaving out the
+    categories `skip` has for a file.
+    """
+    timings = []
+
+    with paused_gc():
+        for path in files:
+            start = time.perf_counter()
+
+            categories = parse_categories(str(path))
+            if categories is not None:
+                file_skip = skip.get(path, frozenset())
+                for key, template in categories.items():
+                    if not file_skip or category_key(key) not in file_skip:
+                        kernel._brain.add(key, template)
+
+            timings.append((path, time.perf_counter() - start))
+
+    return timings
+
+
+def compile_parallel(
+    kernel: aiml.Kernel,
+    files: t.Sequence[Path],
+    workers: int,
+    skip: t.Mapping[Path, t.AbstractSet[CategoryKey]] = {},
+) -> t.List[FileTiming]:
+    """
+    Parse the files in a process pool and merge their tries into the kernel.
+
+    Files are merged in the given order, so a category defined in several
+    files resolves to the last one exactly as with `compile_serial`.
+    """
+    timings = []
+
+    with ProcessPoolExecutor(max_workers=workers) as executor, paused_gc():
+        # Submit the biggest files first so they don't end up as the stragglers.
+        by_size = sorted(files, key=lambda path: path.stat().st_size, reverse=True)
+        futures = {
+            path: executor.submit(parse_file, str(path), skip.get(path, frozenset()))
+            for path in by_size
+        }
+
+        root = kernel._brain._root
+        for path in files:
+            trie, elapsed = futures[path].result()
+            timings.append((path, elapsed))
+
+            if trie is not None:
+                merge_trie(root, trie)
+
+    kernel._brain._templateCount = count_templates(root)
+    return timings
+
+
+def log_timings(timings: t.Sequence[FileTiming], root: Path, slowest: int = 5) -> None:
+    """Log the parse time of every file, highlighting the slowest ones."""
+    for path, elapsed in timings:
+        logger.debug(f"Parsed {path.relative_to(root)} in {elapsed * 1000:.1f}ms")
+
+    ranked = sorted(timings, key=lambda timing: timing[1], reverse=True)[:slowest]
+    summary = ", ".join(
+        f"{path.relative_to(root)} ({elapsed:.2f}s)" for path, elapsed in ranked
+    )
+    logger.info(f"Slowest AIML files: {summary}")
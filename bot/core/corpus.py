@@ -0,0 +1,242 @@
+import hashlib
+import json
+import os
+import time
+import typing as t
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from loguru import logger
+
+from bot.core.compiler import CategoryKey, category_key, parse_categories
+from bot.core.lazy import Graft, LazyFile
+from bot.core.utils import paused_gc
+
+
+def scan_file(path: str) -> t.Tuple[t.Optional[t.Dict[CategoryKey, bytes]], float]:
+    """Parse an AIML file into a fingerprint of the template of every category."""
+    start = time.perf_counter()
+
+    with paused_gc():
+        categories = parse_categories(path)
+        if categories is None:
+            return None, time.perf_counter() - start
+
+        fingerprints = {
+            category_key(key): hashlib.blake2b(
+                repr(template).encode(), digest_size=16
+            ).digest()
+            for key, template in categories.items()
+        }
+
+    return fingerprints, time.perf_counter() - start
+
+
+@dataclass
+class FileReport:
+    """What a file defines and how much of it later files replace."""
+
+    path: Path
+    keys: t.Set[CategoryKey] = field(default_factory=set)
+    parse_time: float = 0.0
+    # Categories a later file defines again, and those it defines the same way.
+    shadowed: t.Set[CategoryKey] = field(default_factory=set)
+    identical: int = 0
+    # The files whose definitions win over this one's, with how many each.
+    shadowed_by: t.Counter[Path] = field(default_factory=Counter)
+
+    @property
+    def categories(self) -> int:
+        return len(self.keys)
+
+    @property
+    def fully_shadowed(self) -> bool:
+        return bool(self.categories) and len(self.shadowed) == self.categories
+
+
+@dataclass
+class Overlap:
+    """A category defined by several files, the last of which wins."""
+
+    key: CategoryKey
+    files: t.List[Path]
+    identical: bool
+
+
+@dataclass
+class CorpusReport:
+    """What `analyze` found, with a report for every file in load order."""
+
+    files: t.List[FileReport]
+    overlaps: t.List[Overlap]
+
+    @property
+    def categories(self) -> int:
+        return sum(report.categories for report in self.files)
+
+    @property
+    def shadowed(self) -> int:
+        return sum(len(report.shadowed) for report in self.files)
+
+
+def analyze(files: t.Sequence[Path], workers: int = 0) -> CorpusReport:
+    """Parse the files, in the order they are loaded, and find what they shadow."""
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            scans = list(executor.map(scan_file, map(str, files)))
+    else:
+        scans = [scan_file(str(path)) for path in files]
+
+    reports = []
+    definitions: t.Dict[CategoryKey, t.List[int]] = {}
+    for index, (path, (fingerprints, elapsed)) in enumerate(zip(files, scans)):
+        reports.append(FileReport(path, set(fingerprints or ()), elapsed))
+        for key in fingerprints or ():
+            definitions.setdefault(key, []).append(index)
+
+    overlaps = []
+    for key, indices in definitions.items():
+        if len(indices) == 1:
+            continue
+
+        winner = indices[-1]
+        fingerprint = scans[winner][0][key]
+        identical = True
+        for index in indices[:-1]:
+            report = reports[index]
+            report.shadowed.add(key)
+            report.shadowed_by[files[winner]] += 1
+            if scans[index][0][key] == fingerprint:
+                report.identical += 1
+            else:
+                identical = False
+
+        overlaps.append(Overlap(key, [files[index] for index in indices], identical))
+
+    return CorpusReport(reports, overlaps)
+
+
+@dataclass
+class ShadowPlan:
+    """What a load can leave out of the corpus it was made for."""
+
+    # Files all of whose categories are shadowed, which needn't be parsed.
+    files: t.Set[Path]
+    # The shadowed categories of the other files.
+    categories: t.Dict[Path, t.FrozenSet[CategoryKey]]
+
+
+def save_plan(report: CorpusReport, root: Path, path: Path, digest: bytes) -> None:
+    """Write the plan to skip what `report` found shadowed, for the corpus `digest`."""
+    plan = {
+        "digest": digest.hex(),
+        "files": [
+            file.path.relative_to(root).as_posix()
+            for file in report.files
+            if file.fully_shadowed
+        ],
+        "categories": {
+            file.path.relative_to(root).as_posix(): sorted(file.shadowed)
+            for file in report.files
+            if file.shadowed and not file.fully_shadowed
+        },
+    }
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    temp_path.write_text(json.dumps(plan))
+    os.replace(temp_path, path)
+
+
+def load_plan(path: Path, root: Path, digest: bytes) -> t.Optional[ShadowPlan]:
+    """
+    Read a plan written by `save_plan`, or None if it is missing, unreadable
+    or was made for another corpus.
+    """
+    try:
+        plan = json.loads(path.read_text())
+    except FileNotFoundError:
+        return None
+    except ValueError as exc:
+        logger.warning(f"Discarding unreadable AIML shadow plan {path}: {exc!r}")
+        return None
+
+    if plan.get("digest") != digest.hex():
+        return None
+
+    return ShadowPlan(
+        {root / name for name in plan["files"]},
+        {
+            root / name: frozenset(map(tuple, keys))
+            for name, keys in plan["categories"].items()
+        },
+    )
+
+
+def plan_lazy(
+    report: CorpusReport, lazy: t.AbstractSet[Path]
+) -> t.Dict[Path, LazyFile]:
+    """
+    Find where the categories of the `lazy` files can be grafted in on demand.
+
+    A category can be grafted below the first word of its pattern that
+    leads off the paths of every category loaded up front, unless a wildcard
+    comes first. The others are loaded up front too, which can take those
+    words away from categories found graftable before, so this repeats
+    until nothing changes.
+    """
+    trie: dict = {}
+    pending: t.Dict[Path, t.Set[CategoryKey]] = {}
+    for file in report.files:
+        if file.path in lazy:
+            pending[file.path] = set(file.keys)
+        else:
+            for key in file.keys:
+                _insert(trie, key[0].split())
+
+    grafts: t.Dict[Path, t.Dict[CategoryKey, Graft]] = {}
+    changed = True
+    while changed:
+        changed = False
+        for path, keys in pending.items():
+            grafts[path] = found = {}
+            for key in list(keys):
+                words = key[0].split()
+                graft = _graft(trie, words)
+                if graft is None:
+                    keys.discard(key)
+                    _insert(trie, words)
+                    changed = True
+                else:
+                    found[key] = graft
+
+    return {
+        file.path: LazyFile(
+            frozenset(grafts[file.path].values()),
+            frozenset(grafts[file.path]),
+            file.categories - len(grafts[file.path]),
+        )
+        for file in report.files
+        if grafts.get(file.path)
+    }
+
+
+def _insert(trie: dict, words: t.Sequence[str]) -> None:
+    node = trie
+    for word in words:
+        node = node.setdefault(word, {})
+
+
+def _graft(trie: dict, words: t.Sequence[str]) -> t.Optional[Graft]:
+    """The first words of a pattern that lead off `trie`, if no wildcard comes first."""
+    node = trie
+    for depth, word in enumerate(words):
+        if word in {"_", "*", "BOT_NAME"}:
+            return None
+        if word not in node:
+            return tuple(words[: depth + 1])
+        node = node[word]
+
+    return None
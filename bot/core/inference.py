@@ -0,0 +1,102 @@
+import asyncio
+import typing as t
+from concurrent.futures import ThreadPoolExecutor
+
+
+class InferenceQueueFull(Exception):
+    """Raised when the inference pool already has `queue_depth` messages pending."""
+
+
+class InferencePool:
+    """
+    Run blocking AIML calls in a bounded thread pool off the event loop.
+
+    Every job is tagged with ordering keys (user IDs). A job only starts once
+    every earlier job sharing one of its keys has finished, so the replies to
+    a single user come back in the order the messages arrived, while jobs for
+    different users run concurrently.
+
+    Coroutine functions are awaited on the loop instead, for backends that
+    already do their work elsewhere (like the kernel worker processes).
+
+    The queue is bounded in messages rather than jobs, as a job may answer a
+    whole batch of them: `pending` counts the `size` of every job running or
+    waiting, and the messages `reserve`d for jobs yet to come.
+    """
+
+    def __init__(self, workers: int, queue_depth: int) -> None:
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.pending = 0
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="aiml-inference"
+        )
+        self._tails: t.Dict[t.Hashable, asyncio.Future] = {}
+
+    def reserve(self, count: int = 1) -> None:
+        """
+        Count `count` messages as pending ahead of the job that will answer
+        them, which is then `run` with `reserved=True`.
+        """
+        if self.pending + count > self.queue_depth:
+            raise InferenceQueueFull(
+                f"{self.pending} inference messages pending (limit {self.queue_depth})"
+            )
+        self.pending += count
+
+    def release(self, count: int = 1) -> None:
+        """Give back messages reserved for a job that won't run after all."""
+        self.pending -= count
+
+    async def run(
+        self,
+        keys: t.Iterable[t.Hashable],
+        func: t.Callable,
+        *args: t.Any,
+        size: int = 1,
+        reserved: bool = False,
+    ) -> t.Any:
+        """
+        Run `func(*args)`, a job answering `size` messages, once earlier jobs
+        for the same keys are done.
+        """
+        if not reserved:
+            self.reserve(size)
+
+        loop = asyncio.get_running_loop()
+        keys = set(keys)
+        done = loop.create_future()
+
+        # Claim our place in the per-key queues before the first await, so the
+        # order is exactly the order in which `run` was called.
+        previous = {self._tails[key] for key in keys if key in self._tails}
+        for key in keys:
+            self._tails[key] = done
+
+        def release(_: t.Any = None) -> None:
+            self.release(size)
+            done.set_result(None)
+
+            for key in keys:
+                if self._tails.get(key) is done:
+                    del self._tails[key]
+
+        try:
+            if previous:
+                await asyncio.wait(previous)
+            if asyncio.iscoroutinefunction(func):
+                future = asyncio.ensure_future(func(*args))
+            else:
+                future = loop.run_in_executor(self._executor, func, *args)
+        except BaseException:
+            release()
+            raise
+
+        # Release the keys when the job really finishes, not when the awaiting
+        # task is cancelled, so the next job for the user can't overtake it.
+        future.add_done_callback(release)
+        return await asyncio.shield(future)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False)
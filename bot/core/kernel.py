@@ -0,0 +1,1034 @@
+import enum
+import functools
+import re
+import sys
+import threading
+import time
+import typing as t
+from collections import Counter, OrderedDict
+
+import aiml
+from aiml.PatternMgr import PatternMgr
+
+from bot.core.lazy import Graft, LazyTopics
+from bot.core.normalize import Normalizer, Sentence
+from bot.core.perf import StageTimings
+from bot.core.tenants import TenantOverlays
+from bot.core.utils import deep_size, paused_gc
+
+# Tags whose output depends on, or changes, anything besides the input itself.
+IMPURE_TAGS = frozenset(
+    {
+        "condition",
+        "date",
+        "get",
+        "gossip",
+        "id",
+        "input",
+        "javascript",
+        "learn",
+        "random",
+        "set",
+        "system",
+        "that",
+        "thatstar",
+        "topicstar",
+    }
+)
+# Tags that echo the matched input, and the ones that do so when used atomically.
+STAR_TAGS = frozenset({"star", "sr"})
+ATOMIC_STAR_TAGS = frozenset({"gender", "person", "person2"})
+
+
+class Purity(enum.Enum):
+    """Whether the response of a category can be cached, as far as loading can tell."""
+
+    PURE = "pure"
+    DYNAMIC = "dynamic"  # Pure, but `<srai>`s computed input, checked on every call
+    IMPURE = "impure"
+
+
+_PURITY_ORDER = [Purity.PURE, Purity.DYNAMIC, Purity.IMPURE]
+
+
+# A `<that>` subtree the matcher tried, and the template it gave.
+ContextGuard = t.Tuple[dict, t.Any]
+
+
+class Redirect(t.NamedTuple):
+    """Where a literal `<srai>` ends up after a chain of redirect categories."""
+
+    inputs: t.Tuple[str, ...]  # What every hop would have matched, in order
+    template: t.Optional[list]  # Template the last input reaches
+    guards: t.Tuple[ContextGuard, ...]
+
+
+class _Tracking(threading.local):
+    """The `<that>` subtrees entered by the matches of the current thread."""
+
+    visits: t.Optional[t.Dict[int, dict]] = None
+
+
+_tracking = _Tracking()
+
+
+class _ContextualThat(dict):
+    """`<that>` subtree of a pattern that doesn't accept any context."""
+
+    __slots__ = ()
+
+    def __contains__(self, key: t.Any) -> bool:
+        # Every match through the subtree starts with a membership test.
+        visits = _tracking.visits
+        if visits is not None:
+            visits[id(self)] = self
+
+        return dict.__contains__(self, key)
+
+
+class ContextTrackingPatternMgr(PatternMgr):
+    """
+    Pattern manager that records which matches depended on `<that>` or `<topic>`.
+
+    The parser gives every pattern a `*` that and topic, so a category only
+    depends on them if the `<that>` subtree at the end of its pattern has
+    anything but that default. `mark_contextual` swaps those subtrees for
+    ones that add themselves to `visits` (when set) as the matcher enters
+    them, even if it then backtracks out. Other subtrees are left untouched,
+    so matching doesn't slow down. Every `match` is reported to `observer`,
+    and the words of every input are passed to `loader` before matching.
+    Templates added are appended to `learned`, when set.
+
+    `overlay` makes a brain that starts out with this one's trie, and copies
+    the nodes along the path of every category added to it before changing
+    them. The rest stays shared, so `visits` belongs to the thread matching
+    rather than to either brain.
+
+    `compact` folds the default `<that>` subtree of a pattern, four dicts of
+    a single entry each, into a `_DEFAULT_CONTEXT` entry of its template.
+    The stock matcher can't walk those, so `prepare` unfolds them again.
+    """
+
+    # Key of the template of a pattern with the default that and topic, in
+    # place of its `<that>` subtree.
+    _DEFAULT_CONTEXT = 6
+    # Keys of the entries holding a template instead of a subtree.
+    _TEMPLATE_KEYS = (PatternMgr._TEMPLATE, _DEFAULT_CONTEXT)
+
+    def __init__(self) -> None:
+        super().__init__()
+
+        self.observer: t.Optional[t.Callable[[t.Any], None]] = None
+        self.loader: t.Optional[t.Callable[[t.Tuple[str, ...]], None]] = None
+        self.learned: t.Optional[t.List[t.Any]] = None
+
+        self.max_context_templates = 4096
+        self._context_templates: t.OrderedDict[t.Hashable, t.Any] = OrderedDict()
+        # IDs of the nodes an overlay has its own copy of, None for a brain
+        # that doesn't share its trie.
+        self._owned: t.Optional[t.Set[int]] = None
+
+    @property
+    def visits(self) -> t.Optional[t.Dict[int, dict]]:
+        return _tracking.visits
+
+    @visits.setter
+    def visits(self, visits: t.Optional[t.Dict[int, dict]]) -> None:
+        _tracking.visits = visits
+
+    def prepare(self) -> None:
+        """Get the fully loaded trie ready for matching."""
+        if self._owned is not None:
+            # What it shares was made ready along with the brain it overlays.
+            self._mark_owned()
+            return
+
+        self.unfold_default_contexts()
+        self.mark_contextual()
+
+    def overlay(self) -> "ContextTrackingPatternMgr":
+        """
+        A brain with the trie of this prepared one, which categories can be
+        added to without changing this one.
+        """
+        brain = type(self)()
+        brain._templateCount = self._templateCount
+        brain._botName = self._botName
+        brain._root = dict(self._root)
+        brain._owned = {id(brain._root)}
+
+        return brain
+
+    def compact(self, root: t.Optional[dict] = None) -> None:
+        """Fold the default `<that>` subtrees and intern the words of the trie."""
+        stack = [self._root if root is None else root]
+
+        while stack:
+            node = stack.pop()
+            for key in list(node):
+                child = node[key]
+                if type(key) is str:
+                    interned = sys.intern(key)
+                    if interned is not key:
+                        del node[key]
+                        node[interned] = child
+
+                if key == self._THAT and self._is_default_context(child):
+                    del node[key]
+                    topic = child[self._STAR][self._TOPIC]
+                    node[self._DEFAULT_CONTEXT] = topic[self._STAR][self._TEMPLATE]
+                elif key not in self._TEMPLATE_KEYS:
+                    stack.append(child)
+
+    def unfold_default_contexts(self) -> None:
+        """Turn the folded default contexts back into the subtrees the parser builds."""
+        stack = [self._root]
+
+        while stack:
+            node = stack.pop()
+            if self._DEFAULT_CONTEXT in node:
+                node[self._THAT] = self._default_context(
+                    node.pop(self._DEFAULT_CONTEXT)
+                )
+
+            for key, child in node.items():
+                if key not in self._TEMPLATE_KEYS:
+                    stack.append(child)
+
+    def _default_context(self, template: list) -> dict:
+        return {self._STAR: {self._TOPIC: {self._STAR: {self._TEMPLATE: template}}}}
+
+    def add(self, data: t.Tuple[str, str, str], template: list) -> None:
+        # `<learn>` can add categories once the trie is compacted, and the
+        # stock `add` needs the default context of the pattern unfolded.
+        pattern, context = self._keys(data)
+        if self._owned is not None:
+            node = self._own(self._root, pattern)
+        else:
+            node = self._root
+            for key in pattern:
+                node = node.get(key)
+                if node is None:
+                    break
+
+        if node is not None and self._DEFAULT_CONTEXT in node:
+            node[self._THAT] = self._default_context(node.pop(self._DEFAULT_CONTEXT))
+        if self._owned is not None:
+            self._own(node, context)
+
+        super().add(data, template)
+        if self.learned is not None:
+            self.learned.append(template)
+
+    def _keys(
+        self, data: t.Tuple[str, str, str]
+    ) -> t.Tuple[t.List[t.Any], t.List[t.Any]]:
+        """The keys the stock `add` walks down for the pattern, and then the context."""
+        pattern, that, topic = data
+        wildcards = {"_": self._UNDERSCORE, "*": self._STAR}
+        pattern_wildcards = {**wildcards, "BOT_NAME": self._BOT_NAME}
+
+        context = []
+        if that:
+            context += [self._THAT] + [wildcards.get(w, w) for w in that.split()]
+        if topic:
+            context += [self._TOPIC] + [wildcards.get(w, w) for w in topic.split()]
+
+        return [pattern_wildcards.get(w, w) for w in pattern.split()], context
+
+    def _own(self, node: dict, keys: t.Iterable[t.Any]) -> dict:
+        """
+        Walk the `keys` down from an owned `node`, copying the shared nodes
+        on the way and adding those that are missing. Returns the last one.
+        """
+        owned = self._owned
+        for key in keys:
+            child = node.get(key)
+            if child is None:
+                child = node[key] = {}
+            elif id(child) not in owned:
+                child = node[key] = type(child)(child)
+            owned.add(id(child))
+            node = child
+
+        return node
+
+    def _mark_owned(self) -> int:
+        """`mark_contextual` for the nodes an overlay owns, returning the count."""
+        owned = self._owned
+        count = 0
+        stack = [self._root]
+
+        while stack:
+            node = stack.pop()
+            for key, child in node.items():
+                if key in self._TEMPLATE_KEYS or id(child) not in owned:
+                    continue
+
+                if key == self._THAT:
+                    if type(child) is dict and not self._is_default_context(child):
+                        node[key] = that = _ContextualThat(child)
+                        owned.discard(id(child))
+                        owned.add(id(that))
+                        count += 1
+                else:
+                    stack.append(child)
+
+        return count
+
+    def mark_contextual(self, root: t.Optional[dict] = None) -> int:
+        """Wrap the `<that>` subtrees that aren't the default one, returning their count."""
+        count = 0
+        stack = [self._root if root is None else root]
+
+        while stack:
+            node = stack.pop()
+            for key, child in node.items():
+                if key == self._THAT:
+                    if not self._is_default_context(child):
+                        node[key] = _ContextualThat(child)
+                        count += 1
+                elif key not in self._TEMPLATE_KEYS:
+                    stack.append(child)
+
+        return count
+
+    def graft(self, path: Graft, subtree: dict) -> None:
+        """Hang a parsed `subtree` below the pattern words of `path`."""
+        self.mark_contextual(subtree)
+
+        node = self._root
+        for word in path[:-1]:
+            node = node[word]
+        node[sys.intern(path[-1])] = subtree
+
+    def prune(self, path: Graft) -> dict:
+        """Take the subtree below the pattern words of `path` out again, returning it."""
+        node = self._root
+        for word in path[:-1]:
+            node = node[word]
+
+        # Its `<that>` subtrees go with it, and their IDs may be reused.
+        self._context_templates.clear()
+        return node.pop(path[-1])
+
+    def _is_default_context(self, that: dict) -> bool:
+        try:
+            topic = that[self._STAR][self._TOPIC]
+            return (
+                len(that) == 1
+                and len(that[self._STAR]) == 1
+                and len(topic) == 1
+                and list(topic[self._STAR]) == [self._TEMPLATE]
+            )
+        except KeyError:
+            return False
+
+    def split(self, text: str) -> t.Tuple[str, ...]:
+        """Uppercase `text` and split it into words without punctuation."""
+        return tuple(re.sub(self._puncStripRE, " ", text.upper()).split())
+
+    def context_words(
+        self, that: str, topic: str
+    ) -> t.Tuple[t.Tuple[str, ...], t.Tuple[str, ...]]:
+        """Split `that` and `topic` into words the way `match` does."""
+        if that.strip() == "":
+            that = "ULTRABOGUSDUMMYTHAT"
+        if topic.strip() == "":
+            topic = "ULTRABOGUSDUMMYTOPIC"
+
+        return self.split(that), self.split(topic)
+
+    def guards(
+        self, subtrees: t.Iterable[dict], that_words: list, topic_words: list
+    ) -> t.Tuple[ContextGuard, ...]:
+        """Pair each `<that>` subtree with the template it gives in this context."""
+        context = (tuple(that_words), tuple(topic_words))
+        return tuple(
+            (subtree, self._context_template(subtree, context)) for subtree in subtrees
+        )
+
+    def check_guards(
+        self, guards: t.Iterable[ContextGuard], that_words: list, topic_words: list
+    ) -> bool:
+        """Whether every guarded `<that>` subtree still gives the same template."""
+        context = (tuple(that_words), tuple(topic_words))
+        return all(
+            self._context_template(subtree, context) is template
+            for subtree, template in guards
+        )
+
+    def _context_template(
+        self, subtree: dict, context: t.Tuple[t.Tuple[str, ...], t.Tuple[str, ...]]
+    ) -> t.Any:
+        # The same few subtrees are checked against the same bot outputs over
+        # and over, and matching those can cost as much as a whole input.
+        key = (id(subtree), context)
+        results = self._context_templates
+        if key in results:
+            results.move_to_end(key)
+            return results[key]
+
+        template = self._match(list(context[0]), [], list(context[1]), subtree)[1]
+        results[key] = template
+        if len(results) > self.max_context_templates:
+            results.popitem(last=False)
+
+        return template
+
+    def match(self, pattern: str, that: str, topic: str) -> t.Any:
+        if len(pattern) == 0:
+            return self._matched(None)
+
+        return self.match_words(self.split(pattern), *self.context_words(that, topic))
+
+    def match_words(
+        self,
+        words: t.Tuple[str, ...],
+        that_words: t.Sequence[str],
+        topic_words: t.Sequence[str],
+    ) -> t.Any:
+        """`match` for an input and context that are already split into words."""
+        return self.match_pattern(words, that_words, topic_words)[1]
+
+    def match_pattern(
+        self,
+        words: t.Tuple[str, ...],
+        that_words: t.Sequence[str],
+        topic_words: t.Sequence[str],
+    ) -> t.Tuple[t.Optional[t.Sequence[t.Any]], t.Any]:
+        """`match_words`, along with the keys of the pattern that matched."""
+        if self.loader is not None:
+            self.loader(words)
+
+        pattern, template = self._match(words, that_words, topic_words, self._root)
+        return pattern, self._matched(template)
+
+    @classmethod
+    def pattern_text(cls, keys: t.Optional[t.Sequence[t.Any]]) -> str:
+        """The input part of a matched pattern as written in AIML, "" for none."""
+        names = {cls._STAR: "*", cls._UNDERSCORE: "_"}
+        words = []
+        for key in keys or ():
+            if key == cls._THAT or key == cls._TOPIC:
+                break
+            words.append(names.get(key, key))
+
+        return " ".join(words)
+
+    def _matched(self, template: t.Any) -> t.Any:
+        if self.observer is not None:
+            self.observer(template)
+
+        return template
+
+
+class ResponseCache:
+    """
+    Bounded LRU cache of responses, counting hits and misses.
+
+    Each response is stored with the pattern it matched and the context
+    guards it was produced under, and only counts as a hit if `guards_hold`
+    accepts them.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+
+        self.hits = 0
+        self.misses = 0
+        self.uncacheable = 0
+        self.evictions = 0
+
+        self._entries: t.OrderedDict[
+            t.Hashable, t.Tuple[str, str, t.Tuple[ContextGuard, ...]]
+        ] = OrderedDict()
+
+    def get(
+        self,
+        keys: t.Iterable[t.Hashable],
+        guards_hold: t.Callable[[t.Tuple[ContextGuard, ...]], bool],
+    ) -> t.Optional[t.Tuple[str, str]]:
+        """The response and pattern under the first of `keys` whose guards hold."""
+        for key in keys:
+            entry = self._entries.get(key)
+            if entry is not None and guards_hold(entry[2]):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0], entry[1]
+
+        self.misses += 1
+        return None
+
+    def put(
+        self,
+        key: t.Hashable,
+        response: str,
+        pattern: str,
+        guards: t.Iterable[ContextGuard],
+    ) -> None:
+        self._entries[key] = (response, pattern, tuple(guards))
+        self._entries.move_to_end(key)
+
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> t.Dict[str, int]:
+        return {
+            "cached": len(self._entries),
+            "cache_hits": self.hits,
+            "cache_misses": self.misses,
+            "cache_uncacheable": self.uncacheable,
+            "cache_evictions": self.evictions,
+        }
+
+
+class _Frame:
+    """What a single top-level `_respond` call turned out to depend on."""
+
+    __slots__ = ("cacheable", "echoes_input", "matched", "visits")
+
+    def __init__(self) -> None:
+        self.cacheable = True
+        self.echoes_input = False
+        self.matched = False
+        self.visits: t.Dict[int, dict] = {}
+
+
+class CachingKernel(aiml.Kernel):
+    """
+    AIML kernel that memoizes the responses of stateless categories.
+
+    `analyze` classifies every category once the brain is loaded, following
+    literal `<srai>`s to their targets. A response is cached by its normalized
+    input when every category involved in producing it is pure. If a match
+    along the way went through a `<that>` specific pattern, the entry is only
+    reused while the current `<that>` and topic lead to the same templates.
+    Categories that echo the input (`<star/>` and friends) are cached by the
+    input with its case and punctuation kept, all others by the words the
+    matcher sees.
+
+    Literal `<srai>`s listed in `redirects` (see `bot.core.redirects`) go
+    straight to the template their chain of redirect categories ends at,
+    as long as the chain's guards hold.
+
+    With `lazy` set, inputs that may reach a topic it hasn't loaded yet are
+    neither followed by the redirects nor by the analysis, and the categories
+    it grafts in are classified as they come.
+
+    `overlay` makes a kernel with categories of its own learned on top of
+    this one's, and `tenants` (when set) keeps those of the bot's tenants.
+
+    How long each sentence takes to normalize, match and evaluate, and how
+    deep its `<srai>`s go, is recorded in `timings`.
+    """
+
+    def __init__(
+        self,
+        cache_size: int = 10000,
+        matcher: t.Type[ContextTrackingPatternMgr] = ContextTrackingPatternMgr,
+        ignored_characters: str = "",
+        timings: t.Optional[StageTimings] = None,
+    ) -> None:
+        super().__init__()
+
+        self._brain = matcher()
+        self._brain.observer = self._observe_match
+        self.cache = ResponseCache(cache_size)
+
+        self.purity: t.Dict[int, Purity] = {}
+        self._uncacheable: t.Set[int] = set()
+        self._echoing: t.Set[int] = set()
+        self._frame: t.Optional[_Frame] = None
+
+        self.timings = timings if timings is not None else StageTimings()
+        # Nested `_respond`s of the sentence being answered, and the most so far.
+        self._depth = 0
+        self._max_depth = 0
+
+        # `<srai>` elements, by ID, that can skip straight to their final template.
+        self.redirects: t.Dict[int, Redirect] = {}
+        self.lazy: t.Optional[LazyTopics] = None
+        self.tenants: t.Optional[TenantOverlays] = None
+
+        self.normalizer = Normalizer(self._subbers["normal"], ignored_characters)
+        # Bytes the brain takes up, as of `measure` and adjusted since.
+        self._memory = Counter(trie=0, templates=0)
+
+        self.max_contexts = 1024
+        self._contexts: t.OrderedDict[
+            t.Tuple[str, str], t.Tuple[t.Tuple[str, ...], t.Tuple[str, ...]]
+        ] = OrderedDict()
+
+    def overlay(self) -> "CachingKernel":
+        """
+        A kernel answering from an overlay of this one's prepared brain, to
+        learn more categories into. Sessions are shared, under the same lock,
+        as are the substitutions and bot predicates. The analysis, redirects
+        and cache of its categories are its own to build.
+        """
+        kernel = type(self)(
+            self.cache.max_size,
+            type(self._brain),
+            self.normalizer.ignored_characters,
+            self.timings,
+        )
+        kernel._verboseMode = self._verboseMode
+        kernel._brain = self._brain.overlay()
+        kernel._brain.observer = kernel._observe_match
+
+        kernel._subbers = self._subbers
+        kernel._botPredicates = self._botPredicates
+        kernel._maxHistorySize = self._maxHistorySize
+        kernel._maxRecursionDepth = self._maxRecursionDepth
+        kernel._respondLock = self._respondLock
+        kernel._sessions = self._sessions
+
+        return kernel
+
+    # -- Load-time analysis --
+    def compact(self) -> None:
+        """
+        Shrink a freshly parsed brain, before it is snapshotted.
+
+        Loading the compact brain from a snapshot builds it that way from the
+        start. Compacting one that is already loaded frees the memory only to
+        the interpreter, since what remains is scattered across its arenas.
+        """
+        with paused_gc():
+            self._brain.compact()
+            self.share_templates()
+
+    def prepare(self) -> None:
+        """Get the brain ready for matching once it is fully loaded."""
+        with paused_gc():
+            self._brain.prepare()
+
+        # Substitutions may have been reloaded since the kernel was created.
+        self.normalizer = Normalizer(
+            self._subbers["normal"], self.normalizer.ignored_characters
+        )
+        self._contexts.clear()
+
+    def share_templates(self, root: t.Optional[dict] = None) -> None:
+        """
+        Parse the text of every template once, and share identical elements.
+
+        python-aiml collapses the whitespace of text elements in place the
+        first time it evaluates them. Doing that up front leaves templates
+        unchanged by evaluation, so categories (and parts of templates) that
+        are the same can all point at a single copy.
+        """
+        elements: t.Dict[t.Hashable, list] = {}
+        attributes: t.Dict[t.Hashable, dict] = {}
+
+        def share(element: list) -> list:
+            tag, attrs = element[0], element[1]
+            if tag == "text":
+                children = [self._text(element)]
+                attrs = {**attrs, "xml:space": "preserve"}
+            else:
+                children = [share(child) for child in element[2:]]
+
+            attrs = attributes.setdefault(tuple(sorted(attrs.items())), attrs)
+            key = (tag, id(attrs)) + tuple(
+                child if type(child) is str else id(child) for child in children
+            )
+            return elements.setdefault(key, [tag, attrs, *children])
+
+        stack = [self._brain._root if root is None else root]
+        while stack:
+            node = stack.pop()
+            for key, child in node.items():
+                if key in ContextTrackingPatternMgr._TEMPLATE_KEYS:
+                    node[key] = share(child)
+                else:
+                    stack.append(child)
+
+    def analyze(self) -> t.Dict[str, int]:
+        """Classify every category of the prepared brain, returning the counts."""
+        self.cache.clear()
+
+        self.purity = {}
+        self._echoing = set()
+        with paused_gc():
+            for template in self._templates():
+                self._classify(template, ())
+
+        self._uncacheable = {
+            key for key, purity in self.purity.items() if purity is Purity.IMPURE
+        }
+
+        counts = Counter(purity.value for purity in self.purity.values())
+        return {purity.value: counts[purity.value] for purity in Purity}
+
+    def graft(self, subtrees: t.Mapping[Graft, dict]) -> None:
+        """Add the categories of a lazy topic to the prepared, analyzed brain."""
+        with paused_gc():
+            for path, subtree in subtrees.items():
+                # Within the subtree only, since pruning goes by template IDs.
+                self.share_templates(subtree)
+                self._brain.graft(path, subtree)
+
+            for subtree in subtrees.values():
+                self._memory.update(self._measure(subtree))
+
+            # Once all are in, for the `<srai>`s between them.
+            if self.purity:
+                for subtree in subtrees.values():
+                    for template in self._templates(subtree):
+                        if self._classify(template, ()) is Purity.IMPURE:
+                            self._uncacheable.add(id(template))
+
+    def prune(self, paths: t.Iterable[Graft]) -> None:
+        """Remove the categories of a lazy topic `graft` added."""
+        for path in paths:
+            subtree = self._brain.prune(path)
+            self._memory.subtract(self._measure(subtree))
+            for template in self._templates(subtree):
+                key = id(template)
+                self.purity.pop(key, None)
+                self._echoing.discard(key)
+                self._uncacheable.discard(key)
+
+        # Cached responses may guard on its `<that>` subtrees.
+        self.cache.clear()
+
+    def _templates(self, root: t.Optional[dict] = None) -> t.Iterator[list]:
+        stack = [self._brain._root if root is None else root]
+
+        while stack:
+            node = stack.pop()
+            for key, child in node.items():
+                if key in ContextTrackingPatternMgr._TEMPLATE_KEYS:
+                    yield child
+                else:
+                    stack.append(child)
+
+    def measure(self) -> None:
+        """
+        Measure the loaded brain for `brain_memory`, which takes long enough
+        on a large one that it is only done once. Lazy topics grafted in or
+        pruned and categories learned later are counted as they come and go.
+        """
+        with self._respondLock:
+            self._memory = self._measure(self._brain._root)
+
+    def _measure(self, root: dict) -> t.Counter[str]:
+        seen: t.Set[int] = set()
+        templates = sum(deep_size(template, seen) for template in self._templates(root))
+        # With the templates seen already, only the trie itself is left.
+        trie = deep_size(root, seen)
+
+        return Counter(trie=trie, templates=templates)
+
+    def learn(self, filename: str) -> None:
+        # Only `<learn>` gets here, the corpus is compiled without it. The
+        # templates it adds are counted, not the few trie nodes on their way.
+        self._brain.learned = learned = []
+        try:
+            super().learn(filename)
+        finally:
+            self._brain.learned = None
+
+        seen: t.Set[int] = set()
+        self._memory["templates"] += sum(
+            deep_size(template, seen) for template in learned
+        )
+
+    def brain_memory(self) -> t.Dict[str, int]:
+        """Bytes taken up by the pattern trie and by the templates it leads to."""
+        return dict(self._memory)
+
+    def session_memory(self) -> t.Dict[str, int]:
+        """Bytes taken up by the sessions held in memory."""
+        seen: t.Set[int] = set()
+        with self._respondLock:
+            return {
+                "sessions": sum(
+                    deep_size(session, seen) for session in self._sessions.resident()
+                )
+            }
+
+    def _classify(self, template: list, chain: t.Tuple[int, ...]) -> Purity:
+        key = id(template)
+        if key in self.purity:
+            return self.purity[key]
+        if key in chain or len(chain) > self._maxRecursionDepth:
+            # Recursive `<srai>`s only end at the recursion limit.
+            return Purity.IMPURE
+
+        purity = Purity.PURE
+        stack = list(template[2:])
+
+        while stack and purity is not Purity.IMPURE:
+            element = stack.pop()
+            tag, children = element[0], element[2:]
+
+            if tag in IMPURE_TAGS:
+                purity = Purity.IMPURE
+            elif tag in STAR_TAGS or (tag in ATOMIC_STAR_TAGS and not children):
+                self._echoing.add(key)
+
+            if tag == "srai" and all(child[0] == "text" for child in children):
+                target_purity = self._classify_srai(
+                    "".join(self._text(child) for child in children), chain + (key,)
+                )
+                purity = max(purity, target_purity, key=_PURITY_ORDER.index)
+            elif tag != "text":
+                if tag in {"srai", "sr"}:
+                    purity = max(purity, Purity.DYNAMIC, key=_PURITY_ORDER.index)
+                stack.extend(children)
+
+        self.purity[key] = purity
+        return purity
+
+    def _classify_srai(self, text: str, chain: t.Tuple[int, ...]) -> Purity:
+        text = self._subbers["normal"].sub(text)
+        if self.lazy is not None:
+            # What it reaches in a topic that isn't loaded can't be told yet.
+            unit = self.lazy.unit(self._brain.split(text))
+            if unit is not None and not unit.loaded:
+                return Purity.IMPURE
+
+        self._brain.visits = {}
+        try:
+            target = self._brain.match(text, "", "")
+            context_dependent = bool(self._brain.visits)
+        finally:
+            self._brain.visits = None
+
+        if target is None:
+            purity = Purity.PURE
+        else:
+            purity = self._classify(target, chain)
+
+        # Which category the input reaches depends on the conversation, so
+        # that can only be decided (and guarded against) once it is known.
+        if context_dependent and purity is Purity.PURE:
+            purity = Purity.DYNAMIC
+
+        return purity
+
+    @staticmethod
+    def _text(element: list) -> str:
+        if element[1].get("xml:space") == "default":
+            return re.sub(r"\s+", " ", element[2])
+        return element[2]
+
+    # -- Responding --
+    def normalize(self, text: str) -> t.List[Sentence]:
+        """Split a message into the sentences `respond` answers one by one."""
+        return self.normalizer.normalize(text)
+
+    def respond(
+        self, input_: str, sessionID: t.Any = aiml.Kernel._globalSessionID
+    ) -> str:
+        """Stock `respond`, with every sentence normalized in one pass up front."""
+        return self.respond_matched(input_, sessionID)[0]
+
+    def respond_matched(
+        self, input_: str, sessionID: t.Any = aiml.Kernel._globalSessionID
+    ) -> t.Tuple[str, t.Tuple[str, ...]]:
+        """
+        `respond`, along with the pattern each sentence of the input matched,
+        as written in AIML, or "" for those that matched none.
+        """
+        start = time.perf_counter()
+        sentences = self.normalize(input_)
+        self.timings.observe("normalize", time.perf_counter() - start)
+        if not sentences:
+            return "", ()
+
+        with self._respondLock:
+            self._addSession(sessionID)
+
+            responses = []
+            patterns = []
+            for sentence in sentences:
+                # The input goes into the history first, for `<input/>`.
+                self._remember(self._inputHistory, sentence.text, sessionID)
+                response, pattern = self._respond_sentence(sentence, sessionID)
+                self._remember(self._outputHistory, response, sessionID)
+
+                responses.append(response)
+                patterns.append(pattern)
+
+            return "  ".join(responses).strip(), tuple(patterns)
+
+    def _remember(self, history: str, entry: str, sessionID: t.Any) -> None:
+        entries = self.getPredicate(history, sessionID)
+        entries.append(entry)
+        if len(entries) > self._maxHistorySize:
+            del entries[: len(entries) - self._maxHistorySize]
+
+        self.setPredicate(history, entries, sessionID)
+
+    def _respond_sentence(
+        self, sentence: Sentence, sessionID: t.Any
+    ) -> t.Tuple[str, str]:
+        if not sentence.text:
+            return "", ""
+        # Without `<that>` or topic words the stock matcher finds nothing at
+        # all, which no guard would tell apart from the context it was cached in.
+        if not self.purity or not all(self._context_words(sessionID)):
+            return self._respond_words(sentence, sessionID)
+
+        key = sentence.key
+        cached = self.cache.get(
+            (sentence.words, key), functools.partial(self._guards_hold, sessionID)
+        )
+        if cached is not None:
+            return cached
+
+        self._frame = frame = _Frame()
+        self._brain.visits = frame.visits
+        try:
+            response, pattern = self._respond_words(sentence, sessionID)
+        finally:
+            self._frame = None
+            self._brain.visits = None
+
+        if frame.cacheable:
+            guards = ()
+            if frame.visits:
+                guards = self._brain.guards(
+                    frame.visits.values(), *self._context_words(sessionID)
+                )
+
+            self.cache.put(
+                key if frame.echoes_input else sentence.words,
+                response,
+                pattern,
+                guards,
+            )
+        else:
+            self.cache.uncacheable += 1
+
+        return response, pattern
+
+    def _respond_words(self, sentence: Sentence, sessionID: t.Any) -> t.Tuple[str, str]:
+        """
+        Stock `_respond` for a top-level sentence, without normalizing it
+        again, and the pattern it matched.
+        """
+        input_stack = self.getPredicate(self._inputStack, sessionID)
+        input_stack.append(sentence.text)
+
+        timings = self.timings
+        start = time.perf_counter()
+        keys, template = self._brain.match_pattern(
+            sentence.words, *self._context_words(sessionID)
+        )
+        timings.observe("match", time.perf_counter() - start)
+
+        response = ""
+        if template is not None:
+            self._max_depth = 0
+            start = time.perf_counter()
+            response = self._processElement(template, sessionID).strip()
+            # Which includes matching and evaluating the `<srai>`s in it.
+            timings.observe("template", time.perf_counter() - start)
+            timings.observe("srai_depth", self._max_depth)
+
+        input_stack.pop()
+        return response, self._brain.pattern_text(keys)
+
+    def _respond(self, input_: str, sessionID: t.Any) -> str:
+        # Only `<srai>` and `<sr>` get here, `respond` has its own way down.
+        self._depth += 1
+        if self._depth > self._max_depth:
+            self._max_depth = self._depth
+
+        try:
+            if self._frame is not None:
+                return self._respond_nested(input_, sessionID)
+
+            return super()._respond(input_, sessionID)
+        finally:
+            self._depth -= 1
+
+    def _respond_nested(self, input_: str, sessionID: t.Any) -> str:
+        input_stack = self.getPredicate(self._inputStack, sessionID)
+        if len(input_stack) > self._maxRecursionDepth:
+            self._frame.cacheable = False
+
+        return super()._respond(input_, sessionID)
+
+    def _processSrai(self, elem: list, sessionID: t.Any) -> str:
+        redirect = self.redirects.get(id(elem))
+        if redirect is None:
+            return super()._processSrai(elem, sessionID)
+
+        # Stock AIML gives up at the recursion limit somewhere along the chain,
+        # and matches nothing in a context without words.
+        input_stack = self.getPredicate(self._inputStack, sessionID)
+        if (
+            len(input_stack) + len(redirect.inputs) - 1 > self._maxRecursionDepth
+            or not all(self._context_words(sessionID))
+            or not self._guards_hold(sessionID, redirect.guards)
+        ):
+            return super()._processSrai(elem, sessionID)
+
+        if self._brain.visits is not None:
+            self._brain.visits.update(
+                (id(subtree), subtree) for subtree, _ in redirect.guards
+            )
+        if redirect.template is None:
+            return ""
+
+        self._observe_match(redirect.template)
+
+        # Later hops would have stacked these inputs, which `<star/>` reads.
+        input_stack.extend(redirect.inputs)
+        response = self._processElement(redirect.template, sessionID).strip()
+        del input_stack[-len(redirect.inputs) :]
+
+        return response
+
+    def _context_words(
+        self, sessionID: t.Any
+    ) -> t.Tuple[t.Tuple[str, ...], t.Tuple[str, ...]]:
+        output_history = self.getPredicate(self._outputHistory, sessionID)
+        that = output_history[-1] if output_history else ""
+        topic = self.getPredicate("topic", sessionID)
+
+        # Needed for every match, cache lookup and redirect, while the bot
+        # only says so many different things.
+        context = (that, topic)
+        words = self._contexts.get(context)
+        if words is None:
+            words = self._brain.context_words(
+                self._subbers["normal"].sub(that), self._subbers["normal"].sub(topic)
+            )
+            self._contexts[context] = words
+            if len(self._contexts) > self.max_contexts:
+                self._contexts.popitem(last=False)
+        else:
+            self._contexts.move_to_end(context)
+
+        return words
+
+    def _guards_hold(
+        self, sessionID: t.Any, guards: t.Tuple[ContextGuard, ...]
+    ) -> bool:
+        if not guards:
+            return True
+
+        return self._brain.check_guards(guards, *self._context_words(sessionID))
+
+    def _observe_match(self, template: t.Any) -> None:
+        frame = self._frame
+        if frame is None:
+            return
+
+        if id(template) in self._uncacheable:
+            frame.cacheable = False
+            self._brain.visits = None
+        if not frame.matched:
+            frame.matched = True
+            frame.echoes_input = id(template) in self._echoing
@@ -0,0 +1,223 @@
+import json
+import os
+import time
+import typing as t
+from pathlib import Path
+
+from loguru import logger
+
+from bot.core.compiler import CategoryKey, merge_trie, parse_file
+from bot.core.utils import paused_gc
+
+# The words of the pattern path from the root to a lazily loaded subtree.
+Graft = t.Tuple[str, ...]
+
+
+class LazyFile(t.NamedTuple):
+    """The lazy part of a topic file: where it hangs and which categories are in it."""
+
+    grafts: t.FrozenSet[Graft]
+    categories: t.FrozenSet[CategoryKey]
+    # Categories of the file loaded up front, without which it isn't parsed then.
+    eager: int
+
+
+def save_manifest(
+    files: t.Mapping[Path, LazyFile], root: Path, path: Path, digest: bytes
+) -> None:
+    """Write the lazy files of the corpus `digest` for `load_manifest`."""
+    manifest = {
+        "digest": digest.hex(),
+        "files": {
+            file.relative_to(root).as_posix(): {
+                "grafts": sorted(lazy.grafts),
+                "categories": sorted(lazy.categories),
+                "eager": lazy.eager,
+            }
+            for file, lazy in files.items()
+        },
+    }
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    temp_path.write_text(json.dumps(manifest))
+    os.replace(temp_path, path)
+
+
+def load_manifest(
+    path: Path, root: Path, digest: bytes
+) -> t.Optional[t.Dict[Path, LazyFile]]:
+    """
+    Read the lazy files from a manifest written by `save_manifest`, or None if
+    it is missing, unreadable or was made for another corpus.
+    """
+    try:
+        manifest = json.loads(path.read_text())
+    except FileNotFoundError:
+        return None
+    except ValueError as exc:
+        logger.warning(f"Discarding unreadable AIML lazy manifest {path}: {exc!r}")
+        return None
+
+    if manifest.get("digest") != digest.hex():
+        return None
+
+    return {
+        root
+        / name: LazyFile(
+            frozenset(map(tuple, lazy["grafts"])),
+            frozenset(map(tuple, lazy["categories"])),
+            lazy["eager"],
+        )
+        for name, lazy in manifest["files"].items()
+    }
+
+
+class LazyUnit:
+    """Lazy files sharing a graft, which are loaded and unloaded together."""
+
+    def __init__(self, files: t.List[Path], grafts: t.Set[Graft]) -> None:
+        self.files = files
+        self.grafts = grafts
+
+        self.loaded = False
+        self.last_used = 0.0
+
+
+class LazyTopics:
+    """
+    Graft the categories of topic files into the trie when an input needs them.
+
+    Each lazy category hangs below a graft, the first node on its pattern's
+    path that no category loaded up front goes through. A node has one path
+    of words from the root, so the matcher can only reach that subtree, and
+    tell it apart from no subtree at all, for inputs starting with those
+    words. Grafting a unit's subtrees before matching such an input gives
+    the same answer as a brain with everything loaded from the start.
+
+    `ensure` is meant to run before every match, and grafts subtrees in with
+    `graft`. Units unused for `idle` seconds are taken out again with `prune`,
+    which it checks every `sweep_interval` seconds at most.
+    """
+
+    def __init__(
+        self,
+        files: t.Mapping[Path, LazyFile],
+        graft: t.Callable[[t.Mapping[Graft, dict]], None],
+        prune: t.Callable[[t.Iterable[Graft]], None],
+        idle: float = 30 * 60,
+        sweep_interval: float = 60,
+    ) -> None:
+        self.graft = graft
+        self.prune = prune
+        self.idle = idle
+        self.sweep_interval = sweep_interval
+
+        self.loads = 0
+        self.unloads = 0
+        self._last_sweep = time.monotonic()
+
+        self.units: t.List[LazyUnit] = []
+        self._units: t.Dict[Graft, LazyUnit] = {}
+        for path, lazy in files.items():
+            self._add(path, lazy.grafts)
+
+        # Files sharing a graft make one unit, parsed in load order.
+        order = {path: index for index, path in enumerate(files)}
+        for unit in self.units:
+            unit.files.sort(key=order.__getitem__)
+
+        self._depths = sorted({len(graft) for graft in self._units})
+        self._first_words = {graft[0] for graft in self._units}
+
+    def _add(self, path: Path, grafts: t.Iterable[Graft]) -> None:
+        merged = {id(self._units[graft]) for graft in grafts if graft in self._units}
+        unit = LazyUnit([], set(grafts))
+        for other in self.units:
+            if id(other) in merged:
+                unit.files += other.files
+                unit.grafts |= other.grafts
+        unit.files.append(path)
+
+        self.units = [other for other in self.units if id(other) not in merged]
+        self.units.append(unit)
+        for graft in unit.grafts:
+            self._units[graft] = unit
+
+    def unit(self, words: t.Sequence[str]) -> t.Optional[LazyUnit]:
+        """The unit whose subtree an input with these words may reach, if any."""
+        if not words or words[0] not in self._first_words:
+            return None
+
+        for depth in self._depths:
+            unit = self._units.get(tuple(words[:depth]))
+            if unit is not None:
+                return unit
+
+        return None
+
+    def ensure(self, words: t.Sequence[str]) -> None:
+        """Graft in what matching `words` may need, and prune what went cold."""
+        now = time.monotonic()
+
+        unit = self.unit(words)
+        if unit is not None:
+            # First, so a sweep while it loads leaves it alone.
+            unit.last_used = now
+            if not unit.loaded:
+                self._load(unit)
+
+        if now - self._last_sweep >= self.sweep_interval:
+            self.sweep(now)
+
+    def sweep(self, now: float) -> None:
+        """Prune the units unused for `idle` seconds."""
+        self._last_sweep = now
+        for unit in self.units:
+            if unit.loaded and now - unit.last_used > self.idle:
+                self._unload(unit)
+
+    def _load(self, unit: LazyUnit) -> None:
+        start = time.perf_counter()
+
+        trie: dict = {}
+        with paused_gc():
+            for path in unit.files:
+                file_trie = parse_file(str(path))[0]
+                if file_trie is not None:
+                    merge_trie(trie, file_trie)
+
+        subtrees = {}
+        for graft in unit.grafts:
+            node = trie
+            for word in graft:
+                node = node.get(word)
+                if node is None:
+                    break
+            else:
+                subtrees[graft] = node
+
+        # Classifying its categories matches inputs of its own.
+        unit.loaded = True
+        self.graft(subtrees)
+
+        self.loads += 1
+        logger.info(
+            f"Loaded lazy AIML topic {', '.join(path.name for path in unit.files)} "
+            f"in {(time.perf_counter() - start) * 1000:.0f}ms"
+        )
+
+    def _unload(self, unit: LazyUnit) -> None:
+        self.prune(unit.grafts)
+        unit.loaded = False
+        self.unloads += 1
+        logger.info(
+            f"Unloaded cold lazy AIML topic {', '.join(path.name for path in unit.files)}"
+        )
+
+    def stats(self) -> t.Dict[str, int]:
+        return {
+            "lazy_loaded": sum(unit.loaded for unit in self.units),
+            "lazy_loads": self.loads,
+            "lazy_unloads": self.unloads,
+        }
@@ -0,0 +1,316 @@
+import functools
+import typing as t
+
+from bot.core.kernel import ContextTrackingPatternMgr
+from bot.core.lazy import Graft
+from bot.core.normalize import split_words
+
+# A pending call of the matcher: node, words, position in the words, `<that>`
+# words, topic words and the reversed path that led there.
+_Task = t.Tuple[dict, t.Sequence[str], int, t.Sequence[str], t.Sequence[str], tuple]
+
+_words = functools.lru_cache(maxsize=4096)(split_words)
+
+
+class FastPatternMgr(ContextTrackingPatternMgr):
+    """
+    Drop-in replacement for python-aiml's recursive pattern matcher.
+
+    The trie is walked with an explicit stack instead of recursion, visiting
+    nodes in the stock priority order (`_`, the word itself, the bot name,
+    `*`), so it returns the same template for every input. Wildcards only
+    try the positions at which their subtree can continue, and inputs are
+    split into interned words once and memoized.
+
+    Patterns without wildcards are also kept in an exact-match index. An
+    input found there only has to rule out the `_` branches along its path,
+    since those take priority over exact words, before the indexed template
+    can be returned.
+
+    Unlike the stock matcher, it walks a compacted trie as it is, taking the
+    template of a folded default context for any that and topic with words.
+
+    An overlay starts out with a copy of the index. The patterns a category
+    added to it can change the result of are those below the words before
+    its first `_`, or below the whole pattern if it has no wildcards, which
+    are indexed again once it is prepared.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+
+        # Words of a pattern -> its template and the `_` subtrees to rule
+        # out first, with the position they would start matching at.
+        self.exact: t.Dict[
+            t.Tuple[str, ...], t.Tuple[t.Any, t.Tuple[t.Tuple[int, dict], ...]]
+        ] = {}
+        # Words below which an overlay's index is out of date.
+        self._stale: t.Set[t.Tuple[str, ...]] = set()
+
+    def prepare(self) -> None:
+        if self._owned is None:
+            self.mark_contextual()
+            self._index_exact()
+            return
+
+        super().prepare()
+        self._reindex(self._stale)
+        self._stale = set()
+
+    def overlay(self) -> "FastPatternMgr":
+        brain = super().overlay()
+        brain.exact = dict(self.exact)
+
+        return brain
+
+    def add(self, data: t.Tuple[str, str, str], template: list) -> None:
+        super().add(data, template)
+
+        # A category learned for an indexed pattern may give it a context.
+        words = tuple(data[0].split())
+        self.exact.pop(words, None)
+
+        if self._owned is not None:
+            for depth, word in enumerate(words):
+                if word == "_":
+                    self._stale.add(words[:depth])
+                if word in ("_", "*", "BOT_NAME"):
+                    break
+            else:
+                self._stale.add(words)
+
+    def _reindex(self, prefixes: t.AbstractSet[t.Tuple[str, ...]]) -> None:
+        """Index the patterns below each of the `prefixes` again."""
+        if not prefixes:
+            return
+        if () in prefixes:
+            self._index_exact()
+            return
+
+        depths = sorted({len(prefix) for prefix in prefixes})
+        self.exact = {
+            words: entry
+            for words, entry in self.exact.items()
+            if not any(words[:depth] in prefixes for depth in depths)
+        }
+        for prefix in prefixes:
+            # Those below another one are indexed along with it.
+            if not any(
+                prefix[:depth] in prefixes for depth in depths if depth < len(prefix)
+            ):
+                self._index_exact(prefix)
+
+    def graft(self, path: Graft, subtree: dict) -> None:
+        self.compact(subtree)
+        super().graft(path, subtree)
+        self._index_exact(path)
+
+    def prune(self, path: Graft) -> dict:
+        depth = len(path)
+        for words in [words for words in self.exact if words[:depth] == path]:
+            del self.exact[words]
+
+        return super().prune(path)
+
+    def _index_exact(self, path: Graft = ()) -> None:
+        """Index the patterns of the subtree at `path`, or of the whole trie."""
+        node, checkpoints = self._root, ()
+        for depth, word in enumerate(path):
+            if self._UNDERSCORE in node:
+                checkpoints += ((depth + 1, node[self._UNDERSCORE]),)
+            node = node[word]
+
+        if not path:
+            self.exact = {}
+        stack = [(node, tuple(path), checkpoints)]
+
+        while stack:
+            node, words, checkpoints = stack.pop()
+
+            if words and self._DEFAULT_CONTEXT in node:
+                self.exact[words] = (node[self._DEFAULT_CONTEXT], checkpoints)
+
+            if self._UNDERSCORE in node:
+                checkpoints += ((len(words) + 1, node[self._UNDERSCORE]),)
+
+            for key, child in node.items():
+                if type(key) is str:
+                    stack.append((child, words + (key,), checkpoints))
+
+    # -- Matching --
+    def split(self, text: str) -> t.Tuple[str, ...]:
+        return _words(text)
+
+    def match_pattern(
+        self,
+        words: t.Tuple[str, ...],
+        that_words: t.Sequence[str],
+        topic_words: t.Sequence[str],
+    ) -> t.Tuple[t.Optional[t.Sequence[t.Any]], t.Any]:
+        if self.loader is not None:
+            self.loader(words)
+
+        # A pattern without wildcards is the words it matched.
+        pattern: t.Optional[t.Sequence[t.Any]] = words
+        template = self._match_exact(words, that_words, topic_words)
+        if template is None:
+            pattern, template = self._search(
+                [(self._root, words, 0, that_words, topic_words, ())]
+            )
+
+        return pattern, self._matched(template)
+
+    def _match_exact(
+        self,
+        words: t.Tuple[str, ...],
+        that_words: t.Sequence[str],
+        topic_words: t.Sequence[str],
+    ) -> t.Any:
+        # A `<that>` or topic of nothing but punctuation has no words, which
+        # makes the stock matcher skip the context subtrees and find nothing.
+        entry = self.exact.get(words)
+        if entry is None or not that_words or not topic_words:
+            return None
+
+        template, checkpoints = entry
+        for start, underscore in checkpoints:
+            tasks = [
+                (underscore, words, position, that_words, topic_words, ())
+                for position in self._starts(underscore, words, start, that_words)
+            ]
+            if tasks and self._search(tasks)[1] is not None:
+                return None
+
+        return template
+
+    def _match(
+        self, words: list, thatWords: list, topicWords: list, root: dict
+    ) -> t.Tuple[t.Optional[list], t.Any]:
+        return self._search([(root, words, 0, thatWords, topicWords, ())])
+
+    def _starts(
+        self, node: dict, words: t.Sequence[str], first: int, that: t.Sequence
+    ) -> t.List[int]:
+        """
+        Positions from `first` on at which matching the rest of `words` at
+        `node` could possibly succeed, for the words a wildcard may swallow.
+        """
+        count = len(words)
+        if self._UNDERSCORE in node or self._STAR in node:
+            starts = list(range(first, count))
+        else:
+            bot_name = self._botName if self._BOT_NAME in node else None
+            starts = [
+                start
+                for start in range(first, count)
+                if words[start] in node or words[start] == bot_name
+            ]
+
+        if (
+            self._TEMPLATE in node
+            or self._DEFAULT_CONTEXT in node
+            or (self._THAT if that else self._TOPIC) in node
+        ):
+            starts.append(count)
+
+        return starts
+
+    def _search(self, tasks: t.List[_Task]) -> t.Tuple[t.Optional[list], t.Any]:
+        """
+        Run the stock recursive match as a depth-first search over `tasks`.
+
+        The stock matcher returns as soon as any branch finds a template, so
+        the first template found is the result and the path to it is the
+        pattern. A task of two items is the fallback to a node's own template,
+        taken once its `<that>` or `<topic>` subtree failed.
+
+        Whether a node matches the words from a given position on can't change
+        within a search, so a marker is pushed below the branches of every
+        node, and once it comes back up the node is remembered as a dead end
+        that the wildcards of other branches don't need to retry.
+        """
+        stack = tasks[::-1]
+        dead_ends = set()
+        bot_name = self._botName
+        UNDERSCORE, STAR, BOT_NAME = self._UNDERSCORE, self._STAR, self._BOT_NAME
+        THAT, TOPIC, TEMPLATE = self._THAT, self._TOPIC, self._TEMPLATE
+        DEFAULT_CONTEXT = self._DEFAULT_CONTEXT
+
+        while stack:
+            task = stack.pop()
+
+            size = len(task)
+            if size == 1:
+                dead_ends.add(task[0])
+                continue
+            if size == 2:
+                node, path = task
+                if TEMPLATE in node:
+                    return _unwind(path), node[TEMPLATE]
+                continue
+
+            node, words, position, that, topic, path = task
+            count = len(words)
+
+            key = (id(node), position)
+            if key in dead_ends:
+                continue
+            stack.append((key,))
+
+            if position == count:
+                if that:
+                    if DEFAULT_CONTEXT in node:
+                        # Its `*`s match any that and topic with words in them.
+                        if topic:
+                            path = (STAR, (TOPIC, (STAR, (THAT, path))))
+                            return _unwind(path), node[DEFAULT_CONTEXT]
+                    elif THAT in node:
+                        stack.append((node, path))
+                        stack.append((node[THAT], that, 0, (), topic, (THAT, path)))
+                        continue
+                elif topic:
+                    if TOPIC in node:
+                        stack.append((node, path))
+                        stack.append((node[TOPIC], topic, 0, (), (), (TOPIC, path)))
+                        continue
+
+                if TEMPLATE in node:
+                    return _unwind(path), node[TEMPLATE]
+                continue
+
+            # Pushed in reverse, so they're popped in the stock priority order.
+            word = words[position]
+            following = position + 1
+
+            if STAR in node:
+                child = node[STAR]
+                for start in reversed(self._starts(child, words, following, that)):
+                    stack.append((child, words, start, that, topic, (STAR, path)))
+
+            if BOT_NAME in node and word == bot_name:
+                stack.append(
+                    (node[BOT_NAME], words, following, that, topic, (word, path))
+                )
+
+            if word in node:
+                stack.append((node[word], words, following, that, topic, (word, path)))
+
+            if UNDERSCORE in node:
+                child = node[UNDERSCORE]
+                for start in reversed(self._starts(child, words, following, that)):
+                    stack.append((child, words, start, that, topic, (UNDERSCORE, path)))
+
+        return None, None
+
+
+def _unwind(path: tuple) -> list:
+    pattern = []
+    while path:
+        label, path = path
+        pattern.append(label)
+
+    pattern.reverse()
+    return pattern
+
+
+MATCHERS = {"stock": ContextTrackingPatternMgr, "fast": FastPatternMgr}
@@ -0,0 +1,291 @@
+import asyncio
+import threading
+import typing as t
+
+import psutil
+from aiohttp import web
+from loguru import logger
+
+from bot.core.perf import DEPTH_BOUNDS, DURATION_BOUNDS, Histogram
+
+# Buckets exported for each kind of histogram, a subset of the recorded
+# ones (which the cumulative counts stay exact for) to keep scrapes small.
+EXPORTED_BOUNDS = {
+    DURATION_BOUNDS: DURATION_BOUNDS[::4],
+    DEPTH_BOUNDS: (0, 1, 2, 3, 5, 10, 20, 50, 100),
+}
+
+
+def _escape(value: t.Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels: t.Dict[str, t.Any]) -> str:
+    if not labels:
+        return ""
+    return (
+        "{"
+        + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+        + "}"
+    )
+
+
+class Exposition:
+    """Metrics in the Prometheus text format, one family at a time."""
+
+    def __init__(self) -> None:
+        self.lines: t.List[str] = []
+
+    def family(self, name: str, kind: str, help_text: str) -> None:
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} {kind}")
+
+    def sample(self, name: str, value: float, **labels: t.Any) -> None:
+        self.lines.append(f"{name}{_labels(labels)} {value!r}")
+
+    def metric(self, name: str, kind: str, help_text: str, value: float) -> None:
+        self.family(name, kind, help_text)
+        self.sample(name, value)
+
+    def histogram(self, name: str, histogram: Histogram, **labels: t.Any) -> None:
+        exported = set(EXPORTED_BOUNDS.get(histogram.bounds, histogram.bounds))
+
+        cumulative = 0
+        for bound, count in zip(histogram.bounds, histogram.counts):
+            cumulative += count
+            if bound in exported:
+                self.sample(f"{name}_bucket", cumulative, le=float(bound), **labels)
+
+        self.sample(f"{name}_bucket", histogram.count, le="+Inf", **labels)
+        self.sample(f"{name}_sum", histogram.total, **labels)
+        self.sample(f"{name}_count", histogram.count, **labels)
+
+    def render(self) -> str:
+        return "\n".join(self.lines) + "\n"
+
+
+class MetricsServer:
+    """
+    Serve the bot's metrics at `/metrics` for Prometheus to scrape.
+
+    The server runs on its own thread and event loop, so scrapes never wait
+    on the bot's loop or hold it up. They only read counters and copies,
+    besides asking the kernel worker processes for theirs, like `sudo stats`.
+    """
+
+    def __init__(self, bot: t.Any, host: str, port: int) -> None:
+        self.bot = bot
+        self.host = host
+        self.port = port
+
+        self.process = psutil.Process()
+        self._loop: t.Optional[asyncio.AbstractEventLoop] = None
+        self._runner: t.Optional[web.AppRunner] = None
+        self._thread: t.Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        started = threading.Event()
+        self._thread = threading.Thread(
+            target=self._serve, args=(started,), name="metrics", daemon=True
+        )
+        self._thread.start()
+        started.wait()
+
+    def _serve(self, started: threading.Event) -> None:
+        self._loop = loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+
+        try:
+            loop.run_until_complete(self._runner.setup())
+            loop.run_until_complete(
+                web.TCPSite(self._runner, self.host, self.port).start()
+            )
+        except OSError as exc:
+            logger.error(f"Could not serve metrics on {self.host}:{self.port}: {exc!r}")
+            loop.run_until_complete(self._runner.cleanup())
+            loop.close()
+            self._loop = None
+            started.set()
+            return
+
+        logger.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+        started.set()
+
+        try:
+            loop.run_forever()
+        finally:
+            loop.run_until_complete(self._runner.cleanup())
+            loop.close()
+
+    def stop(self) -> None:
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        if self._thread is not None:
+            self._thread.join()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        return web.Response(
+            text=self.render(), content_type="text/plain", charset="utf-8"
+        )
+
+    def render(self) -> str:
+        bot = self.bot
+        aiml_skill = bot.aiml_kernel
+        metrics = Exposition()
+
+        metrics.family(
+            "discord_gateway_events_total", "counter", "Gateway events received."
+        )
+        for event, count in dict(getattr(bot, "socket_stats", {})).items():
+            metrics.sample("discord_gateway_events_total", count, event=event or "")
+
+        messages = dict(bot.message_stats)
+        metrics.family(
+            "aiml_messages_total", "counter", "Messages in the bot's channel."
+        )
+        for outcome in ("received", "answered", "shed", "dropped"):
+            metrics.sample(
+                "aiml_messages_total", messages.get(outcome, 0), outcome=outcome
+            )
+
+        timings = aiml_skill.stage_timings()
+        metrics.family(
+            "aiml_stage_seconds", "histogram", "Time spent on each stage of a message."
+        )
+        for stage, histogram in timings.histograms.items():
+            if stage != "srai_depth":
+                metrics.histogram("aiml_stage_seconds", histogram, stage=stage)
+        metrics.family(
+            "aiml_srai_depth", "histogram", "Deepest <srai> nesting of each sentence."
+        )
+        metrics.histogram("aiml_srai_depth", timings.histograms["srai_depth"])
+
+        admission = bot.admission.stats()
+        metrics.metric(
+            "aiml_pending_messages",
+            "gauge",
+            "Admitted messages still being answered.",
+            admission["admission_pending"],
+        )
+        metrics.family(
+            "aiml_shed_messages_total", "counter", "Messages turned away unanswered."
+        )
+        for reason in ("user_rate", "channel_rate", "overloaded"):
+            metrics.sample(
+                "aiml_shed_messages_total", admission[f"shed_{reason}"], reason=reason
+            )
+
+        batches = bot.message_batcher.stats()
+        metrics.metric(
+            "aiml_inference_queue_depth",
+            "gauge",
+            "Messages being answered or waiting to be.",
+            aiml_skill.inference.pending,
+        )
+        metrics.metric(
+            "aiml_batcher_pending_messages",
+            "gauge",
+            "Messages waiting for their batch.",
+            batches["pending_messages"],
+        )
+        metrics.metric(
+            "aiml_batches_total", "counter", "Message batches sent.", batches["batches"]
+        )
+
+        outbox = bot.outbox.stats()
+        metrics.metric(
+            "discord_outbound_queue_depth",
+            "gauge",
+            "Replies waiting for their channel's rate limit.",
+            outbox["outbound_queued"],
+        )
+        metrics.metric(
+            "discord_outbound_messages_total",
+            "counter",
+            "Messages sent to channels.",
+            outbox["outbound_messages"],
+        )
+        metrics.metric(
+            "discord_outbound_coalesced_replies_total",
+            "counter",
+            "Replies merged into the message of another.",
+            outbox["outbound_coalesced"],
+        )
+
+        if bot.transcripts is not None:
+            transcripts = bot.transcripts.stats()
+            metrics.metric(
+                "aiml_transcript_queue_depth",
+                "gauge",
+                "Transcript records waiting to be written.",
+                transcripts["transcript_queued"],
+            )
+            metrics.family(
+                "aiml_transcript_records_total", "counter", "Transcript records."
+            )
+            for result in ("written", "dropped", "failed"):
+                key = "records" if result == "written" else result
+                metrics.sample(
+                    "aiml_transcript_records_total",
+                    transcripts[f"transcript_{key}"],
+                    result=result,
+                )
+
+        sessions = aiml_skill.session_stats()
+        cache = aiml_skill.cache_stats()
+        metrics.metric("aiml_sessions", "gauge", "Live sessions.", sessions["sessions"])
+        metrics.metric(
+            "aiml_categories",
+            "gauge",
+            "Categories in the brain.",
+            aiml_skill.num_categories(),
+        )
+        metrics.family(
+            "aiml_response_cache_lookups_total", "counter", "Response cache lookups."
+        )
+        metrics.sample(
+            "aiml_response_cache_lookups_total", cache["cache_hits"], result="hit"
+        )
+        metrics.sample(
+            "aiml_response_cache_lookups_total", cache["cache_misses"], result="miss"
+        )
+
+        with self.process.oneshot():
+            cpu = self.process.cpu_times()
+            metrics.metric(
+                "process_resident_memory_bytes",
+                "gauge",
+                "Resident memory size in bytes.",
+                self.process.memory_info().rss,
+            )
+            metrics.metric(
+                "process_cpu_seconds_total",
+                "counter",
+                "User and system CPU time spent in seconds.",
+                cpu.user + cpu.system,
+            )
+            metrics.metric(
+                "process_start_time_seconds",
+                "gauge",
+                "Start time of the process since the epoch in seconds.",
+                self.process.create_time(),
+            )
+
+        children = 0
+        # Workers are forked by a zygote of their own, under the bot's process.
+        for child in self.process.children(recursive=True):
+            try:
+                children += child.memory_info().rss
+            except psutil.Error:
+                pass
+        metrics.metric(
+            "process_children_resident_memory_bytes",
+            "gauge",
+            "Resident memory of the kernel worker processes in bytes.",
+            children,
+        )
+        return metrics.render()
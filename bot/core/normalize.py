@@ -0,0 +1,97 @@
+import re
+import sys
+import typing as t
+
+from aiml.WordSub import WordSub
+
+# The same characters python-aiml strips from inputs before matching them.
+PUNCTUATION = re.compile("[" + re.escape(r"""`~!@#$%^&*()-_=+[{]}\|;:'",<.>/?""") + "]")
+
+# python-aiml ends a sentence at each of these.
+_SENTENCE_ENDS = ".?!"
+
+
+def split_words(text: str) -> t.Tuple[str, ...]:
+    """Uppercase, strip punctuation and split `text` into interned words."""
+    return tuple(map(sys.intern, PUNCTUATION.sub(" ", text.upper()).split()))
+
+
+class Sentence(t.NamedTuple):
+    """One sentence of an input, in every form the kernel needs it in."""
+
+    text: str  # What `<input/>` and `<star/>` see
+    subbed: str  # After the `normal` substitutions
+    words: t.Tuple[str, ...]  # What the pattern matcher sees
+
+    @property
+    def key(self) -> str:
+        """The substituted sentence with its whitespace collapsed."""
+        return " ".join(self.subbed.split())
+
+
+class Normalizer:
+    """
+    Turn a raw message into the sentences an AIML kernel responds to.
+
+    python-aiml splits the input into sentences, then runs every sentence
+    through its `normal` substitutions and the matcher uppercases it and
+    strips its punctuation. Before that, the bot drops a few characters
+    from messages. Here the characters are dropped with a single
+    `str.translate`, and one compiled regex finds both the sentence ends
+    and the substitutions in a single scan, with the same results.
+    Substitutions that contain a dropped character can never match, so
+    they are left out of the regex.
+    """
+
+    def __init__(self, subs: WordSub, ignored_characters: str = "") -> None:
+        self.ignored_characters = ignored_characters
+        self._table = str.maketrans("", "", ignored_characters)
+
+        # WordSub compiles lazily, its regex may not be up to date yet.
+        keys = [
+            key
+            for key in subs.keys()
+            if not any(character in key for character in ignored_characters)
+        ]
+        self._subs = {key: subs[key] for key in keys}
+
+        # One shared `\b` and a lookahead on the first letters let the regex
+        # skip most positions without trying every key. The keys stay in the
+        # order WordSub tries them in, where one is a prefix of another.
+        pattern = f"(?P<end>[{re.escape(_SENTENCE_ENDS)}])"
+        if keys:
+            first = "".join(sorted({re.escape(key[0]) for key in keys}))
+            alternatives = "|".join(map(re.escape, keys))
+            pattern += rf"|\b(?=[{first}])(?:{alternatives})\b"
+        self._regex = re.compile(pattern)
+
+    def normalize(self, text: str) -> t.List[Sentence]:
+        """Split `text` into sentences, empty if nothing is left of it."""
+        text = text.translate(self._table)
+
+        sentences = []
+        start = 0  # Of the current sentence
+        position = 0  # Of the text not yet copied into `parts`
+        parts = []
+
+        for match in self._regex.finditer(text):
+            parts.append(text[position : match.start()])
+            position = match.end()
+
+            if match.lastgroup == "end":
+                sentences.append(self._sentence(text[start : match.start()], parts))
+                start = position
+                parts = []
+            else:
+                parts.append(self._subs[match.group()])
+
+        if start < len(text):
+            parts.append(text[position:])
+            sentences.append(self._sentence(text[start:], parts))
+
+        return sentences
+
+    @staticmethod
+    def _sentence(text: str, parts: t.List[str]) -> Sentence:
+        subbed = "".join(parts).strip()
+        return Sentence(text.strip(), subbed, split_words(subbed))
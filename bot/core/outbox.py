@@ -0,0 +1,164 @@
+import asyncio
+import collections
+import time
+import typing as t
+
+from bot.core.perf import StageTimings
+from bot.core.utils import TokenBucket
+
+# Discord rejects messages longer than this.
+MAX_MESSAGE_LENGTH = 2000
+
+# A reply waiting to be sent, when it was queued and the future of its sending.
+_Reply = t.Tuple[str, float, asyncio.Future]
+
+
+class _Channel:
+    """The replies queued for a channel and what is left of its budget."""
+
+    __slots__ = ("queue", "budget", "task")
+
+    def __init__(self, budget: TokenBucket) -> None:
+        self.queue: t.Deque[_Reply] = collections.deque()
+        self.budget = budget
+        self.task: t.Optional[asyncio.Task] = None
+
+
+class Outbox:
+    """
+    Send replies through a queue per channel, paced to its rate limit.
+
+    Discord lets a bot send `rate` messages per `period` seconds to a
+    channel, and the library sleeps through the 429s of any beyond that. A
+    token bucket per channel keeps sends within the budget instead, one at a
+    time and in order. When more replies are waiting than the budget can
+    send right away, as many as fit in a message are joined into one.
+
+    How long replies waited in the queue and how long sending them took is
+    recorded in `timings`.
+    """
+
+    def __init__(
+        self,
+        rate: int = 5,
+        period: float = 5.0,
+        timings: t.Optional[StageTimings] = None,
+        max_length: int = MAX_MESSAGE_LENGTH,
+        separator: str = "\n",
+    ) -> None:
+        self.rate = rate
+        self.period = period
+        self.timings = timings if timings is not None else StageTimings()
+        self.max_length = max_length
+        self.separator = separator
+
+        self.messages = 0
+        self.replies = 0
+        self.coalesced = 0
+
+        self._channels: t.Dict[t.Any, _Channel] = {}
+
+    async def send(self, channel: t.Any, content: str) -> None:
+        """Queue a reply to `channel` and wait until it is sent."""
+        loop = asyncio.get_running_loop()
+        now = time.monotonic()
+
+        state = self._channels.get(channel.id)
+        if state is None:
+            budget = TokenBucket(self.rate / self.period, self.rate, now)
+            state = self._channels[channel.id] = _Channel(budget)
+
+        sent = loop.create_future()
+        state.queue.append((content[: self.max_length], now, sent))
+        if state.task is None:
+            state.task = asyncio.ensure_future(self._run(channel, state))
+
+        await sent
+
+    async def drain(self) -> None:
+        """Wait until every queued reply is sent."""
+        tasks = [state.task for state in self._channels.values() if state.task]
+        if tasks:
+            await asyncio.wait(tasks)
+
+    async def _run(self, channel: t.Any, state: _Channel) -> None:
+        try:
+            while state.queue:
+                wait = state.budget.wait(time.monotonic())
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                    continue
+
+                batch = self._next_batch(state)
+                if batch:
+                    state.budget.tokens -= 1
+                    await self._send(channel, batch)
+        finally:
+            state.task = None
+
+        # Its budget is spent until a whole period has gone by.
+        asyncio.get_running_loop().call_later(
+            self.period, self._forget, channel.id, state
+        )
+
+    def _forget(self, key: t.Any, state: _Channel) -> None:
+        if self._channels.get(key) is state and state.task is None:
+            del self._channels[key]
+
+    def _next_batch(self, state: _Channel) -> t.List[_Reply]:
+        queue = state.queue
+        batch: t.List[_Reply] = []
+        length = 0
+
+        # The rest can go out one by one as long as the budget lasts.
+        while queue and (not batch or len(queue) >= state.budget.tokens):
+            content, queued, sent = queue[0]
+            # Whoever waited for it has given up.
+            if sent.done():
+                queue.popleft()
+                continue
+
+            added = len(content) + (len(self.separator) if batch else 0)
+            if batch and length + added > self.max_length:
+                break
+
+            queue.popleft()
+            batch.append((content, queued, sent))
+            length += added
+
+        return batch
+
+    async def _send(self, channel: t.Any, batch: t.List[_Reply]) -> None:
+        timings = self.timings
+        start = time.monotonic()
+        for _, queued, _ in batch:
+            timings.observe("queue", start - queued)
+
+        try:
+            await channel.send(self.separator.join(content for content, _, _ in batch))
+        except Exception as exc:
+            for _, _, sent in batch:
+                if not sent.done():
+                    sent.set_exception(exc)
+            return
+
+        elapsed = time.monotonic() - start
+        self.messages += 1
+        self.replies += len(batch)
+        self.coalesced += len(batch) - 1
+
+        for _, _, sent in batch:
+            timings.observe("send", elapsed)
+            if not sent.done():
+                sent.set_result(None)
+
+    def stats(self) -> t.Dict[str, int]:
+        # Copied first, as the metrics thread reads these too.
+        channels = list(self._channels.values())
+        return {
+            "outbound_queued": sum(len(state.queue) for state in channels),
+            "outbound_channels": len(channels),
+            "outbound_messages": self.messages,
+            "outbound_replies": self.replies,
+            "outbound_coalesced": self.coalesced,
+        }
@@ -0,0 +1,135 @@
+import bisect
+import copy
+import threading
+import time
+import typing as t
+
+# Bucket bounds for durations in seconds, from 1us to about a minute, each
+# about 19% wider than the last, so a percentile is never off by more.
+DURATION_BOUNDS = tuple(1e-6 * 2 ** (step / 4) for step in range(104))
+# Bucket bounds for counts, like the `<srai>` depth of a sentence.
+DEPTH_BOUNDS = tuple(range(101))
+
+# The stages of answering a message, in order, and whether they're timed.
+STAGES = {
+    "normalize": DURATION_BOUNDS,
+    "match": DURATION_BOUNDS,
+    "srai_depth": DEPTH_BOUNDS,
+    "template": DURATION_BOUNDS,
+    "sanitize": DURATION_BOUNDS,
+    "queue": DURATION_BOUNDS,
+    "send": DURATION_BOUNDS,
+    "total": DURATION_BOUNDS,
+}
+
+
+class Histogram:
+    """
+    Counts of observed values in fixed buckets.
+
+    Observing is a bisect and two additions, cheap enough for every message,
+    and histograms with the same bounds add up, like those of every worker
+    process. Percentiles are reported as the upper bound of their bucket.
+    """
+
+    def __init__(self, bounds: t.Sequence[float]) -> None:
+        self.bounds = tuple(bounds)
+        # One more bucket for whatever is beyond the last bound.
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, fraction: float) -> t.Optional[float]:
+        """The value `fraction` of the observations are at most, if any."""
+        if not self.count:
+            return None
+
+        rank = max(1, round(fraction * self.count))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                break
+
+        if index == len(self.bounds):
+            return self.max
+        # No observation was above the maximum, whatever the bucket says.
+        return min(self.bounds[index], self.max)
+
+    def merge(self, other: "Histogram") -> None:
+        if other.bounds != self.bounds:
+            raise ValueError("Only histograms with the same buckets can be merged")
+
+        self.counts = [mine + theirs for mine, theirs in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def summary(self) -> t.Dict[str, t.Optional[float]]:
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+            "max": self.max if self.count else None,
+        }
+
+
+class StageTimings:
+    """
+    A histogram for each stage of answering a message.
+
+    Stages are observed from every inference thread and the event loop at
+    once, normalizing before the kernel's lock is taken, so every access
+    takes a lock of its own. It's held for a few additions at most.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.reset()
+
+    def observe(self, stage: str, value: float) -> None:
+        with self._lock:
+            self.histograms[stage].observe(value)
+
+    def merge(self, other: "StageTimings") -> None:
+        with other._lock:
+            histograms = copy.deepcopy(other.histograms)
+            since = other.since
+
+        with self._lock:
+            for stage, histogram in histograms.items():
+                self.histograms[stage].merge(histogram)
+            self.since = min(self.since, since)
+
+    def reset(self) -> None:
+        histograms = {stage: Histogram(bounds) for stage, bounds in STAGES.items()}
+        with self._lock:
+            self.histograms = histograms
+            self.since = time.time()
+
+    def summary(self) -> t.Dict[str, t.Dict[str, t.Optional[float]]]:
+        with self._lock:
+            return {
+                stage: histogram.summary()
+                for stage, histogram in self.histograms.items()
+            }
+
+    def __getstate__(self) -> t.Dict[str, t.Any]:
+        # Sent back from the worker processes, without the lock.
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: t.Dict[str, t.Any]) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
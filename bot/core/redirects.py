@@ -0,0 +1,201 @@
+import typing as t
+from dataclasses import dataclass, field
+
+from bot.core.kernel import CachingKernel, Redirect
+from bot.core.utils import paused_gc
+
+_SR_CONTENT = [["star", {}]]
+
+# The inputs a chain of redirects passes through, the template the last one
+# reaches and the contextual subtrees matching them entered.
+_Chain = t.Tuple[t.Tuple[str, ...], t.Optional[list], t.Dict[int, dict]]
+
+
+@dataclass
+class RedirectReport:
+    """What `collapse_redirects` found and changed."""
+
+    literal: int = 0  # Redirect categories to a fixed input
+    starred: int = 0  # Redirect categories to an input built from `<star/>`s
+    collapsed: int = 0  # Literal `<srai>`s linked past at least one redirect
+    hops_removed: int = 0  # Redirect categories the linked `<srai>`s skip
+    # Longest chains first, as (input, final input, hops removed).
+    chains: t.List[t.Tuple[str, str, int]] = field(default_factory=list)
+    cycles: t.List[t.Tuple[str, ...]] = field(default_factory=list)
+
+
+def redirect_content(template: list) -> t.Optional[list]:
+    """
+    The contents of the `<srai>` if `template` is nothing but a redirect to
+    literal text and `<star/>`s, otherwise None.
+    """
+    redirect = None
+    for element in template[2:]:
+        if element[0] == "text" and not element[2].strip():
+            continue
+        if redirect is not None or element[0] not in {"srai", "sr"}:
+            return None
+        redirect = element
+
+    if redirect is None:
+        return None
+    if redirect[0] == "sr":
+        return _SR_CONTENT
+    if all(child[0] in {"text", "star"} for child in redirect[2:]):
+        return redirect[2:]
+
+    return None
+
+
+class _Resolver:
+    """Follows chains of redirects from an input, remembering every input seen."""
+
+    def __init__(self, kernel: CachingKernel, report: RedirectReport) -> None:
+        self.brain = kernel._brain
+        self.lazy = kernel.lazy
+        self.normal = kernel._subbers["normal"]
+        self.max_hops = kernel._maxRecursionDepth
+        self.report = report
+
+        # Input -> the chain from it on, or None if it can't be followed.
+        self.chains: t.Dict[str, t.Optional[_Chain]] = {}
+
+    def resolve(self, text: str) -> t.Optional[_Chain]:
+        """Follow the redirects from `text` as they go without any conversation."""
+        path: t.List[str] = []
+        visits: t.List[t.Dict[int, dict]] = []
+
+        while True:
+            if text in self.chains:
+                rest = self.chains[text]
+                break
+            if text in path or len(path) > self.max_hops:
+                # Stock AIML recurses until the limit and answers nothing.
+                if text in path:
+                    self.report.cycles.append(tuple(path[path.index(text) :]))
+                rest = None
+                break
+            if self._lazy(text):
+                # Where it goes depends on whether its topic is loaded.
+                rest = None
+                break
+
+            path.append(text)
+            target, hop_visits = self._target(text)
+            visits.append(hop_visits)
+
+            content = None if target is None else redirect_content(target)
+            if content is None:
+                rest = ((), target, {})
+                break
+
+            text = self._expand(content, text)
+
+        # Walk back, prepending every input to the chain that follows it.
+        for seen, hop_visits in zip(reversed(path), reversed(visits)):
+            if rest is not None:
+                rest = ((seen,) + rest[0], rest[1], {**rest[2], **hop_visits})
+            self.chains[seen] = rest
+
+        return rest
+
+    def _lazy(self, text: str) -> bool:
+        """Whether matching `text` may need a topic that is loaded on demand."""
+        if self.lazy is None:
+            return False
+
+        return self.lazy.unit(self.brain.split(self.normal.sub(text))) is not None
+
+    def _target(self, text: str) -> t.Tuple[t.Optional[list], t.Dict[int, dict]]:
+        if not text:
+            return None, {}
+
+        self.brain.visits = visits = {}
+        try:
+            target = self.brain.match(self.normal.sub(text), "", "")
+        finally:
+            self.brain.visits = None
+
+        return target, visits
+
+    def _expand(self, content: list, text: str) -> str:
+        """What the redirect's `<srai>` passes on when it matched `text`."""
+        parts = []
+        for element in content:
+            if element[0] == "text":
+                parts.append(CachingKernel._text(element))
+            else:
+                index = int(element[1].get("index", 1))
+                parts.append(
+                    self.brain.star("star", self.normal.sub(text), "", "", index)
+                )
+
+        return "".join(parts)
+
+
+def collapse_redirects(kernel: CachingKernel) -> RedirectReport:
+    """
+    Link the literal `<srai>`s of a prepared brain to the end of their chains.
+
+    A redirect is a category whose template is a single `<srai>` of literal
+    text and `<star/>`s. From every literal `<srai>`, the chain of redirects
+    is followed at load time, working out the stars along the way, up to the
+    first category that does something else. The kernel then processes that
+    category's template straight away instead of matching every hop again.
+    A `<srai>` that reaches such a category with its first match has no hops
+    to skip, and is left to the kernel as it is.
+
+    Which category an input reaches can depend on `<that>` and topic, so the
+    contextual subtrees the hops went through are kept as guards, and a link
+    is only taken while they give the same templates as they did here.
+    Redirects whose input is built from stars are only known per message, so
+    they aren't linked themselves, but the literal `<srai>`s they lead to
+    are. Chains that loop back on themselves, or into a topic loaded on
+    demand, are left alone, and the loops reported.
+    """
+    report = RedirectReport()
+    resolver = _Resolver(kernel, report)
+    brain = kernel._brain
+    default_context = brain.context_words("", "")
+
+    redirects = {}
+    with paused_gc():
+        for template in kernel._templates():
+            content = redirect_content(template)
+            if content is not None:
+                if any(element[0] == "star" for element in content):
+                    report.starred += 1
+                else:
+                    report.literal += 1
+
+            stack = [template]
+            while stack:
+                element = stack.pop()
+                children = element[2:]
+
+                if element[0] != "srai" or not all(
+                    child[0] == "text" for child in children
+                ):
+                    if element[0] != "text":
+                        stack.extend(children)
+                    continue
+
+                text = "".join(CachingKernel._text(child) for child in children)
+                chain = resolver.resolve(text)
+                # A `<srai>` straight to a category that does something else
+                # is matched once either way.
+                if chain is None or len(chain[0]) < 2:
+                    continue
+
+                inputs, target, visits = chain
+                redirects[id(element)] = Redirect(
+                    inputs, target, brain.guards(visits.values(), *default_context)
+                )
+                report.collapsed += 1
+                report.hops_removed += len(inputs) - 1
+                report.chains.append((text, inputs[-1], len(inputs) - 1))
+
+    report.chains.sort(key=lambda chain: chain[2], reverse=True)
+    kernel.redirects = redirects
+
+    return report
@@ -0,0 +1,413 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import typing as t
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from pathlib import Path
+
+import aiml
+
+Session = t.Dict[str, t.Any]
+
+
+class SessionStore(MutableMapping):
+    """
+    Base class for the mapping an AIML kernel keeps its sessions in.
+
+    The kernel reads and writes `kernel._sessions` as a plain dict of session
+    ID to predicate dict, so a store only has to behave like one.
+    """
+
+    def stats(self) -> t.Dict[str, int]:
+        """Counters describing the store, summed across worker processes."""
+        return {"sessions": len(self)}
+
+    def resident(self) -> t.List[Session]:
+        """The sessions held in memory, without counting as a use of them."""
+        return list(self.values())
+
+    def bind(self, lock: t.ContextManager) -> None:
+        """Receive the lock the kernel holds while it uses the sessions."""
+
+    def reset(self) -> None:
+        """Forget every session."""
+        self.clear()
+
+    def close(self) -> None:
+        """Release whatever the store holds on to."""
+
+
+class MemorySessionStore(SessionStore):
+    """
+    Keep at most `max_sessions` sessions in memory, evicting the least
+    recently used one first, and drop sessions idle for more than `ttl` seconds.
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = 10000,
+        ttl: t.Optional[float] = 24 * 60 * 60,
+        pinned: t.Iterable[t.Any] = (aiml.Kernel._globalSessionID,),
+    ) -> None:
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.pinned = set(pinned)
+
+        self.evictions = 0
+        self.expirations = 0
+
+        # Ordered from least to most recently used.
+        self._sessions: t.OrderedDict[t.Any, Session] = OrderedDict()
+        self._last_used: t.Dict[t.Any, float] = {}
+
+    def _is_expired(self, key: t.Any, now: float) -> bool:
+        return (
+            self.ttl is not None
+            and key not in self.pinned
+            and now - self._last_used[key] > self.ttl
+        )
+
+    def _touch(self, key: t.Any, now: float) -> None:
+        self._sessions.move_to_end(key)
+        self._last_used[key] = now
+
+    def _drop(self, key: t.Any) -> Session:
+        del self._last_used[key]
+        return self._sessions.pop(key)
+
+    def _evict(self, key: t.Any) -> None:
+        """Remove a session because of the size limit."""
+        self._drop(key)
+
+    def _expire(self, key: t.Any) -> None:
+        """Remove a session that was idle for longer than the TTL."""
+        self._drop(key)
+        self.expirations += 1
+
+    def _enforce_limits(self, now: float) -> None:
+        # Sessions are ordered by last use, so everything expired or over the
+        # limit sits at the front; stop at the first one that may stay.
+        for _ in range(len(self._sessions)):
+            key = next(iter(self._sessions))
+
+            if key in self.pinned:
+                self._touch(key, now)
+            elif self._is_expired(key, now):
+                self._expire(key)
+            elif len(self._sessions) > self.max_sessions:
+                self._evict(key)
+                self.evictions += 1
+            else:
+                break
+
+    def __contains__(self, key: t.Any) -> bool:
+        if key not in self._sessions:
+            return False
+
+        if self._is_expired(key, time.monotonic()):
+            self._expire(key)
+            return False
+
+        return True
+
+    def __getitem__(self, key: t.Any) -> Session:
+        if key not in self:
+            raise KeyError(key)
+
+        self._touch(key, time.monotonic())
+        return self._sessions[key]
+
+    def __setitem__(self, key: t.Any, session: Session) -> None:
+        now = time.monotonic()
+
+        self._sessions[key] = session
+        self._touch(key, now)
+        self._enforce_limits(now)
+
+    def __delitem__(self, key: t.Any) -> None:
+        self._drop(key)
+
+    def __iter__(self) -> t.Iterator[t.Any]:
+        return iter(list(self._sessions))
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def resident(self) -> t.List[Session]:
+        return list(self._sessions.values())
+
+    def stats(self) -> t.Dict[str, int]:
+        return {
+            "sessions": len(self),
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class SQLiteSessionStore(MemorySessionStore):
+    """
+    Memory session store backed by an SQLite database with write-behind batching.
+
+    Sessions are read from disk lazily, the first time a user is seen after a
+    start or after being evicted from memory. Changed sessions are only marked
+    dirty on the hot path; a background thread writes them in one transaction
+    every `flush_interval` seconds, and `close` writes whatever is left.
+
+    Rows belong to a generation. `reset` starts a new one, which hides every
+    earlier session at once, including ones still being flushed by the stores
+    of a kernel that is being replaced.
+
+    A session idle for longer than `ttl` is gone for good, like in memory:
+    its row is deleted, and rows last written longer ago than that are
+    neither loaded nor kept. A row is written within `flush_interval` of
+    every use of its session.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        flush_interval: float = 5.0,
+        max_sessions: int = 10000,
+        ttl: t.Optional[float] = 24 * 60 * 60,
+        pinned: t.Iterable[t.Any] = (aiml.Kernel._globalSessionID,),
+    ) -> None:
+        super().__init__(max_sessions=max_sessions, ttl=ttl, pinned=pinned)
+
+        self.path = Path(path)
+        self.flush_interval = flush_interval
+
+        self.loads = 0
+        self.flushes = 0
+        self.flushed_sessions = 0
+
+        # Keys whose latest state isn't on disk yet, and sessions that were
+        # evicted from memory before that could happen.
+        self._dirty: t.Set[t.Any] = set()
+        self._evicted: t.Dict[t.Any, t.Optional[Session]] = {}
+
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._closed = threading.Event()
+
+        # Connections and the flush thread don't survive a fork, so both are
+        # created lazily by whichever process ends up using the store.
+        self._pid = None
+        self._connection = None
+        self._generation = None
+        self._inherited: t.List[sqlite3.Connection] = []
+
+    def bind(self, lock: t.ContextManager) -> None:
+        self._lock = lock
+
+    # -- Database --
+    def _open(self) -> sqlite3.Connection:
+        if self._pid == os.getpid():
+            return self._connection
+
+        # A lock inherited from the parent may have been held by its flush
+        # thread at the time of the fork. The parent's connection is kept
+        # referenced but never used or closed here, as closing it could
+        # checkpoint away the WAL the parent is still writing to.
+        self._flush_lock = threading.Lock()
+        if self._connection is not None:
+            self._inherited.append(self._connection)
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(
+            str(self.path), timeout=30, check_same_thread=False
+        )
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                generation INTEGER NOT NULL,
+                id TEXT NOT NULL,
+                data TEXT NOT NULL,
+                updated REAL NOT NULL,
+                PRIMARY KEY (generation, id)
+            );
+            CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated);
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO meta VALUES ('generation', 0);
+            """)
+
+        if self._generation is None:
+            (self._generation,) = connection.execute(
+                "SELECT value FROM meta WHERE key = 'generation'"
+            ).fetchone()
+
+        self._pid = os.getpid()
+        self._connection = connection
+
+        threading.Thread(
+            target=self._flush_periodically, name="aiml-session-flush", daemon=True
+        ).start()
+
+        return connection
+
+    def _load(self, key: t.Any) -> t.Optional[Session]:
+        if key in self._evicted:
+            return self._evicted.pop(key)
+
+        row = (
+            self._open()
+            .execute(
+                "SELECT data FROM sessions "
+                "WHERE generation = ? AND id = ? AND updated >= ?",
+                (self._generation, json.dumps(key), self._expired_before()),
+            )
+            .fetchone()
+        )
+        if row is None:
+            return None
+
+        self.loads += 1
+        return json.loads(row[0])
+
+    def _expired_before(self) -> float:
+        """The time rows last written before have expired, or -inf for none."""
+        return time.time() - self.ttl if self.ttl is not None else float("-inf")
+
+    # -- Write-behind --
+    def _flush_periodically(self) -> None:
+        while not self._closed.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self) -> None:
+        """Write every dirty session to disk in a single transaction."""
+        if not self._dirty:
+            return
+
+        with self._flush_lock:
+            connection = self._open()
+
+            # Serialize under the kernel's lock so no session changes midway,
+            # but keep the disk write itself outside of it.
+            with self._lock:
+                dirty, self._dirty = self._dirty, set()
+                evicted, self._evicted = self._evicted, {}
+                generation = self._generation
+
+                upserts, deletes = [], []
+                for key in dirty:
+                    session = (
+                        evicted[key] if key in evicted else self._sessions.get(key)
+                    )
+                    if session is None:
+                        deletes.append((generation, json.dumps(key)))
+                    else:
+                        upserts.append(
+                            (
+                                generation,
+                                json.dumps(key),
+                                json.dumps(session),
+                                time.time(),
+                            )
+                        )
+
+            if not upserts and not deletes:
+                return
+
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?)", upserts
+                )
+                connection.executemany(
+                    "DELETE FROM sessions WHERE generation = ? AND id = ?", deletes
+                )
+                connection.execute(
+                    "DELETE FROM sessions WHERE generation < ? OR updated < ?",
+                    (generation, self._expired_before()),
+                )
+
+            self.flushes += 1
+            self.flushed_sessions += len(upserts) + len(deletes)
+
+    def reset(self) -> None:
+        """Forget every session, on disk too, by starting a new generation."""
+        connection = self._open()
+
+        with self._lock, connection:
+            connection.execute(
+                "UPDATE meta SET value = value + 1 WHERE key = 'generation'"
+            )
+            (self._generation,) = connection.execute(
+                "SELECT value FROM meta WHERE key = 'generation'"
+            ).fetchone()
+
+            self._sessions.clear()
+            self._last_used.clear()
+            self._dirty.clear()
+            self._evicted.clear()
+
+    def close(self) -> None:
+        self._closed.set()
+
+        if self._pid == os.getpid():
+            self.flush()
+            self._connection.close()
+            self._pid = None
+
+    # -- Mapping interface --
+    def _evict(self, key: t.Any) -> None:
+        session = self._drop(key)
+
+        if key in self._dirty:
+            self._evicted[key] = session
+
+    def _expire(self, key: t.Any) -> None:
+        super()._expire(key)
+
+        # Deleted on disk too, so it isn't loaded back on the next message.
+        self._evicted.pop(key, None)
+        self._dirty.add(key)
+
+    def __contains__(self, key: t.Any) -> bool:
+        if super().__contains__(key):
+            return True
+        if key in self.pinned or (key in self._dirty and key not in self._evicted):
+            # Deleted, but the deletion hasn't been flushed yet.
+            return False
+
+        session = self._load(key)
+        if session is None:
+            return False
+
+        MemorySessionStore.__setitem__(self, key, session)
+        return True
+
+    def __getitem__(self, key: t.Any) -> Session:
+        session = super().__getitem__(key)
+
+        # The kernel updates predicates in place, so every read may be a write.
+        if key not in self.pinned:
+            self._dirty.add(key)
+
+        return session
+
+    def __setitem__(self, key: t.Any, session: Session) -> None:
+        super().__setitem__(key, session)
+
+        if key not in self.pinned:
+            self._dirty.add(key)
+
+    def __delitem__(self, key: t.Any) -> None:
+        super().__delitem__(key)
+
+        self._evicted.pop(key, None)
+        self._dirty.add(key)
+
+    def stats(self) -> t.Dict[str, int]:
+        return {
+            **super().stats(),
+            "loaded": self.loads,
+            "dirty": len(self._dirty),
+            "flushes": self.flushes,
+            "flushed": self.flushed_sessions,
+        }
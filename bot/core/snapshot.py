@@ -0,0 +1,88 @@
+import hashlib
+import marshal
+import os
+import struct
+import sys
+import typing as t
+from pathlib import Path
+
+import aiml
+from aiml.constants import VERSION as AIML_VERSION
+from loguru import logger
+
+from bot.core.utils import paused_gc
+
+# -- Snapshot file layout --
+# MAGIC | format version (uint16) | corpus digest (sha256) | marshalled brain
+MAGIC = b"AIMLBRN\x00"
+FORMAT_VERSION = 2
+
+_HEADER = struct.Struct(f">{len(MAGIC)}sH32s")
+
+
+def corpus_digest(
+    root: Path, files: t.Sequence[Path], options: t.Iterable[str] = ()
+) -> bytes:
+    """Hash the file names and contents of the corpus into a snapshot key."""
+    digest = hashlib.sha256()
+    digest.update(f"{FORMAT_VERSION}:{AIML_VERSION}:{sys.version_info[:2]}".encode())
+
+    for option in options:
+        digest.update(f"\0option:{option}".encode())
+
+    for path in files:
+        digest.update(f"\0{path.relative_to(root).as_posix()}\0".encode())
+        digest.update(path.read_bytes())
+
+    return digest.digest()
+
+
+def save_snapshot(kernel: aiml.Kernel, path: Path, digest: bytes) -> None:
+    """Write the kernel's brain to `path`, replacing any previous snapshot atomically."""
+    brain = kernel._brain
+    payload = marshal.dumps((brain._templateCount, brain._botName, brain._root))
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+
+    with temp_path.open("wb") as file:
+        file.write(_HEADER.pack(MAGIC, FORMAT_VERSION, digest))
+        file.write(payload)
+
+    os.replace(temp_path, path)
+
+
+def load_snapshot(kernel: aiml.Kernel, path: Path, digest: bytes) -> bool:
+    """
+    Load a brain snapshot into the kernel.
+
+    Returns False without touching the kernel if the snapshot is missing, was
+    written by another format version, or was built from a different corpus.
+    """
+    try:
+        with path.open("rb") as file:
+            header = file.read(_HEADER.size)
+            if len(header) != _HEADER.size:
+                return False
+
+            magic, version, snapshot_digest = _HEADER.unpack(header)
+            if magic != MAGIC or version != FORMAT_VERSION or snapshot_digest != digest:
+                return False
+
+            payload = file.read()
+    except FileNotFoundError:
+        return False
+
+    try:
+        with paused_gc():
+            template_count, bot_name, root = marshal.loads(payload)
+    except (EOFError, ValueError, TypeError) as exc:
+        logger.warning(f"Discarding corrupt AIML brain snapshot {path}: {exc!r}")
+        return False
+
+    brain = kernel._brain
+    brain._templateCount = template_count
+    brain._botName = bot_name
+    brain._root = root
+
+    return True
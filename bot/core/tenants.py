@@ -0,0 +1,183 @@
+import collections
+import threading
+import time
+import typing as t
+from concurrent.futures import Future
+from pathlib import Path
+
+from loguru import logger
+
+
+def tenant_dirs(root: Path) -> t.Dict[str, Path]:
+    """The tenants under `root`, a directory of AIML files each, by name."""
+    if not root.is_dir():
+        return {}
+
+    return {path.name: path for path in sorted(root.iterdir()) if path.is_dir()}
+
+
+class Route(t.NamedTuple):
+    """Whether the bot answers in a channel, and which tenant's brain does."""
+
+    listening: bool
+    tenant: t.Optional[str]  # None answers with the base brain
+
+
+IGNORED = Route(False, None)
+
+
+class TenantRouter:
+    """
+    Which tenant, if any, answers the messages of a channel.
+
+    The bot listens in the channels named `channel_name`, answering with
+    the brain of the tenant named after the channel's guild ID if `tenants`
+    has one, and with the base brain otherwise. Every channel is looked up
+    by name once and then remembered by its ID, until it is `forget`-ten.
+    """
+
+    def __init__(
+        self, channel_name: str, tenants: t.Callable[[], t.AbstractSet[str]]
+    ) -> None:
+        self.channel_name = channel_name
+        self.tenants = tenants
+
+        self._routes: t.Dict[int, Route] = {}
+
+    def route(self, channel: t.Any) -> Route:
+        route = self._routes.get(channel.id)
+        if route is None:
+            route = self._routes[channel.id] = self._resolve(channel)
+
+        return route
+
+    def _resolve(self, channel: t.Any) -> Route:
+        if str(channel) != self.channel_name:
+            return IGNORED
+
+        guild = getattr(channel, "guild", None)
+        tenant = str(guild.id) if guild is not None else None
+        return Route(True, tenant if tenant in self.tenants() else None)
+
+    def forget(self, channel_id: int) -> None:
+        """Look a channel up again, after it was renamed or deleted."""
+        self._routes.pop(channel_id, None)
+
+    def clear(self) -> None:
+        """Look every channel up again, after the tenants changed."""
+        self._routes.clear()
+
+    def stats(self) -> t.Dict[str, int]:
+        routes = list(self._routes.values())
+        return {
+            "routed_channels": len(routes),
+            "listening_channels": sum(route.listening for route in routes),
+        }
+
+
+class TenantOverlays:
+    """
+    Kernels of the tenants in `paths`, built by `build` when one of their
+    messages first comes in.
+
+    Those unused for `idle` seconds are dropped again, which is checked for
+    every `sweep_interval` seconds at most, as are the least recently used
+    beyond `max_loaded`. Sessions don't go with them (see
+    `CachingKernel.overlay`), so a tenant that is loaded again carries on
+    its conversations.
+    """
+
+    def __init__(
+        self,
+        paths: t.Mapping[str, Path],
+        build: t.Callable[[str, Path], t.Any],
+        idle: float = 30 * 60,
+        max_loaded: int = 16,
+        sweep_interval: float = 60,
+    ) -> None:
+        self.paths = dict(paths)
+        self.build = build
+        self.idle = idle
+        self.max_loaded = max_loaded
+        self.sweep_interval = sweep_interval
+
+        self.loads = 0
+        self.unloads = 0
+        self._last_sweep = time.monotonic()
+
+        # The kernels being built or loaded, least recently used first, and
+        # when each was last used.
+        self._loaded: t.OrderedDict[str, Future] = collections.OrderedDict()
+        self._last_used: t.Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def kernel(self, tenant: str) -> t.Any:
+        """The kernel of `tenant`, built first if it isn't loaded."""
+        now = time.monotonic()
+
+        with self._lock:
+            future = self._loaded.get(tenant)
+            building = future is None
+            if building:
+                future = self._loaded[tenant] = Future()
+            else:
+                self._loaded.move_to_end(tenant)
+            self._last_used[tenant] = now
+
+            if now - self._last_sweep >= self.sweep_interval or (
+                building and len(self._loaded) > self.max_loaded
+            ):
+                self._sweep(now)
+
+        # Outside of the lock, so other tenants are answered in the meantime.
+        if building:
+            self._load(tenant, future)
+
+        return future.result()
+
+    def _load(self, tenant: str, future: Future) -> None:
+        start = time.perf_counter()
+        try:
+            kernel = self.build(tenant, self.paths[tenant])
+        except BaseException as exc:
+            with self._lock:
+                if self._loaded.get(tenant) is future:
+                    del self._loaded[tenant]
+            future.set_exception(exc)
+            raise
+
+        future.set_result(kernel)
+        self.loads += 1
+        logger.info(
+            f"Loaded AIML tenant {tenant} in {time.perf_counter() - start:.2f}s"
+        )
+
+    def sweep(self) -> None:
+        """Drop the kernels unused for `idle` seconds, or beyond `max_loaded`."""
+        with self._lock:
+            self._sweep(time.monotonic())
+
+    def _sweep(self, now: float) -> None:
+        self._last_sweep = now
+        excess = len(self._loaded) - self.max_loaded
+
+        for tenant, future in list(self._loaded.items()):
+            # Calls already running on a kernel keep it until they're done.
+            if future.done() and (
+                excess > 0 or now - self._last_used[tenant] > self.idle
+            ):
+                del self._loaded[tenant]
+                del self._last_used[tenant]
+                excess -= 1
+                self.unloads += 1
+                logger.info(f"Unloaded AIML tenant {tenant}")
+
+    def stats(self) -> t.Dict[str, int]:
+        with self._lock:
+            loaded = sum(future.done() for future in self._loaded.values())
+
+        return {
+            "tenants_loaded": loaded,
+            "tenant_loads": self.loads,
+            "tenant_unloads": self.unloads,
+        }
@@ -0,0 +1,184 @@
+import gzip
+import json
+import queue
+import threading
+import time
+import typing as t
+from datetime import datetime, timezone
+from pathlib import Path
+
+from loguru import logger
+
+# What `record` hands the writer thread: when, guild, user, input, the
+# patterns matched and the seconds it took to answer.
+_Record = t.Tuple[float, t.Any, t.Any, str, t.Sequence[str], float]
+
+_CLOSE = object()
+
+
+class TranscriptWriter:
+    """
+    Keep a transcript of every message answered, written by a thread of its own.
+
+    `record` only puts the turn on a queue of up to `max_queue`, and when the
+    disk falls that far behind the rest are counted as dropped instead of
+    holding up the caller. The thread writes them out as JSON lines in
+    batches of up to `batch_size`, or whatever came in within
+    `flush_interval` seconds, each batch a gzip member of its own. Those
+    are appended to a segment until it reaches `segment_size` bytes, and a
+    new one is started, keeping only the `keep` most recent (0 keeps all).
+
+    A segment is a valid gzip file at any point, so it can be read while
+    it's written to, and `Replay.from_file` of `bot.bench.workload` replays
+    them, or a whole directory of them.
+    """
+
+    def __init__(
+        self,
+        directory: t.Union[str, Path],
+        max_queue: int = 10000,
+        batch_size: int = 256,
+        flush_interval: float = 1.0,
+        segment_size: int = 64 * 2**20,
+        keep: int = 0,
+    ) -> None:
+        self.directory = Path(directory)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.segment_size = segment_size
+        self.keep = keep
+
+        self.records = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        self.segments = 0
+
+        self._queue: "queue.Queue[t.Any]" = queue.Queue(max_queue)
+        self._segment: t.Optional[t.BinaryIO] = None
+        self._closed = False
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._thread = threading.Thread(
+            target=self._run, name="transcript-writer", daemon=True
+        )
+        self._thread.start()
+
+    def record(
+        self,
+        guild: t.Any,
+        user: t.Any,
+        input_: str,
+        patterns: t.Sequence[str],
+        latency: float,
+    ) -> None:
+        """Add a turn to the transcript, unless the queue is full or closed."""
+        if self._closed:
+            return
+
+        try:
+            self._queue.put_nowait(
+                (time.time(), guild, user, input_, patterns, latency)
+            )
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self) -> None:
+        """Write out what is queued and stop the thread."""
+        if self._closed:
+            return
+
+        self._closed = True
+        self._queue.put(_CLOSE)
+        self._thread.join()
+
+    def _run(self) -> None:
+        closing = False
+        while not closing:
+            batch = []
+            item = self._queue.get()
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is _CLOSE:
+                    closing = True
+                    break
+
+                batch.append(item)
+                remaining = deadline - time.monotonic()
+                if len(batch) >= self.batch_size or remaining <= 0:
+                    break
+
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+
+            if batch:
+                self._write(batch)
+
+        if self._segment is not None:
+            self._segment.close()
+
+    def _write(self, batch: t.List[_Record]) -> None:
+        lines = "".join(
+            json.dumps(
+                {
+                    "ts": round(timestamp, 3),
+                    "guild": guild,
+                    "user": user,
+                    "input": input_,
+                    "patterns": list(patterns),
+                    "latency": round(latency, 6),
+                },
+                ensure_ascii=False,
+                separators=(",", ":"),
+            )
+            + "\n"
+            for timestamp, guild, user, input_, patterns, latency in batch
+        )
+
+        try:
+            segment = self._segment
+            if segment is None or segment.tell() >= self.segment_size:
+                segment = self._rotate()
+
+            segment.write(gzip.compress(lines.encode("utf-8"), compresslevel=6))
+            segment.flush()
+        except (OSError, TypeError, ValueError) as exc:
+            logger.error(f"Failed to write {len(batch)} transcript records: {exc}")
+            self.failed += len(batch)
+            return
+
+        self.records += len(batch)
+        self.batches += 1
+
+    def _rotate(self) -> t.BinaryIO:
+        if self._segment is not None:
+            self._segment.close()
+            self._segment = None
+
+        # Named after when they were started, so they sort in order.
+        name = datetime.now(timezone.utc).strftime("transcript-%Y%m%d-%H%M%S-%f")
+        self._segment = open(self.directory / f"{name}.jsonl.gz", "ab")
+        self.segments += 1
+
+        if self.keep > 0:
+            for old in transcript_segments(self.directory)[: -self.keep]:
+                old.unlink()
+
+        return self._segment
+
+    def stats(self) -> t.Dict[str, int]:
+        return {
+            "transcript_records": self.records,
+            "transcript_dropped": self.dropped,
+            "transcript_failed": self.failed,
+            "transcript_queued": self._queue.qsize(),
+            "transcript_batches": self.batches,
+            "transcript_segments": self.segments,
+        }
+
+
+def transcript_segments(directory: t.Union[str, Path]) -> t.List[Path]:
+    """The segments of the transcript in `directory`, oldest first."""
+    return sorted(Path(directory).glob("transcript-*.jsonl.gz"))
@@ -0,0 +1,84 @@
+import gc
+import sys
+import typing as t
+from collections import deque
+from contextlib import contextmanager
+
+
+@contextmanager
+def paused_gc() -> t.Iterator[None]:
+    """
+    Disable the cyclic garbage collector for the duration of the block.
+
+    Building the brain allocates millions of small dicts and lists, none of
+    which form garbage cycles, so letting the collector rescan them over and
+    over only slows loading down.
+    """
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if was_enabled:
+            gc.enable()
+
+
+def deep_size(obj: t.Any, seen: t.Set[int]) -> int:
+    """
+    Bytes taken up by `obj` and everything in the containers within it.
+
+    Objects whose ID is in `seen` are skipped and the rest are added to it,
+    so an object shared by several of the measured ones is only counted once.
+    """
+    size = 0
+    stack = [obj]
+
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+            stack.extend(obj)
+
+    return size
+
+
+class TokenBucket:
+    """
+    Allow `rate` events per second on average, and up to `burst` at once.
+
+    The bucket refills continuously and starts out full. Times are those of
+    `time.monotonic`.
+    """
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float, now: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def refill(self, now: float) -> float:
+        """Top the tokens up, returning how many there are."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+    def take(self, now: float) -> bool:
+        """Take a token if there is one, returning whether there was."""
+        if self.refill(now) < 1:
+            return False
+
+        self.tokens -= 1
+        return True
+
+    def wait(self, now: float) -> float:
+        """Seconds until there is a token to take."""
+        return max(0.0, (1 - self.refill(now)) / self.rate)
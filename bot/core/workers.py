@@ -0,0 +1,406 @@
+import bisect
+import gc
+import hashlib
+import itertools
+import multiprocessing
+import os
+import pickle
+import signal
+import threading
+import typing as t
+from concurrent.futures import Future
+from multiprocessing import reduction
+from multiprocessing.connection import Connection
+
+from loguru import logger
+
+
+class WorkerDied(Exception):
+    """Raised for calls that were routed to a worker process that exited."""
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(value.encode(), digest_size=8).digest(), "big"
+    )
+
+
+class HashRing:
+    """Consistent hash ring mapping arbitrary keys onto `nodes` slots."""
+
+    def __init__(self, nodes: int, replicas: int = 64) -> None:
+        points = sorted(
+            (_hash(f"{node}:{replica}"), node)
+            for node in range(nodes)
+            for replica in range(replicas)
+        )
+        self._points = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def route(self, key: t.Any) -> int:
+        index = bisect.bisect(self._points, _hash(str(key))) % len(self._points)
+        return self._nodes[index]
+
+
+def _worker_main(target: t.Any, connection: Connection) -> None:
+    """Serve method calls on the forked `target` until the parent hangs up."""
+    # Interrupts are handled by the parent, which shuts the workers down itself.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    target.workers = None
+
+    try:
+        _serve(target, connection)
+    finally:
+        close = getattr(target, "close", None)
+        if close is not None:
+            close()
+
+
+def _serve(target: t.Any, connection: Connection) -> None:
+    while True:
+        try:
+            message = connection.recv()
+        except (EOFError, OSError):
+            break
+
+        if message is None:
+            break
+
+        request_id, method, args = message
+        try:
+            reply = (request_id, True, getattr(target, method)(*args))
+        except Exception as exc:
+            reply = (request_id, False, exc)
+
+        try:
+            connection.send(reply)
+        except (pickle.PicklingError, TypeError, AttributeError) as exc:
+            connection.send((request_id, False, RuntimeError(repr(exc))))
+
+
+def _zygote_main(target: t.Any, control: Connection) -> None:
+    """
+    Fork a worker for each pipe end the parent sends over `control`.
+
+    The zygote never starts a thread, so unlike the parent, where the
+    inference, flush and metrics threads may hold a lock at any moment, it
+    can always fork safely.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Workers are reaped as they exit, the parent notices by their pipes.
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    target.workers = None
+
+    while True:
+        try:
+            message = control.recv()
+        except (EOFError, OSError):
+            break
+
+        if message is None:
+            break
+
+        command, args = message
+        try:
+            if command == "spawn":
+                reply = _fork_worker(target, control, reduction.recv_handle(control))
+            elif command == "call":
+                method, *rest = args
+                reply = getattr(target, method)(*rest)
+                # Whatever it loaded is shared with the workers forked next.
+                gc.freeze()
+            else:
+                raise ValueError(f"Unknown zygote command {command!r}")
+        except Exception as exc:
+            control.send((False, exc))
+        else:
+            control.send((True, reply))
+
+    os._exit(0)
+
+
+def _fork_worker(target: t.Any, control: Connection, handle: int) -> int:
+    pid = os.fork()
+    if pid:
+        os.close(handle)
+        return pid
+
+    code = 0
+    try:
+        control.close()
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        _worker_main(target, Connection(handle))
+    except BaseException:
+        logger.exception("AIML worker crashed")
+        code = 1
+    finally:
+        os._exit(code)
+
+
+class _Zygote:
+    """
+    A process forked once from the quiescent, loaded skill, that forks the
+    workers from then on.
+    """
+
+    def __init__(self, target: t.Any) -> None:
+        context = multiprocessing.get_context("fork")
+        self.control, child_control = context.Pipe()
+        self.process = context.Process(
+            target=_zygote_main,
+            args=(target, child_control),
+            name="aiml-worker-zygote",
+            daemon=True,
+        )
+        self.process.start()
+        child_control.close()
+
+        self._lock = threading.Lock()
+
+    def _request(
+        self, command: str, *args: t.Any, handle: t.Optional[int] = None
+    ) -> t.Any:
+        with self._lock:
+            self.control.send((command, args))
+            if handle is not None:
+                reduction.send_handle(self.control, handle, self.process.pid)
+            ok, value = self.control.recv()
+
+        if not ok:
+            raise value
+        return value
+
+    def call(self, method: str, *args: t.Any) -> t.Any:
+        """Call `method(*args)` on the zygote's copy of the target."""
+        return self._request("call", method, *args)
+
+    def spawn(self, index: int) -> "_Worker":
+        """A new worker, serving calls over a pipe of its own."""
+        parent_connection, child_connection = multiprocessing.Pipe()
+        try:
+            pid = self._request("spawn", handle=child_connection.fileno())
+        finally:
+            child_connection.close()
+
+        return _Worker(index, pid, parent_connection)
+
+    def close(self, timeout: float) -> None:
+        with self._lock:
+            try:
+                self.control.send(None)
+            except OSError:
+                pass
+
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.control.close()
+
+
+class _Worker:
+    def __init__(self, index: int, pid: int, connection: Connection) -> None:
+        self.index = index
+        self.pid = pid
+        self.connection = connection
+
+        self._lock = threading.Lock()
+        self._pending: t.Dict[int, Future] = {}
+        self._request_ids = itertools.count()
+        self._closed = False
+
+        self._reader = threading.Thread(
+            target=self._read_replies, name=f"aiml-worker-{index}-reader", daemon=True
+        )
+        self._reader.start()
+
+    def submit(self, method: str, args: tuple) -> Future:
+        future = Future()
+
+        with self._lock:
+            if self._closed:
+                future.set_exception(WorkerDied(f"AIML worker {self.index} is down"))
+                return future
+
+            request_id = next(self._request_ids)
+            self._pending[request_id] = future
+            try:
+                self.connection.send((request_id, method, args))
+            except OSError as exc:
+                del self._pending[request_id]
+                future.set_exception(WorkerDied(f"AIML worker {self.index}: {exc!r}"))
+
+        return future
+
+    def _read_replies(self) -> None:
+        while True:
+            try:
+                request_id, ok, value = self.connection.recv()
+            except (EOFError, OSError):
+                break
+
+            with self._lock:
+                future = self._pending.pop(request_id)
+
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+        self._fail_pending()
+
+    @property
+    def alive(self) -> bool:
+        return self._reader.is_alive()
+
+    def _fail_pending(self) -> None:
+        with self._lock:
+            self._closed = True
+            pending, self._pending = self._pending, {}
+
+        for future in pending.values():
+            future.set_exception(WorkerDied(f"AIML worker {self.index} exited"))
+
+    def stop(self, timeout: float) -> None:
+        with self._lock:
+            if not self._closed:
+                try:
+                    self.connection.send(None)
+                except OSError:
+                    pass
+
+        # The reader drains the replies to calls that were still queued,
+        # until the worker hangs up.
+        self._reader.join(timeout)
+        if self._reader.is_alive():
+            try:
+                os.kill(self.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+            self._reader.join()
+
+        self.connection.close()
+        self._fail_pending()
+
+
+class KernelWorkerPool:
+    """
+    Fork `processes` copies of an already loaded AIML skill and route calls to them.
+
+    The brain is loaded once in the parent and shared copy-on-write with the
+    forked workers. Calls are routed by key (the user ID) on a consistent hash
+    ring, so a user's session predicates always live in the same worker, and
+    workers that exit are restarted in the same slot.
+
+    The pool has to be created while the calling process runs no other
+    thread, at startup. It forks a zygote then, which forks every worker,
+    restarted ones included, so none is ever forked while a lock is held.
+
+    With `collect` as `(method, callback)`, workers replaced by `reload` are
+    called `method` last, and `callback` is given what they return, to keep
+    what they gathered. Workers that crashed take theirs with them.
+    """
+
+    def __init__(
+        self,
+        target: t.Any,
+        processes: int,
+        monitor_interval: float = 1.0,
+        collect: t.Optional[t.Tuple[str, t.Callable[[t.Any], None]]] = None,
+    ) -> None:
+        self.target = target
+        self.processes = processes
+        self.collect = collect
+        self.restarts = 0
+
+        self._ring = HashRing(processes)
+        self._closing = threading.Event()
+        # Held while workers are replaced, by the monitor or `reload`.
+        self._lock = threading.Lock()
+
+        # Move everything loaded so far, the brain included, out of the
+        # collector's generations so the workers' GC passes don't write to
+        # (and thereby copy) the shared pages.
+        gc.freeze()
+        self._zygote = _Zygote(target)
+        self._workers = [self._zygote.spawn(index) for index in range(processes)]
+
+        self._monitor = threading.Thread(
+            target=self._monitor_workers,
+            args=(monitor_interval,),
+            name="aiml-worker-monitor",
+            daemon=True,
+        )
+        self._monitor.start()
+
+        logger.info(f"Started {processes} AIML worker processes")
+
+    def _monitor_workers(self, interval: float) -> None:
+        while not self._closing.wait(interval):
+            with self._lock:
+                self._restart_exited()
+
+    def _restart_exited(self) -> None:
+        for index, worker in enumerate(self._workers):
+            if worker.alive or self._closing.is_set():
+                continue
+
+            logger.warning(
+                f"AIML worker {index} (pid {worker.pid}) exited, restarting it"
+            )
+            worker.stop(timeout=0)
+            try:
+                self._workers[index] = self._zygote.spawn(index)
+            except (EOFError, OSError) as exc:
+                logger.error(f"Could not restart AIML worker {index}: {exc!r}")
+                continue
+            self.restarts += 1
+
+    def reload(self, method: str, *args: t.Any, timeout: float = 5.0) -> t.Any:
+        """
+        Have the zygote call `method(*args)` on its copy of the target, to
+        load the new brain, and replace every worker by one forked from it.
+        Returns what the call did.
+
+        Calls keep going to the old workers until the new ones are all up,
+        and those already sent to them are answered before they stop.
+        """
+        with self._lock:
+            result = self._zygote.call(method, *args)
+            workers = [self._zygote.spawn(index) for index in range(self.processes)]
+            old_workers, self._workers = self._workers, workers
+
+        for worker in old_workers:
+            self._retire(worker, timeout)
+
+        return result
+
+    def _retire(self, worker: _Worker, timeout: float) -> None:
+        if self.collect is None:
+            worker.stop(timeout)
+            return
+
+        method, callback = self.collect
+        # Queued after every call already sent to it, so it misses none.
+        future = worker.submit(method, ())
+        worker.stop(timeout)
+        try:
+            callback(future.result())
+        except WorkerDied:
+            logger.warning(f"AIML worker {worker.index} exited before {method}")
+
+    def call(self, key: t.Any, method: str, *args: t.Any) -> Future:
+        """Call `method(*args)` on the worker that owns `key`."""
+        return self._workers[self._ring.route(key)].submit(method, args)
+
+    def broadcast(self, method: str, *args: t.Any) -> t.List[Future]:
+        """Call `method(*args)` on every worker."""
+        return [worker.submit(method, args) for worker in self._workers]
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Stop the workers once they have answered the calls already queued."""
+        self._closing.set()
+
+        for worker in self._workers:
+            worker.stop(timeout)
+        self._zygote.close(timeout)
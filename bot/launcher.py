@@ -0,0 +1,123 @@
+"""
+Run the bot's shards over several processes, or clusters.
+
+`AutoShardedBot` runs every shard in one process, where decoding the
+gateway events and answering the messages of all of them share a core.
+This splits the shards into contiguous ranges, one per cluster, and:
+
+- loads the AIML brain once, before forking the clusters, so they share
+  it copy-on-write,
+- staggers the clusters' start so their shards identify one after another,
+- restarts clusters that crash, from the same brain,
+- passes the stats of every cluster on to the others, for `sudo stats`
+  and `sudo shards`.
+
+    python -m bot.launcher [--clusters N] [--shards N]
+"""
+
+import argparse
+import asyncio
+import os
+import signal
+import sys
+import time
+import typing as t
+from multiprocessing.connection import Connection
+
+from loguru import logger
+
+from bot import Bot, config
+from bot.__main__ import TOKEN, create_bot
+from bot.core.aiml_skill import AIMLSkill
+from bot.core.cluster import (
+    ClusterLaunchError,
+    ClusterLink,
+    ClusterSupervisor,
+    identify_delay,
+    recommended_shards,
+    shard_ranges,
+)
+
+
+def run_cluster(
+    skill: AIMLSkill,
+    ranges: t.List[t.List[int]],
+    shard_count: int,
+    cluster_id: int,
+    connection: Connection,
+    delay: float,
+) -> None:
+    """Run the bot for one cluster's shards, in the process forked for it."""
+    # The launcher shuts the clusters down itself, with SIGTERM, which the
+    # bot handles once it runs, and its handlers weren't meant for here.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    # The launcher's loop was closed before forking.
+    asyncio.set_event_loop(asyncio.new_event_loop())
+
+    if delay:
+        logger.info(f"Cluster {cluster_id} connecting in {delay:.0f}s")
+        time.sleep(delay)
+
+    skill.use_session_store(Bot.session_store(cluster_id))
+    if config.aiml_worker_processes > 0:
+        skill.start_workers(config.aiml_worker_processes)
+
+    bot = create_bot(
+        shard_ids=ranges[cluster_id],
+        shard_count=shard_count,
+        cluster_id=cluster_id,
+        cluster_count=len(ranges),
+        cluster_link=ClusterLink(cluster_id, connection),
+        aiml_kernel=skill,
+    )
+    bot.run(TOKEN)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--clusters", type=int, default=config.cluster_count, help="0 for each core"
+    )
+    parser.add_argument(
+        "--shards", type=int, default=config.shard_count, help="0 asks Discord"
+    )
+    args = parser.parse_args()
+
+    if not TOKEN:
+        logger.critical("Missing Bot Token!")
+        return 1
+
+    shard_count, max_concurrency = args.shards, 1
+    if shard_count <= 0:
+        try:
+            shard_count, max_concurrency = asyncio.run(recommended_shards(TOKEN))
+        except (ClusterLaunchError, OSError) as exc:
+            logger.critical(f"Could not get the shard count from Discord: {exc!r}")
+            return 1
+
+    cluster_count = min(args.clusters or os.cpu_count() or 1, shard_count)
+    ranges = shard_ranges(shard_count, cluster_count)
+    logger.info(
+        f"Running {shard_count} shards over {cluster_count} clusters: "
+        + ", ".join(f"{shards[0]}-{shards[-1]}" for shards in ranges)
+    )
+
+    # Workers are forked by each cluster, as they don't survive a fork.
+    skill = Bot.load_aiml_skill(worker_processes=0)
+
+    supervisor = ClusterSupervisor(
+        lambda cluster_id, connection, delay: run_cluster(
+            skill, ranges, shard_count, cluster_id, connection, delay
+        ),
+        cluster_count,
+        start_delay=identify_delay(len(ranges[0]), max_concurrency),
+        restart_delay=config.cluster_restart_delay,
+    )
+    supervisor.run()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())